@@ -0,0 +1,205 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ledger import Ledger
+
+# Порог робастной z-оценки (Иглевич - Хоглин): |z| выше - выброс
+Z_LIMIT = 3.5
+# Разброс не считается меньше этой доли типичного значения: иначе ровная история
+# (записи по 8 ч, итоги 152, 152, 152) делала бы выбросом любое отклонение на час
+MIN_SPREAD_SHARE = 0.1
+# Доля часов, перешедшая между активностями или проектами по сравнению с историей
+MIX_SHIFT_LIMIT = 0.5
+# Прошлых загрузок с часами сущности, нужных для сравнения итогов с ее историей
+MIN_HISTORY = 2
+# Проверки: сущность, по которой ищется отклонение, и разрез структуры часов
+ENTRY_CHECKS = ['Employee']
+TOTAL_CHECKS = ['Employee', 'Project_No']
+MIX_CHECKS = [('Employee', 'Activity'), ('Employee', 'Project_No')]
+KINDS = {
+    'entry': 'Часы записи',
+    'total': 'Часы за загрузку',
+    'mix': 'Смена структуры часов'
+}
+REPORT_COLUMNS = ['Kind', 'Entity', 'Name', 'Detail', 'Hours', 'Baseline', 'Score', 'Row']
+# Поля записи в подробностях выброса
+ENTRY_DETAIL = ['Project_No', 'Activity', 'Staff_Comment']
+
+
+def batch_ids(store):
+    """Номер пакета загрузки для каждой строки хранилища (строки дописываются пакетами по журналу)"""
+    added = [batch['added'] for batch in Ledger.open(store.path).batches]
+    if sum(added) != len(store):
+        # Журнал не соответствует хранилищу - вся история считается одним пакетом
+        return np.zeros(len(store), dtype=np.int64), 1
+    return np.repeat(np.arange(len(added)), added), len(added)
+
+
+def _spread(deviations, typical):
+    """Масштаб отклонений по MAD, но не меньше MIN_SPREAD_SHARE типичного значения"""
+    return np.maximum(deviations / 0.6745, MIN_SPREAD_SHARE * np.abs(typical))
+
+
+def _group_medians(values, groups, n_groups):
+    """Медиана values в каждой группе одной сортировкой (NaN для пустых групп)"""
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    low = offsets + np.maximum(counts - 1, 0) // 2
+    high = offsets + counts // 2
+    medians = np.full(n_groups, np.nan)
+    present = counts > 0
+    medians[present] = (sorted_values[low[present]] + sorted_values[np.minimum(high, len(values) - 1)[present]]) / 2
+    return medians
+
+
+def entry_outliers(store, col, batches, latest):
+    """Записи последнего пакета, часы которых намного выше обычных записей той же сущности"""
+    codes = np.asarray(store.codes[col])
+    hours = np.asarray(store.values['Hours'], dtype=np.float64)
+    n_groups = len(store.dictionaries[col])
+    medians = _group_medians(hours, codes, n_groups)
+    deviations = _group_medians(np.abs(hours - medians[codes]), codes, n_groups)
+    scores = (hours - medians[codes]) / _spread(deviations, medians)[codes]
+    rows = np.flatnonzero((batches == latest) & (scores > Z_LIMIT))
+    # Декодируются только найденные строки
+    details = [store.dictionaries[field][np.asarray(store.codes[field])[rows]] for field in ENTRY_DETAIL]
+    return pd.DataFrame({
+        'Kind': 'entry',
+        'Entity': col,
+        'Name': store.dictionaries[col][codes[rows]],
+        'Detail': [' · '.join(str(v) for v in values if v) for values in zip(*details)],
+        'Hours': hours[rows],
+        'Baseline': medians[codes[rows]],
+        'Score': scores[rows],
+        'Row': rows
+    })
+
+
+def total_outliers(store, col, batches, n_batches):
+    """Сущности, чьи часы в последнем пакете далеко от их же часов в прошлых пакетах"""
+    if n_batches <= MIN_HISTORY:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    codes = np.asarray(store.codes[col])
+    n_groups = len(store.dictionaries[col])
+    totals = np.bincount(codes * n_batches + batches, weights=np.asarray(store.values['Hours']),
+                         minlength=n_groups * n_batches).reshape(n_groups, n_batches)
+    # Пакет без часов сущности - ее отсутствие, а не ноль часов
+    history = np.where(totals[:, :-1] > 0, totals[:, :-1], np.nan)
+    latest = totals[:, -1]
+    enough = (np.sum(~np.isnan(history), axis=1) >= MIN_HISTORY) & (latest > 0)
+    # Сущности без истории дают пустые срезы - они отброшены маской enough
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = np.nanmedian(history, axis=1)
+        deviations = np.nanmedian(np.abs(history - medians[:, None]), axis=1)
+        scores = (latest - medians) / _spread(deviations, medians)
+    flagged = np.flatnonzero(enough & (np.abs(scores) > Z_LIMIT))
+    return pd.DataFrame({
+        'Kind': 'total',
+        'Entity': col,
+        'Name': store.dictionaries[col][flagged],
+        'Detail': '',
+        'Hours': latest[flagged],
+        'Baseline': medians[flagged],
+        'Score': scores[flagged],
+        'Row': -1
+    })
+
+
+def mix_shifts(store, col, by, batches, n_batches):
+    """Сущности, у которых распределение часов по by в последнем пакете ушло от истории.
+
+    Сдвиг - доля часов, которую нужно перенести, чтобы получить прежнюю
+    структуру (половина суммы модулей разностей долей). В подробностях -
+    значение by с наибольшим ростом доли.
+    """
+    if n_batches < 2:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    codes = np.asarray(store.codes[col])
+    by_codes = np.asarray(store.codes[by])
+    n_groups, n_by = len(store.dictionaries[col]), len(store.dictionaries[by])
+    is_latest = (batches == n_batches - 1).astype(np.int64)
+    hours = np.bincount((codes * n_by + by_codes) * 2 + is_latest, weights=np.asarray(store.values['Hours']),
+                        minlength=n_groups * n_by * 2).reshape(n_groups, n_by, 2)
+    history, latest = hours[:, :, 0], hours[:, :, 1]
+    history_total, latest_total = history.sum(axis=1), latest.sum(axis=1)
+    present = (history_total > 0) & (latest_total > 0)
+    with np.errstate(all='ignore'):
+        change = latest / latest_total[:, None] - history / history_total[:, None]
+    shift = np.where(present, np.abs(change).sum(axis=1) / 2, 0.0)
+    flagged = np.flatnonzero(shift > MIX_SHIFT_LIMIT)
+    grown = np.argmax(np.nan_to_num(change[flagged]), axis=1)
+    return pd.DataFrame({
+        'Kind': 'mix',
+        'Entity': col,
+        'Name': store.dictionaries[col][flagged],
+        'Detail': [f"{store.dictionaries[by][g]}: {h / t:.0%} часов (было {p / pt:.0%})" for g, h, t, p, pt in
+                   zip(grown, latest[flagged, grown], latest_total[flagged], history[flagged, grown], history_total[flagged])],
+        'Hours': latest_total[flagged],
+        'Baseline': history_total[flagged],
+        'Score': shift[flagged],
+        'Row': -1
+    })
+
+
+def detect(store):
+    """Все проверки по записям хранилища; последний пакет сравнивается с историей"""
+    batches, n_batches = batch_ids(store)
+    parts = [entry_outliers(store, col, batches, n_batches - 1) for col in ENTRY_CHECKS]
+    parts += [total_outliers(store, col, batches, n_batches) for col in TOTAL_CHECKS]
+    parts += [mix_shifts(store, col, by, batches, n_batches) for col, by in MIX_CHECKS]
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    report = pd.concat(parts, ignore_index=True)[REPORT_COLUMNS]
+    order = np.lexsort((-report['Score'].abs().to_numpy(), report['Kind'].map(list(KINDS).index).to_numpy()))
+    return report.iloc[order].reset_index(drop=True)
+
+
+class Anomalies:
+    """Отчет о выбросах для версии хранилища.
+
+    Считается при загрузке целиком (медианы зависят от всех данных) и
+    сохраняется рядом с хранилищем; пока версия не изменилась, отчет
+    только читается.
+    """
+
+    FILE_NAME = 'anomalies.json'
+
+    def __init__(self, version, report):
+        self.version = version
+        self.report = report
+
+    @classmethod
+    def report_path(cls, store):
+        return os.path.join(store.path, cls.FILE_NAME)
+
+    @classmethod
+    def open(cls, store):
+        """Прочитать отчет хранилища или вернуть None"""
+        path = cls.report_path(store)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['version'], pd.DataFrame(data['report'], columns=REPORT_COLUMNS))
+
+    @classmethod
+    def update(cls, store):
+        """Пересчитать отчет, если он построен для другой версии хранилища"""
+        anomalies = cls.open(store)
+        if anomalies is not None and anomalies.version == store.version:
+            return anomalies
+        anomalies = cls(store.version, detect(store))
+        path = cls.report_path(store)
+        data = {'version': store.version, 'report': anomalies.report.to_dict(orient='list')}
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=lambda v: v.item())
+        os.replace(path + '.tmp', path)
+        return anomalies
@@ -0,0 +1,47 @@
+import os
+import warnings
+
+from sql_store import SqlStore, duckdb
+
+# Источник итогов: pandas (rollups в памяти, по умолчанию), sqlite или duckdb
+BACKEND = os.environ.get('KMGA_BACKEND', 'pandas')
+
+
+class RollupBackend:
+    """Итоги из rollups в памяти процесса; строки выборов - из FilterIndex"""
+
+    def __init__(self, rollups, filter_index=None):
+        self.rollups = rollups
+        self.filter_index = filter_index
+
+    def totals(self, keys, *selections):
+        """Сумма часов по ключам для пересечения выборов, отсортированная по ключам"""
+        rows = self.filter_index.select(*selections) if self.filter_index is not None else None
+        return self.rollups.level(keys, rows)
+
+
+def sql_engine(backend=BACKEND):
+    """Движок базы для бэкенда или None для pandas; без пакета duckdb используется sqlite"""
+    if backend == 'pandas':
+        return None
+    if backend == 'duckdb' and duckdb is None:
+        warnings.warn("Пакет duckdb не установлен, используется sqlite")
+        return 'sqlite'
+    return backend
+
+
+def open_backend(store, rollups, filter_index=None, rows=None, backend=BACKEND):
+    """Источник итогов с общим интерфейсом totals(keys, *selections).
+
+    Для sqlite/duckdb группировки и фильтры выполняются в базе хранилища,
+    rows ограничивает записи (результат поиска); rollups и filter_index
+    тогда не используются. Их можно передать функциями без аргументов -
+    тогда структуры в памяти строятся только для pandas.
+    """
+    engine = sql_engine(backend)
+    if engine is None:
+        rollups = rollups() if callable(rollups) else rollups
+        filter_index = filter_index() if callable(filter_index) else filter_index
+        return RollupBackend(rollups, filter_index)
+    db = SqlStore.update(store, engine)
+    return db if rows is None else db.restrict(rows)
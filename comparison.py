@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+# Что сравнивается и в каком разрезе
+COMPARE_DIMENSIONS = {
+    'Employee': 'Сотрудники',
+    'Project_No': 'Проекты',
+    'Client': 'Клиенты'
+}
+BREAKDOWNS = {
+    'Employee': ['Project_No', 'Activity', 'Client'],
+    'Project_No': ['Employee', 'Activity'],
+    'Client': ['Project_No', 'Employee', 'Activity']
+}
+BREAKDOWN_LABELS = {
+    'Employee': 'по сотрудникам',
+    'Project_No': 'по проектам',
+    'Client': 'по клиентам',
+    'Activity': 'по активностям'
+}
+OTHER_LABEL = 'Другие'
+
+
+def compare_totals(backend, col, members, by, *selections):
+    """Итоги по by для каждого из сравниваемых значений col - одной группировкой.
+
+    Выбор {col: members} добавляется к фильтрам, и итоги по [col, by]
+    считаются одним запросом к источнику итогов, а не отдельным проходом
+    на каждое значение. Фильтр по самой колонке col из selections
+    нужно убрать заранее, иначе пересечение сузит сравнение.
+    """
+    totals = backend.totals([col, by], *selections, {col: list(members)})
+    return totals[[col, by, 'Hours']]
+
+
+def _difference(table, members):
+    hours = table[list(members)]
+    if len(members) == 2:
+        return hours[members[1]] - hours[members[0]]
+    return hours.max(axis=1) - hours.min(axis=1)
+
+
+def comparison_table(totals, col, members, by):
+    """Таблица сравнения: строка - значение by, колонка - значение col, плюс разница.
+
+    Для двух значений разница - второе минус первое, для большего числа -
+    размах (максимум минус минимум). Строки - по убыванию суммы часов.
+    """
+    table = totals.pivot_table(index=by, columns=col, values='Hours', aggfunc='sum', fill_value=0.0)
+    table = table.reindex(columns=list(members), fill_value=0.0)
+    table['Difference'] = _difference(table, members)
+    order = np.argsort(-table[list(members)].sum(axis=1).to_numpy(), kind='stable')
+    return table.iloc[order]
+
+
+def fold_others(table, members, limit):
+    """Первые limit строк таблицы сравнения, остальные - одной строкой OTHER_LABEL"""
+    if len(table) <= limit:
+        return table
+    head = table.iloc[:limit]
+    others = table.iloc[limit:][list(members)].sum().to_frame(OTHER_LABEL).T
+    others['Difference'] = _difference(others, members)
+    return pd.concat([head, others])
+
+
+def deviations(table, members):
+    """Отклонение часов каждого значения от среднего по сравниваемым (для тепловой карты разницы)"""
+    hours = table[list(members)]
+    return hours.sub(hours.mean(axis=1), axis=0)
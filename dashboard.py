@@ -1,8 +1,30 @@
+import html
+import os
+
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import streamlit as st
-import json
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from topk import top_k, page, page_count
+from anomalies import KINDS as ANOMALY_KINDS, Anomalies
+from backend import open_backend, sql_engine
+from comparison import BREAKDOWN_LABELS, BREAKDOWNS, COMPARE_DIMENSIONS, compare_totals, comparison_table, deviations, fold_others
+from ingest import ingest
+from duplicates import DuplicateIndex
+from export import FORMAT_LABELS, FORMATS, available_formats, cleanup_exports, export_path, export_url, frame_chunks, record_chunks, write_export
+from filters import FILTER_COLUMNS, FilterIndex, chart_selection, combine
+from memory import CACHE_TTL, VIEW_CACHE, cached
+from record_store import RecordStore, STORE_DIR
+from rollups import Rollups
+from schema import StarSchema
+from shadow import SHADOW, shadowed
+from snapshots import SnapshotStore, diff, summary
+from text_index import TextIndex
+from treemap import build_hierarchy
+from utilization import CAPACITY_HOURS, UTILIZATION_KEYS, team_summary, utilization, utilization_totals
+from validation import QUARANTINE_PATH, RECORD_COLUMNS
+from warmup import Warmup, quiet
 
 # Настройка страницы
 st.set_page_config(
@@ -49,58 +71,1162 @@ THEMES = {
         "border": "#e2e8f0",
         "primary": "#d69e2e",
         "colors": ['#d69e2e', '#e6b84f', '#f6ad55', '#fbd38d', '#fef5e7', '#b7791f']
+    },
+    "Современный": {
+        "bg": "#ffffff",
+        "card": "#f8f9fa",
+        "text": "#212529",
+        "text_light": "#6c757d",
+        "border": "#e9ecef",
+        "primary": "#4A90E2",
+        "colors": ['#4A90E2', '#50C878', '#FF6B6B', '#FFA500', '#9B59B6', '#1ABC9C', '#E74C3C', '#3498DB',
+                   '#F39C12', '#16A085', '#E67E22', '#95A5A6', '#34495E', '#2ECC71', '#8E44AD', '#C0392B', '#D35400']
     }
 }
 
+def add_project_labels(projects):
+    """Метки проектов для списков и графиков - по одной на проект измерения"""
+    # Создаем метки проектов - полные названия для списка
+    projects['Project_Full_Name'] = (
+        projects['Client'] + ' - ' + 
+        projects['Project_No'] + ' | ' + 
+        projects['Project_Description']
+    )
+    
+    # Короткая метка для графиков
+    projects['Project_Label'] = (
+        projects['Client'] + ' - ' + 
+        projects['Project_No']
+    )
+    return projects
+
+# Ограничения кешей Streamlit: версий данных и поисковых запросов в памяти.
+# Виды (итоги по фильтрам, таблицы, фигуры) - в кеше видов с бюджетом памяти (memory.py)
+VERSION_ENTRIES = 2
+QUERY_ENTRIES = int(os.environ.get('KMGA_QUERY_ENTRIES', 16))
+SNAPSHOT_ENTRIES = 8
+
+def session_owner():
+    """Id сессии Streamlit - владелец записей кеша видов (None вне сессии, например при прогреве)"""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+VIEW_CACHE.owner = session_owner
+
 # Загрузка данных с правильной агрегацией
-@st.cache_data
+@st.cache_data(max_entries=1)
 def load_data():
     """Загрузка и предобработка данных с исправленной агрегацией"""
-    with open('data.json', 'r', encoding='utf-8') as f:
-        raw = json.load(f)
+    # Проверка и идемпотентная загрузка пакета: повторно присланные записи не попадают в хранилище
+    store, data_version = ingest()
     
-    df = pd.DataFrame(raw['data'])
+    # Широкая таблица из звезды: факты по путям иерархии, метки - из измерения проектов
+    df_aggregated = load_star(data_version, '').wide()
+    VIEW_CACHE.pin('load_data', df_aggregated)
     
-    # Фильтруем только положительные часы
-    df = df[df['Hours'] > 0].copy()
+    return df_aggregated, data_version
+
+@cached()
+def load_top_totals(version, query, filters):
+    """Итоги по проектам и сотрудникам для выбранных фильтров (считаются один раз).
+
+    filters - пересечение фильтров sidebar и выбора на графике (combine), чтобы
+    одинаковый выбор при разных типах графика попадал в одну запись кеша.
+    """
+    backend = load_backend(version, query)
+    project_totals = load_star(version, query).attach(backend.totals(['Project_No'], filters), 'Project')
+    employee_totals = backend.totals(['Employee'], filters)
+    return project_totals, employee_totals
+
+@st.cache_resource(max_entries=QUERY_ENTRIES, ttl=CACHE_TTL)
+def load_filter_index(version, query):
+    """Множества строк по значениям фильтров (строятся по кодам путей один раз на данные и поисковый запрос)"""
+    return FilterIndex.from_rollups(load_rollups(version, query))
+
+@st.cache_resource(max_entries=VERSION_ENTRIES)
+def load_store(version):
+    """Колоночное хранилище записей (открывается один раз на версию данных)"""
+    return RecordStore(STORE_DIR)
+
+@st.cache_data(max_entries=VERSION_ENTRIES)
+def load_duplicates(version):
+    """Повторяющиеся исходные записи по счетчикам хешей, посчитанным при загрузке"""
+    store = load_store(version)
+    duplicates = DuplicateIndex.open(store)
+    return duplicates.report(store, 'exact'), duplicates.report(store, 'near')
+
+@st.cache_data(max_entries=VERSION_ENTRIES)
+def load_anomalies(version):
+    """Отчет о выбросах, посчитанный при загрузке этой версии данных"""
+    return Anomalies.update(load_store(version)).report
+
+@st.cache_data(max_entries=VERSION_ENTRIES)
+def load_quarantine(version):
+    """Записи, отклоненные проверкой при загрузке (файла нет, если выгрузка не разбиралась заново)"""
+    if not os.path.exists(QUARANTINE_PATH):
+        return pd.DataFrame(columns=['Row'] + RECORD_COLUMNS + ['Reason'])
+    return pd.read_csv(QUARANTINE_PATH)
+
+@st.cache_resource(max_entries=VERSION_ENTRIES)
+def load_text_index(version):
+    """Поисковый индекс по комментариям и описаниям проектов"""
+    return TextIndex.open(load_store(version))
+
+@st.cache_resource(max_entries=QUERY_ENTRIES, ttl=CACHE_TTL)
+def load_rollups(version, query):
+    """Итоги уровней иерархии (материализуются один раз на данные и поисковый запрос)"""
+    if query:
+        # Итоги найденных строк - одним bincount по номерам путей; уровни считаются по мере запросов
+        return load_rollups(version, '').restrict(load_text_index(version).search(query))
+    return Rollups.open(load_store(version)).materialize()
+
+@st.cache_resource(max_entries=QUERY_ENTRIES, ttl=CACHE_TTL)
+def load_backend(version, query):
+    """Источник итогов: rollups в памяти или встроенная база (переменная окружения KMGA_BACKEND).
+
+    При KMGA_SHADOW_PERCENT > 0 часть вызовов totals() сверяется с эталоном pandas по выгрузке (shadow.py)
+    """
+    rows = load_text_index(version).search(query) if query else None
+    store = load_store(version)
+    # Итоги и индекс фильтров в памяти нужны только pandas: для базы они не строятся
+    backend = open_backend(store, lambda: load_rollups(version, query), lambda: load_filter_index(version, query), rows)
+    return shadowed(backend, store, rows)
+
+def shadow_check(version, query, name, frame, keys, *selections):
+    """Сверка таблицы, отобранной индексом фильтров, с эталоном pandas (часть вызовов при KMGA_SHADOW_PERCENT > 0)"""
+    if SHADOW.sample():
+        rows = load_text_index(version).search(query) if query else None
+        SHADOW.check_frame(name, frame, keys, load_store(version), rows, *selections)
+
+@st.cache_resource(max_entries=QUERY_ENTRIES, ttl=CACHE_TTL)
+def load_star(version, query):
+    """Факты и измерения; метки проектов считаются один раз на проект"""
+    star = StarSchema.from_rollups(load_rollups(version, query))
+    add_project_labels(star.dimensions['Project'])
+    return star
+
+@st.cache_resource(max_entries=VERSION_ENTRIES)
+def load_snapshots(version):
+    """История снимков итогов по загрузкам (перечитывается с новой версией данных)"""
+    return SnapshotStore()
+
+@st.cache_data(max_entries=SNAPSHOT_ENTRIES, ttl=CACHE_TTL)
+def load_snapshot(version):
+    """Итоги по путям из снимка версии данных"""
+    return SnapshotStore().load(version)
+
+@cached()
+def load_changes(before, after, keys, selection, chart_filter):
+    """Изменения часов по ключам между двумя снимками для тех же фильтров"""
+    return diff(load_snapshot(before), load_snapshot(after), list(keys), selection, chart_filter)
+
+@cached()
+def load_utilization(version, query, filters, capacity):
+    """Загрузка сотрудников для фильтров: один проход по итогам путей или одна группировка во встроенной базе"""
+    if sql_engine() is not None:
+        totals = load_backend(version, query).totals(UTILIZATION_KEYS, filters)
+        return utilization_totals(totals, capacity)
+    rows = load_filter_index(version, query).select(filters)
+    result = utilization(load_rollups(version, query), rows, capacity)
+    shadow_check(version, query, 'load_utilization', result, ['Employee'], filters)
+    return result
+
+@cached()
+def load_ranking(version, query, filters, col):
+    """Значения колонки по убыванию часов для фильтров - варианты сравнения"""
+    totals = load_backend(version, query).totals([col], filters)
+    return totals.sort_values('Hours', ascending=False, kind='stable')[col].tolist()
+
+@cached()
+def load_comparison(version, query, filters, col, members, by):
+    """Таблица сравнения значений members колонки col: итоги всех значений - одной группировкой"""
+    totals = compare_totals(load_backend(version, query), col, members, by, filters)
+    return comparison_table(totals, col, list(members), by)
+
+@cached()
+def search_data(query, version):
+    """Агрегаты только по записям, найденным полнотекстовым поиском"""
+    return load_star(version, query).wide()
+
+# Содержимое файла экспорта (ZIP содержит все таблицы)
+EXPORT_CONTENTS = {
+    'summary': 'Сводка: сотрудники, проекты, активности',
+    'records': 'Исходные записи'
+}
+EXPORT_COLUMNS = ['Employee', 'Project_No', 'Project_Full_Name', 'Client', 'Activity', 'Hours']
+
+def prepare_export(version, query, selection, chart_filter, fmt, content):
+    """Файл экспорта: таблицы пишутся по частям при первом запросе, готовый файл переиспользуется.
+
+    После записи удаляются файлы прежних версий данных, устаревшие и самые давние сверх лимита места.
+    """
+    def summary_chunks():
+        df = search_data(query, version) if query else load_data()[0]
+        rows = load_filter_index(version, query).select(selection, chart_filter)
+        summary = (df if rows is None else df.iloc[rows])[EXPORT_COLUMNS]
+        shadow_check(version, query, 'export summary', summary, FILTER_COLUMNS, selection, chart_filter)
+        return frame_chunks(summary)
+
+    def project_chunks():
+        totals = load_backend(version, query).totals(['Project_No'], selection, chart_filter)
+        return frame_chunks(load_star(version, query).attach(totals, 'Project'))
+
+    def employee_chunks():
+        return frame_chunks(load_backend(version, query).totals(['Employee'], selection, chart_filter))
+
+    def records():
+        store = load_store(version)
+        rows = store.select(
+            equals=combine(selection, chart_filter),
+            rows=load_text_index(version).search(query) if query else None
+        )
+        return record_chunks(store, rows)
+
+    tables = {
+        'summary': summary_chunks,
+        'projects': project_chunks,
+        'employees': employee_chunks,
+        'records': records
+    }
+    if fmt != 'zip':
+        tables = {content: tables[content]}
+    path = write_export(export_path(version, (query, selection, chart_filter, fmt, content), fmt), fmt, tables)
+    cleanup_exports(version, keep=path)
+    return path
+
+# Колонки, значения которых передаются в customdata элементов основного графика
+CHART_FILTER_COLUMNS = {
+    'Pie Chart': ['Project_No'],
+    'Bar Chart': ['Employee', 'Project_No'],
+    'Line Chart': ['Project_No'],
+    'Heatmap': ['Employee', 'Project_No'],
+    'Treemap': ['Client', 'Project_No', 'Employee', 'Activity'],
+    'Utilization': ['Employee']
+}
+
+@cached()
+def build_main_chart(version, query, chart_type, selection, theme_name, treemap_activity=False, capacity=CAPACITY_HOURS):
+    """Основной график по фильтрам sidebar (фигура строится один раз на вид и переиспользуется сессиями)"""
+    theme = THEMES[theme_name]
+    # Строится по фильтрам sidebar без выбора на графике, чтобы выбранный элемент оставался на нем виден;
+    # итоги уровней - из rollups в памяти или запросами к встроенной базе
+    backend = load_backend(version, query)
+    star = load_star(version, query)
+    if chart_type == 'Pie Chart':
+        # Pie Chart с часами и процентами
+        proj_sum = star.attach(backend.totals(['Project_No'], selection), 'Project')
+        proj_sum = proj_sum.sort_values('Hours', ascending=False)
+        all_projects = proj_sum['Project_No']
     
-    # Очистка данных
-    df['Employee'] = df['Employee'].str.strip()
-    df['Project_No'] = df['Project_No'].str.strip()
-    df['Client'] = df['Client'].str.strip()
-    df['Activity'] = df['Activity'].str.strip()
-    df['Project_Description'] = df['Project_Description'].str.strip()
+        # Группируем маленькие проекты
+        if len(proj_sum) > 10:
+            top_10 = proj_sum.head(10)
+            others = proj_sum.tail(len(proj_sum) - 10)
+            others_sum = others['Hours'].sum()
+            if others_sum > 0:
+                top_10 = pd.concat([top_10, pd.DataFrame([{
+                    'Project_No': 'OTHER',
+                    'Project_Label': 'Другие проекты',
+                    'Hours': others_sum
+                }])], ignore_index=True)
+            proj_sum = top_10
     
-    # Исправленная агрегация
-    df_aggregated = df.groupby([
-        'Employee', 
-        'Project_No', 
-        'Client', 
-        'Activity', 
-        'Project_Description'
-    ])['Hours'].sum().reset_index()
+        # Срез "Другие проекты" выбирает все свернутые в него проекты
+        shown_projects = proj_sum['Project_No'][proj_sum['Project_No'] != 'OTHER']
+        other_projects = all_projects[~all_projects.isin(shown_projects)].tolist()
+        pie_customdata = [[other_projects if no == 'OTHER' else no] for no in proj_sum['Project_No']]
     
-    # Создаем метки проектов - полные названия для списка
-    df_aggregated['Project_Full_Name'] = (
-        df_aggregated['Client'] + ' - ' + 
-        df_aggregated['Project_No'] + ' | ' + 
-        df_aggregated['Project_Description']
-    )
+        fig = go.Figure(data=[go.Pie(
+            labels=proj_sum['Project_Label'],
+            values=proj_sum['Hours'],
+            customdata=pie_customdata,
+            hole=0.5,
+            textinfo='label+percent+value',
+            texttemplate='%{label}<br>%{value:,.0f} ч<br>(%{percent})',
+            textposition='outside',
+            textfont=dict(size=10, color=theme['text']),
+            marker=dict(
+                colors=theme['colors'][:len(proj_sum)],
+                line=dict(color=theme['bg'], width=2)
+            ),
+            hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>',
+            rotation=90
+        )])
     
-    # Короткая метка для графиков
-    df_aggregated['Project_Label'] = (
-        df_aggregated['Client'] + ' - ' + 
-        df_aggregated['Project_No']
-    )
+        fig.update_layout(
+            title="",
+            template='plotly_white',
+            height=600,
+            showlegend=True,
+            legend=dict(
+                orientation="v",
+                yanchor="middle",
+                y=0.5,
+                xanchor="left",
+                x=1.15,
+                font=dict(size=10, color=theme['text']),
+                bgcolor='rgba(255,255,255,0.95)',
+                bordercolor=theme['border'],
+                borderwidth=1
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=50, r=280, t=30, b=50),
+            font=dict(color=theme['text'])
+        )
+
+    elif chart_type == 'Bar Chart':
+        # Stacked Bar Chart
+        fig = go.Figure()
+    
+        # Итоги сотрудник × проект берутся одним запросом, дальше - срезы по сотрудникам
+        employee_projects = star.attach(backend.totals(['Employee', 'Project_No'], selection), 'Project')
+        for i, (emp, temp) in enumerate(employee_projects.groupby('Employee', sort=True)):
+            fig.add_trace(go.Bar(
+                x=temp['Project_Label'],
+                y=temp['Hours'],
+                name=emp,
+                customdata=[[emp, no] for no in temp['Project_No']],
+                marker_color=theme['colors'][i % len(theme['colors'])],
+                text=[f'{h:,.0f}' for h in temp['Hours']],
+                textposition='outside',
+                textfont=dict(size=9, color=theme['text']),
+                hovertemplate='<b>%{fullData.name}</b><br>Проект: %{x}<br>Часы: %{y:,.0f}<extra></extra>'
+            ))
+    
+        fig.update_layout(
+            title="",
+            xaxis_title="",
+            yaxis_title="Часы",
+            barmode='stack',
+            template='plotly_white',
+            height=650,
+            showlegend=True,
+            legend=dict(
+                orientation="v",
+                yanchor="top",
+                y=1,
+                xanchor="left",
+                x=1.02,
+                font=dict(size=10, color=theme['text']),
+                bgcolor='rgba(255,255,255,0.95)',
+                bordercolor=theme['border'],
+                borderwidth=1
+            ),
+            xaxis=dict(
+                categoryorder='total descending',
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border'],
+                linecolor=theme['border']
+            ),
+            yaxis=dict(
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border'],
+                linecolor=theme['border']
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=60, r=220, t=30, b=120),
+            font=dict(color=theme['text'])
+        )
+
+    elif chart_type == 'Line Chart':
+        # Line Chart: проекты по убыванию часов
+        project_hours_sorted = star.attach(backend.totals(['Project_No'], selection), 'Project')
+        project_hours_sorted = project_hours_sorted.sort_values('Hours', ascending=False)
+        primary_rgb = ', '.join(str(int(theme['primary'][i:i + 2], 16)) for i in (1, 3, 5))
+    
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=project_hours_sorted['Project_Label'],
+            y=project_hours_sorted['Hours'],
+            customdata=project_hours_sorted['Project_No'],
+            mode='lines+markers',
+            name='Часы',
+            line=dict(width=3, color=theme['primary'], shape='spline'),
+            marker=dict(size=10, color=theme['primary'], line=dict(width=2, color=theme['bg'])),
+            fill='tonexty',
+            fillcolor=f'rgba({primary_rgb}, 0.15)',
+            text=[f'{h:,.0f}' for h in project_hours_sorted['Hours']],
+            textposition='top center',
+            textfont=dict(size=9, color=theme['text']),
+            hovertemplate='<b>Проект:</b> %{x}<br><b>Часы:</b> %{y:,.0f}<extra></extra>'
+        ))
+    
+        fig.update_layout(
+            title="",
+            xaxis_title="",
+            yaxis_title="Часы",
+            template='plotly_white',
+            height=550,
+            xaxis=dict(
+                tickangle=-45,
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border'],
+                linecolor=theme['border']
+            ),
+            yaxis=dict(
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border'],
+                linecolor=theme['border']
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            showlegend=False,
+            margin=dict(l=60, r=50, t=30, b=150),
+            font=dict(color=theme['text'])
+        )
+
+    elif chart_type == 'Heatmap':
+        # Heatmap - убираем colorbar из go.Heatmap, используем только showscale
+        pivot_data = star.attach(backend.totals(['Employee', 'Project_No'], selection), 'Project')
+        pivot_table = pivot_data.pivot_table(
+            index='Employee', 
+            columns='Project_Label', 
+            values='Hours', 
+            aggfunc='sum'
+        ).fillna(0)
+    
+        # Ячейка выбирает сотрудника и проект
+        label_projects = dict(zip(pivot_data['Project_Label'], pivot_data['Project_No']))
+        heatmap_customdata = [[[emp, label_projects[label]] for label in pivot_table.columns] for emp in pivot_table.index]
     
-    # Проверка на дубликаты
-    duplicates_check = df_aggregated.duplicated(subset=['Employee', 'Project_No'], keep=False)
-    duplicates_df = df_aggregated[duplicates_check].copy() if duplicates_check.any() else pd.DataFrame()
+        fig = go.Figure(data=go.Heatmap(
+            z=pivot_table.values.tolist(),
+            x=pivot_table.columns.tolist(),
+            y=pivot_table.index.tolist(),
+            customdata=heatmap_customdata,
+            colorscale=[[0, theme['card']], [0.5, theme['colors'][2]], [1, theme['primary']]],
+            text=[[f'{val:.0f}' if val > 0 else '' for val in row] for row in pivot_table.values],
+            texttemplate='%{text}',
+            textfont=dict(size=9, color='white'),
+            hovertemplate='<b>Сотрудник:</b> %{y}<br><b>Проект:</b> %{x}<br><b>Часы:</b> %{z:,.0f}<extra></extra>',
+            showscale=True
+        ))
+    
+        fig.update_layout(
+            title="",
+            xaxis_title="",
+            yaxis_title="",
+            template='plotly_white',
+            height=900,
+            xaxis=dict(
+                side="bottom",
+                tickangle=-45,
+                tickfont=dict(size=9, color=theme['text_light']),
+                gridcolor=theme['border']
+            ),
+            yaxis=dict(
+                autorange="reversed",
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border']
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=150, r=80, t=30, b=200),
+            font=dict(color=theme['text'])
+        )
+
+    elif chart_type == 'Treemap':
+        # Иерархия Клиент → Проект → Сотрудник (→ Активность) строится по кодам уровней, мелкие узлы - в "Другие"
+        treemap_extra = ['Activity'] if treemap_activity else []
+        if sql_engine() is not None:
+            # Листья - одной группировкой в базе, метки проектов - из измерения
+            chart_df = star.attach(backend.totals(['Client', 'Project_No', 'Employee'] + treemap_extra, selection), 'Project')
+        else:
+            # Пересечение предвычисленных множеств строк вместо цепочки масок по копии таблицы
+            df = search_data(query, version) if query else load_data()[0]
+            chart_rows = load_filter_index(version, query).select(selection)
+            chart_df = df if chart_rows is None else df.iloc[chart_rows]
+            shadow_check(version, query, 'chart_df Treemap', chart_df, FILTER_COLUMNS, selection)
+        nodes = build_hierarchy(
+            chart_df,
+            ['Client', 'Project_Label', 'Employee'] + treemap_extra,
+            ['Client', 'Project_No', 'Employee'] + treemap_extra
+        )
+    
+        fig = go.Figure(go.Treemap(
+            ids=nodes['ids'],
+            labels=nodes['labels'],
+            parents=nodes['parents'],
+            values=nodes['values'],
+            customdata=nodes['customdata'],
+            branchvalues='total',
+            marker=dict(
+                colors=nodes['colors'],
+                colorscale=[[0, theme['card']], [0.5, theme['colors'][2]], [1, theme['primary']]],
+                showscale=True
+            )
+        ))
     
-    return df_aggregated, duplicates_df
+        fig.update_layout(
+            template='plotly_white',
+            height=650,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=20, r=20, t=30, b=20),
+            font=dict(color=theme['text'])
+        )
+    
+        fig.update_traces(
+            hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<extra></extra>',
+            textfont=dict(size=11, color='white'),
+            textposition='middle center',
+            texttemplate='%{label}<br>%{value:,.0f} ч',
+            marker=dict(line=dict(color='white', width=2))
+        )
+
+    elif chart_type == 'Utilization':
+        # Часы сотрудников с выставлением счета и без него против нормы; больше всего часов - сверху
+        util = load_utilization(version, query, combine(selection), capacity).sort_values('Hours', kind='stable')
+        util_customdata = [[emp, ratio, share, load] for emp, ratio, share, load in
+                           zip(util['Employee'], util['Chargeable_Ratio'], util['Admin_Share'], util['Utilization'])]
+        fig = go.Figure()
+        for col, name, color in [('Chargeable_Hours', 'Клиентские проекты', theme['primary']),
+                                 ('Non_Chargeable_Hours', 'Без выставления счета', theme['colors'][2])]:
+            fig.add_trace(go.Bar(
+                x=util[col],
+                y=util['Employee'],
+                name=name,
+                orientation='h',
+                customdata=util_customdata,
+                marker_color=color,
+                hovertemplate=('<b>%{y}</b><br>' + name + ': %{x:,.0f} ч<br>Доля клиентских: %{customdata[1]:.0%}'
+                               '<br>Администрирование: %{customdata[2]:.0%}<br>Загрузка: %{customdata[3]:.0%}<extra></extra>')
+            ))
+        fig.add_vline(
+            x=capacity,
+            line=dict(color=theme['text'], width=2, dash='dash'),
+            annotation_text=f"Норма {capacity:,.0f} ч",
+            annotation_font=dict(size=10, color=theme['text'])
+        )
+
+        fig.update_layout(
+            title="",
+            xaxis_title="Часы",
+            yaxis_title="",
+            barmode='stack',
+            template='plotly_white',
+            height=max(450, 22 * len(util) + 120),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="left",
+                x=0,
+                font=dict(size=10, color=theme['text'])
+            ),
+            xaxis=dict(
+                tickfont=dict(size=10, color=theme['text_light']),
+                gridcolor=theme['border'],
+                linecolor=theme['border']
+            ),
+            yaxis=dict(
+                tickfont=dict(size=10, color=theme['text_light'])
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=200, r=50, t=50, b=50),
+            font=dict(color=theme['text'])
+        )
+
+    return fig
+
+# Потоков фонового прогрева кешей (0 - без прогрева)
+WARMUP_WORKERS = int(os.environ.get('KMGA_WARMUP_WORKERS', 2))
+# Кеши вызываются из потоков прогрева без сессии - это ожидаемо
+quiet('streamlit.runtime.scriptrunner_utils.script_run_context')
+
+@st.cache_resource(max_entries=VERSION_ENTRIES)
+def start_warmup(version):
+    """Фоновый прогрев после загрузки данных: вид по умолчанию, затем виды каждого
+    проекта и сотрудника (по убыванию часов) для всех типов графика и тема по умолчанию"""
+    backend = load_backend(version, '')
+    no_filter = {'Project_No': [], 'Employee': [], 'Client': [], 'Activity': []}
+    views = [('по умолчанию', no_filter)]
+    for col, view in [('Project_No', 'проекты'), ('Employee', 'сотрудники')]:
+        totals = backend.totals([col]).sort_values('Hours', ascending=False, kind='stable')
+        views += [(view, {**no_filter, col: [value]}) for value in totals[col]]
+    theme_name = next(iter(THEMES))
+    tasks = []
+    for view, selection in views:
+        tasks.append((view, load_top_totals, (version, '', combine(selection))))
+        for chart_type in CHART_FILTER_COLUMNS:
+            tasks.append((view, build_main_chart, (version, '', chart_type, selection, theme_name, False, CAPACITY_HOURS)))
+    return Warmup(tasks, WARMUP_WORKERS, name=f"Прогрев {version}").start()
+
+def show_main_chart(fig, key, chart_filter):
+    """Основной график: клик по элементу фильтрует KPI, таблицы, записи и экспорт"""
+    st.plotly_chart(
+        fig,
+        use_container_width=True,
+        config={'displayModeBar': False},
+        key=key,
+        on_select='rerun',
+        selection_mode='points'
+    )
+    active = {col: values for col, values in chart_filter.items() if values}
+    if active:
+        st.caption(
+            "🖱️ Фильтр по графику: " + "; ".join(', '.join(values) for values in active.values())
+            + " · двойной щелчок по графику сбрасывает выбор"
+        )
+
+# Разделы страницы - фрагменты: их собственные виджеты перезапускают только
+# сам раздел, а не всю страницу; данные берутся из общих кешей
+
+# Колонки отчета о повторах
+DUPLICATE_COLUMNS = ['Employee', 'Project_No', 'Client', 'Activity', 'Staff_Comment', 'Hours', 'Count', 'Total_Hours']
+
+# Колонки отчета о выбросах
+ANOMALY_COLUMNS = {
+    'Kind': 'Проверка',
+    'Entity': 'Разрез',
+    'Name': 'Значение',
+    'Detail': 'Подробности',
+    'Hours': 'Часы',
+    'Baseline': 'Обычно, ч',
+    'Score': 'Оценка'
+}
+ANOMALY_ENTITIES = {'Employee': 'Сотрудник', 'Project_No': 'Проект'}
+
+@st.fragment
+def data_quality_section(version):
+    """Отчет о загрузке: повторяющиеся и отклоненные проверкой записи"""
+    duplicates_df, near_duplicates_df = load_duplicates(version)
+    if not duplicates_df.empty or not near_duplicates_df.empty:
+        with st.expander("⚠️ Найдены потенциальные дубликаты", expanded=False):
+            st.dataframe(
+                duplicates_df[DUPLICATE_COLUMNS].rename(columns={'Count': 'Повторов', 'Total_Hours': 'Часов всего'}),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.caption(
+                f"Всего найдено {len(duplicates_df)} групп одинаковых исходных записей: "
+                f"{int((duplicates_df['Count'] - 1).sum())} лишних строк"
+            )
+            if not near_duplicates_df.empty:
+                st.markdown("**Почти одинаковые записи** (комментарий отличается регистром или пунктуацией)")
+                st.dataframe(
+                    near_duplicates_df[DUPLICATE_COLUMNS].rename(columns={'Count': 'Повторов', 'Total_Hours': 'Часов всего'}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+    # Выбросы: записи и итоги, далекие от обычных для сотрудника или проекта
+    anomalies_df = load_anomalies(version)
+    if not anomalies_df.empty:
+        with st.expander(f"📈 Необычные часы: {len(anomalies_df)}", expanded=False):
+            st.dataframe(
+                anomalies_df.assign(
+                    Kind=anomalies_df['Kind'].map(ANOMALY_KINDS),
+                    Entity=anomalies_df['Entity'].map(ANOMALY_ENTITIES)
+                )[list(ANOMALY_COLUMNS)].rename(columns=ANOMALY_COLUMNS),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.caption(
+                "Часы записи - по сравнению с обычной записью сотрудника; часы за загрузку и структура часов - "
+                "по сравнению с прошлыми загрузками. Оценка - робастная z-оценка (медиана и MAD) "
+                "или доля часов, сменившая проект или активность"
+            )
+
+    # Записи, не прошедшие проверку
+    quarantine_df = load_quarantine(version)
+    if not quarantine_df.empty:
+        with st.expander(f"🚫 Отклонено при загрузке: {len(quarantine_df)}", expanded=False):
+            st.dataframe(quarantine_df, use_container_width=True, hide_index=True)
+            st.caption(f"Записи сохранены в {QUARANTINE_PATH} вместе с причинами")
+
+@st.fragment
+def kpi_section(version, query, selection, chart_filter):
+    """KPI по фильтрам sidebar и выбору на графике; изменения - к прошлой загрузке"""
+    # Расчет метрик - из тех же итогов, что и таблицы
+    project_hours, employee_hours = load_top_totals(version, query, combine(selection, chart_filter))
+    active_projects = len(project_hours)
+    active_employees = len(employee_hours)
+    total_hours = project_hours['Hours'].sum()
+
+    if len(project_hours) > 0:
+        top_project_row = project_hours.loc[project_hours['Hours'].idxmax()]
+        top_project = top_project_row['Project_No']
+        top_project_hours = top_project_row['Hours']
+    else:
+        top_project = "N/A"
+        top_project_hours = 0
+
+    avg_hours_per_employee = employee_hours['Hours'].mean() if active_employees > 0 else 0
+
+    # Изменения KPI с прошлой загрузки - по снимку итогов, без чтения прежних записей
+    snapshots = load_snapshots(version)
+    previous_version = snapshots.previous(version)
+    kpi_deltas = {'hours': None, 'projects': None, 'employees': None, 'avg_hours': "ч/сотрудник"}
+    if previous_version is not None and not query:
+        previous_kpis = summary(load_snapshot(previous_version), selection, chart_filter)
+        kpi_deltas = {
+            'hours': f"{total_hours - previous_kpis['hours']:+,.0f} ч",
+            'projects': active_projects - previous_kpis['projects'],
+            'employees': active_employees - previous_kpis['employees'],
+            'avg_hours': f"{avg_hours_per_employee - previous_kpis['avg_hours']:+.1f} ч/сотрудник"
+        }
+
+    # KPI Cards
+    st.markdown("<br>", unsafe_allow_html=True)
+    col1, col2, col3, col4, col5 = st.columns(5)
+
+    with col1:
+        st.metric(
+            label="Общие часы",
+            value=f"{total_hours:,.0f}",
+            delta=kpi_deltas['hours']
+        )
+
+    with col2:
+        st.metric(
+            label="Проектов",
+            value=active_projects,
+            delta=kpi_deltas['projects']
+        )
+
+    with col3:
+        st.metric(
+            label="Сотрудников",
+            value=active_employees,
+            delta=kpi_deltas['employees']
+        )
+
+    with col4:
+        st.metric(
+            label="Топ проект",
+            value=top_project,
+            delta=f"{top_project_hours:,.0f} ч"
+        )
+
+    with col5:
+        st.metric(
+            label="Средняя загрузка",
+            value=f"{avg_hours_per_employee:.1f}",
+            delta=kpi_deltas['avg_hours']
+        )
+
+# Разрезы сравнения загрузок
+CHANGE_LEVELS = {
+    'Проекты': ['Project_No', 'Project_Description'],
+    'Сотрудники': ['Employee'],
+    'Клиенты': ['Client']
+}
+CHANGE_COLUMNS = {
+    'Project_No': 'Проект',
+    'Project_Description': 'Описание',
+    'Employee': 'Сотрудник',
+    'Client': 'Клиент',
+    'Hours_Before': 'Было, ч',
+    'Hours_After': 'Стало, ч',
+    'Delta': 'Изменение, ч',
+    'Delta_Pct': 'Изменение, %',
+    'Status': 'Статус'
+}
+
+@st.fragment
+def changes_section(version, query, selection, chart_filter):
+    """Сравнение любых двух снимков итогов (выбор снимков перезапускает только этот раздел)"""
+    snapshots = load_snapshots(version)
+    if len(snapshots.snapshots) > 1:
+        previous_version = snapshots.previous(version)
+        snapshot_labels = {}
+        for s in snapshots.snapshots:
+            # Версия, загруженная снова, встает на место своей последней загрузки
+            snapshot_labels.pop(s['version'], None)
+            snapshot_labels[s['version']] = f"{s['time']} · {s['hours']:,.0f} ч"
+        snapshot_versions = list(snapshot_labels)
+        if previous_version is not None and not query:
+            st.caption(f"Изменения KPI - по сравнению с загрузкой {snapshot_labels[previous_version]}")
+        with st.expander("🔄 Изменения с прошлой загрузки", expanded=False):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                before_version = st.selectbox(
+                    "Было",
+                    options=snapshot_versions,
+                    index=len(snapshot_versions) - 2,
+                    format_func=snapshot_labels.get
+                )
+            with col2:
+                after_version = st.selectbox(
+                    "Стало",
+                    options=snapshot_versions,
+                    index=len(snapshot_versions) - 1,
+                    format_func=snapshot_labels.get
+                )
+            with col3:
+                change_view = st.radio("Разрез", options=list(CHANGE_LEVELS), horizontal=True)
+            if query:
+                st.caption("Снимки хранят только итоги, поэтому поиск в сравнении не учитывается")
+            changes = load_changes(before_version, after_version, tuple(CHANGE_LEVELS[change_view]), selection, chart_filter)
+            if changes.empty:
+                st.info("Между выбранными загрузками часы не изменились")
+            else:
+                st.caption(f"Изменилось позиций: {len(changes)} · итого {changes['Delta'].sum():+,.0f} ч")
+                st.dataframe(changes.rename(columns=CHANGE_COLUMNS), use_container_width=True, hide_index=True)
+
+@st.fragment
+def tables_section(version, query, selection, chart_filter, theme):
+    """Топы и постраничные списки проектов и сотрудников"""
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown(f"""
+    <div style='padding: 1rem 0;'>
+        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Дополнительная информация</h2>
+    </div>
+    """, unsafe_allow_html=True)
+
+    # Итоги считаются один раз на выбор фильтров, топ берется частичной выборкой
+    project_totals, employee_totals = load_top_totals(version, query, combine(selection, chart_filter))
+    project_totals = project_totals[['Project_Full_Name', 'Hours']].rename(columns={'Project_Full_Name': 'Проект', 'Hours': 'Часы'})
+    employee_totals = employee_totals.rename(columns={'Employee': 'Сотрудник', 'Hours': 'Часы'})
+
+    top_n = st.number_input("Размер топа", min_value=1, max_value=100, value=10, step=1)
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.markdown(f"**🏆 Топ-{top_n} проектов**")
+        st.dataframe(
+            top_k(project_totals, top_n, value='Часы'),
+            use_container_width=True,
+            hide_index=True,
+            height=400
+        )
+
+    with col2:
+        st.markdown(f"**👥 Топ-{top_n} сотрудников**")
+        st.dataframe(
+            top_k(employee_totals, top_n, value='Часы'),
+            use_container_width=True,
+            hide_index=True,
+            height=400
+        )
+
+    # Полный список постранично: выбирается только видимая страница
+    if st.checkbox("📄 Показать все", value=False):
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            all_view = st.radio("Список", options=['Проекты', 'Сотрудники'], horizontal=True)
+        totals = project_totals if all_view == 'Проекты' else employee_totals
+        with col2:
+            page_size = st.selectbox("Строк на странице", options=[25, 50, 100], index=0)
+        pages = page_count(totals, page_size)
+        with col3:
+            page_no = st.number_input("Страница", min_value=1, max_value=pages, value=1, step=1)
+        st.dataframe(
+            page(totals, page_no - 1, page_size, value='Часы'),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(f"Страница {page_no} из {pages} · всего {len(totals)}")
+
+# Подписи колонок таблицы загрузки
+UTILIZATION_LABELS = {
+    'Employee': 'Сотрудник',
+    'Hours': 'Часы',
+    'Chargeable_Hours': 'Клиентские, ч',
+    'Non_Chargeable_Hours': 'Без счета, ч',
+    'Admin_Hours': 'Администрирование, ч',
+    'Chargeable_Ratio': 'Доля клиентских',
+    'Admin_Share': 'Доля администрирования',
+    'Capacity': 'Норма, ч',
+    'Utilization': 'Загрузка',
+    'Chargeable_Utilization': 'Клиентская загрузка'
+}
+UTILIZATION_PERCENT = ['Chargeable_Ratio', 'Admin_Share', 'Utilization', 'Chargeable_Utilization']
+
+@st.fragment
+def utilization_section(version, query, selection, chart_filter, capacity):
+    """Показатели команды и таблица загрузки сотрудников (сортировка перезапускает только этот раздел)"""
+    util = load_utilization(version, query, combine(selection, chart_filter), capacity)
+    team = team_summary(util)
+    st.caption(
+        f"Сотрудников: {team['employees']} · доля клиентских часов {team['chargeable_ratio']:.0%} · "
+        f"администрирование {team['admin_share']:.0%} · загрузка к норме {team['utilization']:.0%} · "
+        f"сверх нормы: {team['over_capacity']}"
+    )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        util_sort = st.selectbox(
+            "Сортировка загрузки",
+            options=list(UTILIZATION_LABELS),
+            index=list(UTILIZATION_LABELS).index('Utilization'),
+            format_func=UTILIZATION_LABELS.get
+        )
+    with col2:
+        util_ascending = st.selectbox("Порядок загрузки", options=['По убыванию', 'По возрастанию']) == 'По возрастанию'
+    util = util.sort_values(util_sort, ascending=util_ascending, kind='stable')
+
+    # Доли показываются в процентах; заголовки таблицы тоже сортируют
+    util[UTILIZATION_PERCENT] = util[UTILIZATION_PERCENT] * 100
+    st.dataframe(
+        util.rename(columns=UTILIZATION_LABELS),
+        use_container_width=True,
+        hide_index=True,
+        column_config={UTILIZATION_LABELS[col]: st.column_config.NumberColumn(format='%.0f%%') for col in UTILIZATION_PERCENT}
+    )
+
+# Подписи колонок исходных записей
+RECORD_LABELS = {
+    'Employee': 'Сотрудник',
+    'Client': 'Клиент',
+    'Project_No': 'Проект',
+    'Activity': 'Активность',
+    'Project_Description': 'Описание проекта',
+    'Staff_Comment': 'Комментарий',
+    'Hours': 'Часы'
+}
+
+@st.fragment
+def records_section(version, query, selection, chart_filter, theme):
+    """Исходные записи: фильтрация, сортировка и страницы - на стороне хранилища"""
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown(f"""
+    <div style='padding: 1rem 0;'>
+        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Исходные записи</h2>
+    </div>
+    """, unsafe_allow_html=True)
+
+    store = load_store(version)
+
+    # Фильтры sidebar и поиск действуют и на записи
+    record_rows = store.select(
+        equals=combine(selection, chart_filter),
+        rows=load_text_index(version).search(query) if query else None
+    )
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        record_sort = st.selectbox(
+            "Сортировка",
+            options=list(RECORD_LABELS.keys()),
+            index=len(RECORD_LABELS) - 1,
+            format_func=lambda x: RECORD_LABELS[x]
+        )
+    with col2:
+        record_ascending = st.selectbox("Порядок", options=['По убыванию', 'По возрастанию']) == 'По возрастанию'
+    with col3:
+        record_page_size = st.selectbox("Записей на странице", options=[25, 50, 100], index=1)
+    record_pages = page_count(record_rows, record_page_size)
+    with col4:
+        record_page = st.number_input("Страница записей", min_value=1, max_value=record_pages, value=1, step=1)
+
+    records_page = store.page(
+        record_rows,
+        sort_by=record_sort,
+        ascending=record_ascending,
+        offset=(record_page - 1) * record_page_size,
+        limit=record_page_size
+    )
+    st.dataframe(
+        records_page.rename(columns=RECORD_LABELS),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.caption(f"Страница {record_page} из {record_pages} · найдено записей: {len(record_rows):,} из {len(store):,}")
+
+# Виды сравнения и число элементов на графике (остальные - в "Другие")
+COMPARE_VIEWS = ['Парные столбцы', 'Зеркальные круговые', 'Тепловая карта разницы']
+COMPARE_BAR_ROWS = 20
+COMPARE_PIE_SLICES = 10
+
+@st.fragment
+def comparison_section(version, query, selection, theme):
+    """Сравнение сотрудников, проектов или клиентов (выбор перезапускает только этот раздел)"""
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown(f"""
+    <div style='padding: 1rem 0;'>
+        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Сравнение</h2>
+    </div>
+    """, unsafe_allow_html=True)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        compare_col = st.radio("Сравнить", options=list(COMPARE_DIMENSIONS), format_func=COMPARE_DIMENSIONS.get, horizontal=True)
+    with col2:
+        compare_by = st.selectbox("Разрез", options=BREAKDOWNS[compare_col], format_func=BREAKDOWN_LABELS.get)
+    with col3:
+        compare_view = st.selectbox("Вид сравнения", options=COMPARE_VIEWS)
+
+    projects = load_star(version, query).dimensions['Project']
+    project_labels = dict(zip(projects['Project_No'], projects['Project_Label']))
+    def label(value, col):
+        return project_labels.get(value, value) if col == 'Project_No' else value
+
+    # Фильтр sidebar по самой сравниваемой колонке не применяется - иначе он сузил бы сравнение
+    filters = combine({col: values for col, values in selection.items() if col != compare_col})
+    options = load_ranking(version, query, filters, compare_col)
+    members = st.multiselect(
+        "Значения для сравнения",
+        options=options,
+        default=options[:2],
+        format_func=lambda value: label(value, compare_col),
+        placeholder="Выберите два или больше"
+    )
+    if len(members) < 2:
+        st.info("Выберите хотя бы два значения для сравнения")
+        return
+
+    table = load_comparison(version, query, filters, compare_col, tuple(members), compare_by)
+    if table.empty:
+        st.info("Для выбранных значений нет часов")
+        return
+    member_labels = [label(m, compare_col) for m in members]
+    colors = theme['colors']
+
+    if compare_view == 'Парные столбцы':
+        shown = fold_others(table, members, COMPARE_BAR_ROWS)
+        fig = go.Figure()
+        for i, (member, member_label) in enumerate(zip(members, member_labels)):
+            fig.add_trace(go.Bar(
+                x=[label(v, compare_by) for v in shown.index],
+                y=shown[member],
+                name=member_label,
+                marker_color=colors[i % len(colors)],
+                hovertemplate='<b>%{fullData.name}</b><br>%{x}<br>Часы: %{y:,.0f}<extra></extra>'
+            ))
+        fig.update_layout(
+            barmode='group',
+            template='plotly_white',
+            height=550,
+            yaxis_title="Часы",
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="left", x=0, font=dict(size=10, color=theme['text'])),
+            xaxis=dict(tickangle=-45, tickfont=dict(size=10, color=theme['text_light']), linecolor=theme['border']),
+            yaxis=dict(tickfont=dict(size=10, color=theme['text_light']), gridcolor=theme['border']),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=60, r=30, t=50, b=150),
+            font=dict(color=theme['text'])
+        )
+
+    elif compare_view == 'Зеркальные круговые':
+        # Одинаковый цвет у значения разреза на всех кругах, соседние круги - в противоположных направлениях
+        shown = fold_others(table, members, COMPARE_PIE_SLICES)
+        slice_labels = [label(v, compare_by) for v in shown.index]
+        slice_colors = [colors[i % len(colors)] for i in range(len(shown))]
+        fig = make_subplots(rows=1, cols=len(members), specs=[[{'type': 'domain'}] * len(members)], subplot_titles=member_labels)
+        for i, member in enumerate(members):
+            fig.add_trace(go.Pie(
+                labels=slice_labels,
+                values=shown[member],
+                name=member_labels[i],
+                hole=0.45,
+                sort=False,
+                direction='counterclockwise' if i % 2 == 0 else 'clockwise',
+                marker=dict(colors=slice_colors, line=dict(color=theme['bg'], width=2)),
+                textinfo='percent',
+                hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
+            ), row=1, col=i + 1)
+        fig.update_layout(
+            template='plotly_white',
+            height=500,
+            legend=dict(orientation="h", yanchor="top", y=-0.05, xanchor="left", x=0, font=dict(size=10, color=theme['text'])),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=30, r=30, t=60, b=30),
+            font=dict(color=theme['text'])
+        )
+
+    else:
+        # Отклонение от среднего по сравниваемым: выше среднего - основной цвет, ниже - красный
+        shown = fold_others(table, members, COMPARE_BAR_ROWS)
+        delta = deviations(shown, members)
+        fig = go.Figure(data=go.Heatmap(
+            z=delta.T.values.tolist(),
+            x=[label(v, compare_by) for v in delta.index],
+            y=member_labels,
+            customdata=shown[members].T.values.tolist(),
+            colorscale=[[0, '#E74C3C'], [0.5, theme['card']], [1, theme['primary']]],
+            zmid=0,
+            text=[[f'{v:+,.0f}' if v != 0 else '' for v in row] for row in delta.T.values],
+            texttemplate='%{text}',
+            textfont=dict(size=9, color=theme['text']),
+            hovertemplate='<b>%{y}</b><br>%{x}<br>Часы: %{customdata:,.0f}<br>К среднему: %{z:+,.0f}<extra></extra>',
+            showscale=True
+        ))
+        fig.update_layout(
+            template='plotly_white',
+            height=max(300, 60 * len(members) + 200),
+            xaxis=dict(side="bottom", tickangle=-45, tickfont=dict(size=9, color=theme['text_light'])),
+            yaxis=dict(autorange="reversed", tickfont=dict(size=10, color=theme['text_light'])),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            margin=dict(l=200, r=80, t=30, b=150),
+            font=dict(color=theme['text'])
+        )
+
+    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+
+    difference_label = 'Разница, ч' if len(members) == 2 else 'Размах, ч'
+    display = table.rename(columns={**dict(zip(members, member_labels)), 'Difference': difference_label})
+    display.index = [label(v, compare_by) for v in display.index]
+    display = display.rename_axis(index=RECORD_LABELS[compare_by], columns=None).reset_index()
+    st.dataframe(display, use_container_width=True, hide_index=True)
+    if len(members) == 2:
+        st.caption(f"Разница - {member_labels[1]} минус {member_labels[0]}")
+
+@st.fragment
+def export_section(version, query, selection, chart_filter, theme):
+    """Экспорт по текущим фильтрам (формат и подготовка файла перезапускают только этот раздел)"""
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown(f"""
+    <div style='padding: 1rem 0;'>
+        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Экспорт данных</h2>
+    </div>
+    """, unsafe_allow_html=True)
+
+    export_label = '_'.join(v for values in combine(selection, chart_filter).values() for v in values)[:100] or 'все'
+    col1, col2 = st.columns(2)
+    with col1:
+        export_format = st.selectbox("Формат файла", options=available_formats(), format_func=FORMAT_LABELS.get)
+    with col2:
+        export_content = st.selectbox(
+            "Данные",
+            options=list(EXPORT_CONTENTS),
+            format_func=EXPORT_CONTENTS.get,
+            disabled=export_format == 'zip'
+        )
+
+    # Файл строится только по кнопке и переиспользуется для тех же данных, фильтров и формата
+    export_key = (version, query, selection, chart_filter, export_format, export_content)
+    prepare = st.button("⚙️ Подготовить файл", use_container_width=True)
+    if prepare:
+        st.session_state['export_key'] = export_key
+    if st.session_state.get('export_key') != export_key:
+        return
+    with st.spinner("Подготовка файла..."):
+        export_file = prepare_export(*export_key)
+    label = f"📥 Скачать {FORMAT_LABELS[export_format]} ({os.path.getsize(export_file) / 1e6:,.1f} МБ)"
+    file_name = f"kmga_data_{export_label}.{FORMATS[export_format][0]}"
+    if st.get_option('server.enableStaticServing'):
+        # Ссылка на файл в static: Streamlit отдает его с диска, в памяти сервера файл не держится
+        st.markdown(f"""
+        <a href="{export_url(export_file)}" download="{html.escape(file_name)}" style='display: block; text-align: center;
+            padding: 0.5rem; border: 1px solid {theme['primary']}; border-radius: 0.5rem;
+            color: {theme['primary']}; text-decoration: none;'>{label}</a>
+        """, unsafe_allow_html=True)
+    elif prepare:
+        # Без раздачи static файл целиком читается в память сервера и лежит там, пока кнопка на
+        # странице, - поэтому кнопка показывается только в запуске, где файл подготовлен
+        with open(export_file, 'rb') as f:
+            st.download_button(
+                label=label,
+                data=f,
+                file_name=file_name,
+                mime=FORMATS[export_format][1],
+                use_container_width=True
+            )
+    else:
+        st.caption("Файл подготовлен - нажмите «Подготовить файл», чтобы скачать его")
 
 # Загрузка данных
-df, duplicates_df = load_data()
+df, data_version = load_data()
+# Прогрев частых видов в фоне - один раз на версию данных
+start_warmup(data_version)
 
 # Sidebar с фильтрами и настройками
 st.sidebar.markdown("### ⚙️ Настройки")
@@ -157,54 +1283,69 @@ st.markdown(f"""
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🔍 Фильтры")
 
-# Получаем уникальные проекты с полными названиями
-project_options = df.groupby(['Project_No', 'Project_Full_Name'])['Hours'].sum().reset_index()
-project_options = project_options.sort_values('Project_No')
+# Варианты фильтров - прямо из таблиц измерений (проекты - с полными названиями)
+dimensions = load_star(data_version, '')
+project_options = dimensions.dimension('Project')
 project_dict = dict(zip(project_options['Project_Full_Name'], project_options['Project_No']))
 
-# Фильтры
-selected_project_full = st.sidebar.selectbox(
-    "📁 Проект",
-    options=['Все проекты'] + list(project_dict.keys()),
-    index=0,
-    format_func=lambda x: x
+# Фильтры (пустой выбор - все значения)
+selected_projects_full = st.sidebar.multiselect(
+    "📁 Проекты",
+    options=list(project_dict.keys()),
+    placeholder="Все проекты"
 )
 
-selected_employee = st.sidebar.selectbox(
-    "👤 Сотрудник",
-    options=['Все сотрудники'] + sorted(df['Employee'].unique().tolist()),
-    index=0
+selected_employees = st.sidebar.multiselect(
+    "👤 Сотрудники",
+    options=dimensions.options('Employee'),
+    placeholder="Все сотрудники"
+)
+
+selected_clients = st.sidebar.multiselect(
+    "🏢 Клиенты",
+    options=dimensions.options('Client'),
+    placeholder="Все клиенты"
+)
+
+selected_activities = st.sidebar.multiselect(
+    "🛠️ Активности",
+    options=dimensions.options('Activity'),
+    placeholder="Все активности"
 )
 
+selection = {
+    'Project_No': [project_dict[p] for p in selected_projects_full],
+    'Employee': selected_employees,
+    'Client': selected_clients,
+    'Activity': selected_activities
+}
+
+# Полнотекстовый поиск: фильтрует все графики, KPI и таблицы
+search_query = st.sidebar.text_input(
+    "🔤 Поиск по комментариям",
+    value="",
+    placeholder="например: SIS upgrade"
+).strip()
+
 st.sidebar.markdown("---")
 
 chart_type = st.sidebar.radio(
     "📊 Тип графика",
-    options=['Pie Chart', 'Bar Chart', 'Heatmap', 'Treemap'],
+    options=list(CHART_FILTER_COLUMNS),
     index=0
 )
 
 st.sidebar.markdown("---")
 show_tables = st.sidebar.checkbox("📋 Показать таблицы", value=False)
+show_records = st.sidebar.checkbox("🔎 Исходные записи", value=False)
 export_data = st.sidebar.checkbox("💾 Экспорт данных", value=False)
+compare_mode = st.sidebar.checkbox("⚖️ Режим сравнения", value=False)
 
-# Фильтрация данных
-filtered_df = df.copy()
-if selected_project_full != 'Все проекты':
-    selected_project_no = project_dict[selected_project_full]
-    filtered_df = filtered_df[filtered_df['Project_No'] == selected_project_no]
-if selected_employee != 'Все сотрудники':
-    filtered_df = filtered_df[filtered_df['Employee'] == selected_employee]
-
-# Показываем дубликаты если они есть
-if not duplicates_df.empty:
-    with st.expander("⚠️ Найдены потенциальные дубликаты", expanded=False):
-        st.dataframe(
-            duplicates_df[['Employee', 'Project_No', 'Client', 'Project_Description', 'Hours']].sort_values(['Employee', 'Project_No']),
-            use_container_width=True,
-            hide_index=True
-        )
-        st.caption(f"Всего найдено {len(duplicates_df)} записей с дублирующимися комбинациями Employee + Project_No")
+# Элементы, выбранные кликом на графике, - дополнительный фильтр для остальной страницы
+chart_key = f"chart_{chart_type}"
+chart_filter = chart_selection(st.session_state.get(chart_key), CHART_FILTER_COLUMNS[chart_type])
+
+data_quality_section(data_version)
 
 # Заголовок
 st.markdown(f"""
@@ -218,915 +1359,27 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-# Расчет метрик
-total_hours = filtered_df['Hours'].sum()
-active_projects = filtered_df['Project_No'].nunique()
-active_employees = filtered_df['Employee'].nunique()
-
-project_hours = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-if len(project_hours) > 0:
-    top_project_row = project_hours.loc[project_hours['Hours'].idxmax()]
-    top_project = top_project_row['Project_No']
-    top_project_hours = top_project_row['Hours']
-else:
-    top_project = "N/A"
-    top_project_hours = 0
-
-avg_hours_per_employee = filtered_df.groupby('Employee')['Hours'].sum().mean() if active_employees > 0 else 0
-
-# KPI Cards
-st.markdown("<br>", unsafe_allow_html=True)
-col1, col2, col3, col4, col5 = st.columns(5)
-
-with col1:
-    st.metric(
-        label="Общие часы",
-        value=f"{total_hours:,.0f}"
-    )
-
-with col2:
-    st.metric(
-        label="Проектов",
-        value=active_projects
-    )
-
-with col3:
-    st.metric(
-        label="Сотрудников",
-        value=active_employees
-    )
-
-with col4:
-    st.metric(
-        label="Топ проект",
-        value=top_project,
-        delta=f"{top_project_hours:,.0f} ч"
-    )
-
-with col5:
-    st.metric(
-        label="Средняя загрузка",
-        value=f"{avg_hours_per_employee:.1f}",
-        delta="ч/сотрудник"
-    )
-
-st.markdown("<br>", unsafe_allow_html=True)
-
-# Основной график
-if chart_type == 'Pie Chart':
-    # Pie Chart с часами и процентами
-    proj_sum = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-    proj_sum = proj_sum.sort_values('Hours', ascending=False)
-    
-    # Группируем маленькие проекты
-    if len(proj_sum) > 10:
-        top_10 = proj_sum.head(10)
-        others = proj_sum.tail(len(proj_sum) - 10)
-        others_sum = others['Hours'].sum()
-        if others_sum > 0:
-            top_10 = pd.concat([top_10, pd.DataFrame([{
-                'Project_No': 'OTHER',
-                'Project_Label': 'Другие проекты',
-                'Hours': others_sum
-            }])], ignore_index=True)
-        proj_sum = top_10
-    
-    fig = go.Figure(data=[go.Pie(
-        labels=proj_sum['Project_Label'],
-        values=proj_sum['Hours'],
-        hole=0.5,
-        textinfo='label+percent+value',
-        texttemplate='%{label}<br>%{value:,.0f} ч<br>(%{percent})',
-        textposition='outside',
-        textfont=dict(size=10, color=theme['text']),
-        marker=dict(
-            colors=theme['colors'][:len(proj_sum)],
-            line=dict(color=theme['bg'], width=2)
-        ),
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>',
-        rotation=90
-    )])
-    
-    fig.update_layout(
-        title="",
-        template='plotly_white',
-        height=600,
-        showlegend=True,
-        legend=dict(
-            orientation="v",
-            yanchor="middle",
-            y=0.5,
-            xanchor="left",
-            x=1.15,
-            font=dict(size=10, color=theme['text']),
-            bgcolor='rgba(255,255,255,0.95)',
-            bordercolor=theme['border'],
-            borderwidth=1
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=50, r=280, t=30, b=50),
-        font=dict(color=theme['text'])
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Bar Chart':
-    # Stacked Bar Chart
-    fig = go.Figure()
-    
-    employees = sorted(filtered_df['Employee'].unique())
-    for i, emp in enumerate(employees):
-        emp_data = filtered_df[filtered_df['Employee'] == emp]
-        temp = emp_data.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-        fig.add_trace(go.Bar(
-            x=temp['Project_Label'],
-            y=temp['Hours'],
-            name=emp,
-            marker_color=theme['colors'][i % len(theme['colors'])],
-            text=[f'{h:,.0f}' for h in temp['Hours']],
-            textposition='outside',
-            textfont=dict(size=9, color=theme['text']),
-            hovertemplate='<b>%{fullData.name}</b><br>Проект: %{x}<br>Часы: %{y:,.0f}<extra></extra>'
-        ))
-    
-    fig.update_layout(
-        title="",
-        xaxis_title="",
-        yaxis_title="Часы",
-        barmode='stack',
-        template='plotly_white',
-        height=650,
-        showlegend=True,
-        legend=dict(
-            orientation="v",
-            yanchor="top",
-            y=1,
-            xanchor="left",
-            x=1.02,
-            font=dict(size=10, color=theme['text']),
-            bgcolor='rgba(255,255,255,0.95)',
-            bordercolor=theme['border'],
-            borderwidth=1
-        ),
-        xaxis=dict(
-            categoryorder='total descending',
-            tickfont=dict(size=10, color=theme['text_light']),
-            gridcolor=theme['border'],
-            linecolor=theme['border']
-        ),
-        yaxis=dict(
-            tickfont=dict(size=10, color=theme['text_light']),
-            gridcolor=theme['border'],
-            linecolor=theme['border']
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=60, r=220, t=30, b=120),
-        font=dict(color=theme['text'])
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Heatmap':
-    # Heatmap - убираем colorbar из go.Heatmap, используем только showscale
-    pivot_data = filtered_df.groupby(['Employee', 'Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-    pivot_table = pivot_data.pivot_table(
-        index='Employee', 
-        columns='Project_Label', 
-        values='Hours', 
-        aggfunc='sum'
-    ).fillna(0)
-    
-    fig = go.Figure(data=go.Heatmap(
-        z=pivot_table.values.tolist(),
-        x=pivot_table.columns.tolist(),
-        y=pivot_table.index.tolist(),
-        colorscale=[[0, theme['card']], [0.5, theme['colors'][2]], [1, theme['primary']]],
-        text=[[f'{val:.0f}' if val > 0 else '' for val in row] for row in pivot_table.values],
-        texttemplate='%{text}',
-        textfont=dict(size=9, color='white'),
-        hovertemplate='<b>Сотрудник:</b> %{y}<br><b>Проект:</b> %{x}<br><b>Часы:</b> %{z:,.0f}<extra></extra>',
-        showscale=True
-    ))
-    
-    fig.update_layout(
-        title="",
-        xaxis_title="",
-        yaxis_title="",
-        template='plotly_white',
-        height=900,
-        xaxis=dict(
-            side="bottom",
-            tickangle=-45,
-            tickfont=dict(size=9, color=theme['text_light']),
-            gridcolor=theme['border']
-        ),
-        yaxis=dict(
-            autorange="reversed",
-            tickfont=dict(size=10, color=theme['text_light']),
-            gridcolor=theme['border']
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=150, r=80, t=30, b=200),
-        font=dict(color=theme['text'])
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Treemap':
-    # Treemap - убираем update_coloraxes, используем стандартный colorbar
-    treemap_data = filtered_df.groupby(['Client', 'Project_No', 'Project_Label', 'Employee'])['Hours'].sum().reset_index()
-    
-    fig = px.treemap(
-        treemap_data,
-        path=[px.Constant("Все"), 'Client', 'Project_Label', 'Employee'],
-        values='Hours',
-        title="",
-        color='Hours',
-        color_continuous_scale=[[0, theme['card']], [0.5, theme['colors'][2]], [1, theme['primary']]],
-        template='plotly_white'
-    )
-    
-    fig.update_layout(
-        height=650,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=20, r=20, t=30, b=20),
-        font=dict(color=theme['text'])
-    )
-    
-    fig.update_traces(
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<extra></extra>',
-        textfont=dict(size=11, color='white'),
-        textposition='middle center',
-        texttemplate='%{label}<br>%{value:,.0f} ч',
-        marker=dict(line=dict(color='white', width=2))
-    )
-    
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-# Опциональные таблицы
-if show_tables:
-    st.markdown("<br>", unsafe_allow_html=True)
-    st.markdown(f"""
-    <div style='padding: 1rem 0;'>
-        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Дополнительная информация</h2>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown("**🏆 Топ-10 проектов**")
-        top_projects = filtered_df.groupby(['Project_No', 'Project_Full_Name'])['Hours'].sum().reset_index()
-        top_projects = top_projects.sort_values('Hours', ascending=False).head(10)
-        st.dataframe(
-            top_projects[['Project_Full_Name', 'Hours']].rename(columns={'Project_Full_Name': 'Проект', 'Hours': 'Часы'}),
-            use_container_width=True,
-            hide_index=True,
-            height=400
-        )
-    
-    with col2:
-        st.markdown("**👥 Топ-10 сотрудников**")
-        top_employees = filtered_df.groupby('Employee')['Hours'].sum().reset_index()
-        top_employees = top_employees.sort_values('Hours', ascending=False).head(10)
-        st.dataframe(
-            top_employees.rename(columns={'Employee': 'Сотрудник', 'Hours': 'Часы'}),
-            use_container_width=True,
-            hide_index=True,
-            height=400
-        )
-
-# Экспорт данных
-if export_data:
-    st.markdown("<br>", unsafe_allow_html=True)
-    st.markdown(f"""
-    <div style='padding: 1rem 0;'>
-        <h2 style='color: {theme['text']}; font-size: 1.3rem; font-weight: 600; margin: 0;'>Экспорт данных</h2>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    csv = filtered_df[['Employee', 'Project_No', 'Project_Full_Name', 'Client', 'Activity', 'Hours']].to_csv(index=False).encode('utf-8-sig')
-    st.download_button(
-        label="📥 Скачать CSV",
-        data=csv,
-        file_name=f"kmga_data_{selected_project_full}_{selected_employee}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import streamlit as st
-import json
-
-# Настройка страницы
-st.set_page_config(
-    page_title="KMGA Analytics Dashboard",
-    page_icon="📊",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Современный CSS стилизация
-st.markdown("""
-<style>
-    /* Чистый современный дизайн */
-    .main {
-        background: linear-gradient(180deg, #ffffff 0%, #f8f9fa 100%);
-    }
-    
-    /* Стильные KPI карточки */
-    .stMetric {
-        background: linear-gradient(135deg, #ffffff 0%, #f8f9fa 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        border: none;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.08);
-        transition: transform 0.2s;
-    }
-    
-    .stMetric:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(0,0,0,0.12);
-    }
-    
-    .stMetric label {
-        color: #6c757d;
-        font-size: 0.75rem;
-        font-weight: 600;
-        text-transform: uppercase;
-        letter-spacing: 0.5px;
-    }
-    
-    .stMetric [data-testid="stMetricValue"] {
-        color: #212529;
-        font-size: 2rem;
-        font-weight: 700;
-        margin-top: 0.5rem;
-    }
-    
-    .stMetric [data-testid="stMetricDelta"] {
-        color: #28a745;
-        font-size: 0.8rem;
-        font-weight: 600;
-        margin-top: 0.25rem;
-    }
-    
-    /* Заголовки */
-    h1, h2, h3 {
-        color: #212529;
-        font-weight: 700;
-        margin-bottom: 1rem;
-    }
-    
-    /* Sidebar */
-    .stSidebar {
-        background: #ffffff;
-        border-right: 1px solid #e9ecef;
-    }
-    
-    .stSelectbox label, .stRadio label, .stCheckbox label {
-        color: #495057;
-        font-size: 0.9rem;
-        font-weight: 600;
-        margin-bottom: 0.5rem;
-    }
-    
-    /* Улучшенные элементы формы */
-    .stSelectbox > div > div {
-        border-radius: 8px;
-        border: 1px solid #dee2e6;
-    }
-    
-    .stRadio > div {
-        gap: 0.5rem;
-    }
-    
-    /* Скрываем элементы Streamlit */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    
-    /* Улучшаем таблицы */
-    .stDataFrame {
-        border-radius: 8px;
-        overflow: hidden;
-    }
-    
-    /* Убираем предупреждения по умолчанию */
-    .stAlert {
-        display: none;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Загрузка данных с правильной агрегацией
-@st.cache_data
-def load_data():
-    """Загрузка и предобработка данных с исправленной агрегацией"""
-    with open('data.json', 'r', encoding='utf-8') as f:
-        raw = json.load(f)
-    
-    df = pd.DataFrame(raw['data'])
-    
-    # Фильтруем только положительные часы
-    df = df[df['Hours'] > 0].copy()
-    
-    # Очистка данных
-    df['Employee'] = df['Employee'].str.strip()
-    df['Project_No'] = df['Project_No'].str.strip()
-    df['Client'] = df['Client'].str.strip()
-    df['Activity'] = df['Activity'].str.strip()
-    df['Project_Description'] = df['Project_Description'].str.strip()
-    
-    # Исправленная агрегация: убираем дубликаты перед группировкой
-    df_aggregated = df.groupby([
-        'Employee', 
-        'Project_No', 
-        'Client', 
-        'Activity', 
-        'Project_Description'
-    ])['Hours'].sum().reset_index()
-    
-    # Создаем метки проектов - более четкие с Client и Project_Description
-    df_aggregated['Project_Label'] = (
-        df_aggregated['Client'] + ' - ' + 
-        df_aggregated['Project_No'] + ' | ' + 
-        df_aggregated['Project_Description'].str[:60]
-    )
-    df_aggregated['Project_Full_Label'] = (
-        df_aggregated['Client'] + ' - ' + 
-        df_aggregated['Project_No'] + '<br>' + 
-        df_aggregated['Project_Description']
-    )
-    
-    # Проверка на дубликаты (Employee + Project_No)
-    duplicates_check = df_aggregated.duplicated(subset=['Employee', 'Project_No'], keep=False)
-    duplicates_df = df_aggregated[duplicates_check].copy() if duplicates_check.any() else pd.DataFrame()
-    
-    return df_aggregated, duplicates_df
-
-# Загрузка данных
-df, duplicates_df = load_data()
-
-# Показываем дубликаты если они есть
-if not duplicates_df.empty:
-    with st.expander("⚠️ Найдены потенциальные дубликаты", expanded=False):
-        st.dataframe(
-            duplicates_df[['Employee', 'Project_No', 'Client', 'Project_Description', 'Hours']].sort_values(['Employee', 'Project_No']),
-            use_container_width=True,
-            hide_index=True
-        )
-        st.caption(f"Всего найдено {len(duplicates_df)} записей с дублирующимися комбинациями Employee + Project_No")
-
-# Красивый заголовок
-st.markdown("""
-<div style='text-align: center; padding: 2rem 0 1rem 0;'>
-    <h1 style='color: #212529; font-size: 2.5rem; font-weight: 700; margin-bottom: 0.5rem;'>
-        KMGA Analytics Dashboard
-    </h1>
-    <p style='color: #6c757d; font-size: 1.1rem; font-weight: 400;'>
-        Оперативная аналитика ресурсов
-    </p>
-</div>
-""", unsafe_allow_html=True)
-
-# Sidebar с фильтрами
-st.sidebar.markdown("""
-<div style='padding: 1rem 0; border-bottom: 2px solid #e9ecef; margin-bottom: 1.5rem;'>
-    <h3 style='color: #212529; font-size: 1.2rem; font-weight: 700; margin: 0;'>Фильтры</h3>
-</div>
-""", unsafe_allow_html=True)
-
-# Получаем уникальные значения
-unique_projects = sorted(df['Project_No'].unique().tolist())
-unique_employees = sorted(df['Employee'].unique().tolist())
-
-# Фильтры в sidebar
-selected_project = st.sidebar.selectbox(
-    "📁 Проект",
-    options=['Все проекты'] + unique_projects,
-    index=0,
-    label_visibility="visible"
-)
-
-selected_employee = st.sidebar.selectbox(
-    "👤 Сотрудник",
-    options=['Все сотрудники'] + unique_employees,
-    index=0,
-    label_visibility="visible"
-)
-
-st.sidebar.markdown("<br>", unsafe_allow_html=True)
-
-chart_type = st.sidebar.radio(
-    "📊 Тип графика",
-    options=['Bar Chart', 'Pie Chart', 'Line Chart', 'Heatmap', 'Treemap'],
-    index=1,
-    label_visibility="visible"
-)
+kpi_section(data_version, search_query, selection, chart_filter)
+changes_section(data_version, search_query, selection, chart_filter)
 
-st.sidebar.markdown("<br>", unsafe_allow_html=True)
-
-# Дополнительные опции
-show_tables = st.sidebar.checkbox("📋 Показать таблицы", value=False)
-export_data = st.sidebar.checkbox("💾 Экспорт данных", value=False)
-
-# Фильтрация данных
-filtered_df = df.copy()
-if selected_project != 'Все проекты':
-    filtered_df = filtered_df[filtered_df['Project_No'] == selected_project]
-if selected_employee != 'Все сотрудники':
-    filtered_df = filtered_df[filtered_df['Employee'] == selected_employee]
-
-# Расчет метрик
-total_hours = filtered_df['Hours'].sum()
-active_projects = filtered_df['Project_No'].nunique()
-active_employees = filtered_df['Employee'].nunique()
-
-# Топ проект
-project_hours = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-if len(project_hours) > 0:
-    top_project_row = project_hours.loc[project_hours['Hours'].idxmax()]
-    top_project = top_project_row['Project_No']
-    top_project_label = top_project_row['Project_Label']
-    top_project_hours = top_project_row['Hours']
-else:
-    top_project = "N/A"
-    top_project_label = "N/A"
-    top_project_hours = 0
-
-# Средняя загрузка
-avg_hours_per_employee = filtered_df.groupby('Employee')['Hours'].sum().mean() if active_employees > 0 else 0
-
-# Стильные KPI Cards
 st.markdown("<br>", unsafe_allow_html=True)
-col1, col2, col3, col4, col5 = st.columns(5)
-
-with col1:
-    st.metric(
-        label="⏱️ Общие часы",
-        value=f"{total_hours:,.0f}"
-    )
-
-with col2:
-    st.metric(
-        label="📁 Проектов",
-        value=active_projects
-    )
-
-with col3:
-    st.metric(
-        label="👥 Сотрудников",
-        value=active_employees
-    )
-
-with col4:
-    st.metric(
-        label="🏆 Топ проект",
-        value=top_project,
-        delta=f"{top_project_hours:,.0f} ч"
-    )
-
-with col5:
-    st.metric(
-        label="📊 Средняя загрузка",
-        value=f"{avg_hours_per_employee:.1f}",
-        delta="ч/сотрудник"
-    )
-
-st.markdown("<br>", unsafe_allow_html=True)
-
-# Основной график с современным дизайном
-st.markdown("""
-<div style='padding: 1rem 0;'>
-    <h2 style='color: #212529; font-size: 1.5rem; font-weight: 700; margin: 0;'>Основная визуализация</h2>
-</div>
-""", unsafe_allow_html=True)
-
-# Современная цветовая палитра (приглушенные, но красивые цвета)
-modern_colors = [
-    '#4A90E2',  # Синий
-    '#50C878',  # Зеленый
-    '#FF6B6B',  # Красный
-    '#FFA500',  # Оранжевый
-    '#9B59B6',  # Фиолетовый
-    '#1ABC9C',  # Бирюзовый
-    '#E74C3C',  # Коралловый
-    '#3498DB',  # Голубой
-    '#F39C12',  # Желтый
-    '#16A085',  # Изумрудный
-    '#E67E22',  # Морковный
-    '#95A5A6',  # Серый
-    '#34495E',  # Темно-серый
-    '#2ECC71',  # Светло-зеленый
-    '#8E44AD',  # Темно-фиолетовый
-    '#C0392B',  # Темно-красный
-    '#D35400'   # Темно-оранжевый
-]
-
-# Градиентная палитра для pie chart
-pie_colors = px.colors.qualitative.Set3 + px.colors.qualitative.Pastel
-
-if chart_type == 'Bar Chart':
-    # Stacked Bar Chart
-    fig = go.Figure()
-
-    employees = sorted(filtered_df['Employee'].unique())
-    for i, emp in enumerate(employees):
-        emp_data = filtered_df[filtered_df['Employee'] == emp]
-        temp = emp_data.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-        fig.add_trace(go.Bar(
-            x=temp['Project_Label'],
-            y=temp['Hours'],
-            name=emp,
-            marker_color=modern_colors[i % len(modern_colors)],
-            text=[f'{h:,.0f}' for h in temp['Hours']],
-            textposition='outside',
-            textfont=dict(size=10, color='#495057'),
-            hovertemplate='<b>%{fullData.name}</b><br>Проект: %{x}<br>Часы: %{y:,.0f}<extra></extra>'
-        ))
-    
-    fig.update_layout(
-        title="",
-        xaxis_title="",
-        yaxis_title="Часы",
-        barmode='stack',
-        template='plotly_white',
-        height=650,
-        showlegend=True,
-        legend=dict(
-            orientation="v",
-            yanchor="top",
-            y=1,
-            xanchor="left",
-            x=1.02,
-            font=dict(size=10, color='#495057'),
-            bgcolor='rgba(255,255,255,0.95)',
-            bordercolor='#e9ecef',
-            borderwidth=1
-        ),
-        xaxis=dict(
-            categoryorder='total descending',
-            tickfont=dict(size=10, color='#6c757d'),
-            gridcolor='#f1f3f5',
-            linecolor='#dee2e6',
-            showgrid=True
-        ),
-        yaxis=dict(
-            tickfont=dict(size=10, color='#6c757d'),
-            gridcolor='#f1f3f5',
-            linecolor='#dee2e6',
-            showgrid=True
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=60, r=220, t=30, b=120)
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Pie Chart':
-    # Pie Chart (Donut) с улучшенным дизайном
-    proj_sum = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-    proj_sum = proj_sum.sort_values('Hours', ascending=False)
-    
-    # Группируем маленькие проекты в "Другие"
-    if len(proj_sum) > 10:
-        top_10 = proj_sum.head(10)
-        others = proj_sum.tail(len(proj_sum) - 10)
-        others_sum = others['Hours'].sum()
-        if others_sum > 0:
-            top_10 = pd.concat([top_10, pd.DataFrame([{
-                'Project_No': 'OTHER',
-                'Project_Label': 'Другие проекты',
-                'Hours': others_sum
-            }])], ignore_index=True)
-        proj_sum = top_10
-    
-    fig = go.Figure(data=[go.Pie(
-        labels=proj_sum['Project_Label'],
-        values=proj_sum['Hours'],
-        hole=0.5,
-        textinfo='percent+label',
-        textposition='outside',
-        textfont=dict(size=11, color='#495057'),
-        marker=dict(
-            colors=pie_colors[:len(proj_sum)],
-            line=dict(color='#ffffff', width=2)
-        ),
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>',
-        rotation=90
-    )])
-    
-    fig.update_layout(
-        title="",
-        template='plotly_white',
-        height=600,
-        showlegend=True,
-        legend=dict(
-            orientation="v",
-            yanchor="middle",
-            y=0.5,
-            xanchor="left",
-            x=1.15,
-            font=dict(size=10, color='#495057'),
-            bgcolor='rgba(255,255,255,0.95)',
-            bordercolor='#e9ecef',
-            borderwidth=1
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=50, r=280, t=30, b=50)
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Line Chart':
-    # Line Chart с градиентом
-    project_hours_df = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-    project_hours_sorted = project_hours_df.sort_values('Hours', ascending=False)
-    
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=project_hours_sorted['Project_Label'],
-        y=project_hours_sorted['Hours'],
-        mode='lines+markers',
-        name='Часы',
-        line=dict(width=3, color='#4A90E2', shape='spline'),
-        marker=dict(size=10, color='#4A90E2', line=dict(width=2, color='white')),
-        fill='tonexty',
-        fillcolor='rgba(74, 144, 226, 0.15)',
-        text=[f'{h:,.0f}' for h in project_hours_sorted['Hours']],
-        textposition='top center',
-        textfont=dict(size=9, color='#495057'),
-        hovertemplate='<b>Проект:</b> %{x}<br><b>Часы:</b> %{y:,.0f}<extra></extra>'
-    ))
-    
-    fig.update_layout(
-        title="",
-        xaxis_title="",
-        yaxis_title="Часы",
-        template='plotly_white',
-        height=550,
-        xaxis=dict(
-            tickangle=-45,
-            tickfont=dict(size=10, color='#6c757d'),
-            gridcolor='#f1f3f5',
-            linecolor='#dee2e6',
-            showgrid=True
-        ),
-        yaxis=dict(
-            tickfont=dict(size=10, color='#6c757d'),
-            gridcolor='#f1f3f5',
-            linecolor='#dee2e6',
-            showgrid=True
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        showlegend=False,
-        margin=dict(l=60, r=50, t=30, b=150)
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Heatmap':
-    # Heatmap с улучшенной цветовой схемой
-    pivot_data = filtered_df.groupby(['Employee', 'Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-    pivot_table = pivot_data.pivot_table(
-        index='Employee', 
-        columns='Project_Label', 
-        values='Hours', 
-        aggfunc='sum'
-    ).fillna(0)
-    
-    fig = go.Figure(data=go.Heatmap(
-        z=pivot_table.values.tolist(),
-        x=pivot_table.columns.tolist(),
-        y=pivot_table.index.tolist(),
-        colorscale=[[0, '#f8f9fa'], [0.3, '#e3f2fd'], [0.6, '#4A90E2'], [1, '#1e5aa8']],
-        text=[[f'{val:.0f}' if val > 0 else '' for val in row] for row in pivot_table.values],
-        texttemplate='%{text}',
-        textfont=dict(size=9, color='white'),
-        hovertemplate='<b>Сотрудник:</b> %{y}<br><b>Проект:</b> %{x}<br><b>Часы:</b> %{z:,.0f}<extra></extra>',
-        showscale=True,
-        colorbar=dict(
-            title="Часы",
-            titlefont=dict(size=10, color='#495057'),
-            tickfont=dict(size=9, color='#495057')
-        )
-    ))
-    
-    fig.update_layout(
-        title="",
-        xaxis_title="",
-        yaxis_title="",
-        template='plotly_white',
-        height=900,
-        xaxis=dict(
-            side="bottom",
-            tickangle=-45,
-            tickfont=dict(size=9, color='#6c757d'),
-            gridcolor='#f1f3f5'
-        ),
-        yaxis=dict(
-            autorange="reversed",
-            tickfont=dict(size=10, color='#6c757d'),
-            gridcolor='#f1f3f5'
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=150, r=80, t=30, b=200)
-    )
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-
-elif chart_type == 'Treemap':
-    # Treemap с улучшенной цветовой схемой
-    treemap_data = filtered_df.groupby(['Client', 'Project_No', 'Project_Label', 'Employee'])['Hours'].sum().reset_index()
-    
-    fig = px.treemap(
-        treemap_data,
-        path=[px.Constant("Все"), 'Client', 'Project_Label', 'Employee'],
-        values='Hours',
-        title="",
-        color='Hours',
-        color_continuous_scale='Blues',
-        template='plotly_white'
-    )
-    
-    fig.update_layout(
-        height=650,
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        margin=dict(l=20, r=20, t=30, b=20)
-    )
-    
-    fig.update_traces(
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<extra></extra>',
-        textfont=dict(size=11, color='white'),
-        textposition='middle center',
-        texttemplate='%{label}<br>%{value:,.0f} ч',
-        marker=dict(line=dict(color='white', width=2))
-    )
-    
-    # Исправляем обновление colorbar для treemap
-    if hasattr(fig.layout, 'coloraxis'):
-        fig.update_layout(
-            coloraxis_colorbar=dict(
-                title="Часы",
-                titlefont=dict(size=10, color='#495057'),
-                tickfont=dict(size=9, color='#495057')
-            )
-        )
-    
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
 
-# Опциональные таблицы
+# Основной график не выделен во фрагмент: выбор на нем фильтрует всю страницу
+treemap_activity = chart_type == 'Treemap' and st.checkbox("🛠️ Детализация по активностям", value=False)
+capacity = CAPACITY_HOURS
+if chart_type == 'Utilization':
+    capacity = st.number_input("⏱️ Норма часов на сотрудника", min_value=1.0, value=CAPACITY_HOURS, step=8.0)
+fig = build_main_chart(data_version, search_query, chart_type, selection, selected_theme_name, treemap_activity, capacity)
+show_main_chart(fig, chart_key, chart_filter)
+if chart_type == 'Utilization':
+    utilization_section(data_version, search_query, selection, chart_filter, capacity)
+
+# Разделы по флажкам sidebar
+if compare_mode:
+    comparison_section(data_version, search_query, selection, theme)
 if show_tables:
-    st.markdown("<br>", unsafe_allow_html=True)
-    st.markdown("""
-    <div style='padding: 1rem 0;'>
-        <h2 style='color: #212529; font-size: 1.5rem; font-weight: 700; margin: 0;'>Дополнительная информация</h2>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown("**🏆 Топ-10 проектов**")
-        top_projects = filtered_df.groupby(['Project_No', 'Project_Label'])['Hours'].sum().reset_index()
-        top_projects = top_projects.sort_values('Hours', ascending=False).head(10)
-        st.dataframe(
-            top_projects[['Project_Label', 'Hours']].rename(columns={'Project_Label': 'Проект', 'Hours': 'Часы'}),
-            use_container_width=True,
-            hide_index=True,
-            height=400
-        )
-    
-    with col2:
-        st.markdown("**👥 Топ-10 сотрудников**")
-        top_employees = filtered_df.groupby('Employee')['Hours'].sum().reset_index()
-        top_employees = top_employees.sort_values('Hours', ascending=False).head(10)
-        st.dataframe(
-            top_employees.rename(columns={'Employee': 'Сотрудник', 'Hours': 'Часы'}),
-            use_container_width=True,
-            hide_index=True,
-            height=400
-        )
-
-# Экспорт данных
+    tables_section(data_version, search_query, selection, chart_filter, theme)
+if show_records:
+    records_section(data_version, search_query, selection, chart_filter, theme)
 if export_data:
-    st.markdown("<br>", unsafe_allow_html=True)
-    st.markdown("""
-    <div style='padding: 1rem 0;'>
-        <h2 style='color: #212529; font-size: 1.5rem; font-weight: 700; margin: 0;'>Экспорт данных</h2>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    # CSV экспорт
-    csv = filtered_df[['Employee', 'Project_No', 'Project_Label', 'Client', 'Activity', 'Hours']].to_csv(index=False).encode('utf-8-sig')
-    st.download_button(
-        label="📥 Скачать CSV",
-        data=csv,
-        file_name=f"kmga_data_{selected_project}_{selected_employee}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    export_section(data_version, search_query, selection, chart_filter, theme)
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Поля, по которым ищутся почти-дубликаты (комментарий сравнивается без регистра и пунктуации)
+NEAR_COLUMNS = ['Employee', 'Project_No', 'Client', 'Activity', 'Staff_Comment']
+KINDS = ['exact', 'near']
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _normalize_loose(values):
+    """Нестрогая форма текста: нижний регистр, только буквы и цифры"""
+    return pd.Series(values, dtype='string').str.casefold().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+
+def near_hashes(store, start, stop):
+    """Хеши строк [start, stop) для поиска почти-дубликатов.
+
+    Нормализуются и хешируются только значения словарей, строка получает
+    смесь хешей своих кодов и часов - без декодирования текста по строкам.
+    """
+    result = np.zeros(stop - start, dtype=np.uint64)
+    for col in NEAR_COLUMNS:
+        dictionary_hashes = pd.util.hash_array(_normalize_loose(store.dictionaries[col]).to_numpy(dtype=object))
+        result = result * _MIX ^ dictionary_hashes[store.codes[col][start:stop]]
+    hours = pd.util.hash_array(np.asarray(store.values['Hours'][start:stop]))
+    return result * _MIX ^ hours
+
+
+class DuplicateIndex:
+    """Счетчики повторов записей по хешам строк.
+
+    exact - полностью совпадающие записи (хеш строки хранилища),
+    near - совпадающие с точностью до регистра и пунктуации комментария.
+    Для каждого хеша хранятся число повторов, первая строка и сумма часов;
+    при дозагрузке хешируются только новые строки, и счетчики сливаются
+    с сохраненными за O(новые строки + группы).
+    """
+
+    FILE_NAME = 'duplicates.npz'
+
+    def __init__(self, rows, groups, variants):
+        self.rows = rows
+        self.groups = groups
+        self.variants = variants
+
+    @classmethod
+    def empty(cls):
+        fields = {'hash': np.uint64, 'count': np.int64, 'first': np.int64, 'hours': np.float64}
+        groups = {kind: pd.DataFrame({field: np.array([], dtype=dtype) for field, dtype in fields.items()}) for kind in KINDS}
+        variants = pd.DataFrame({'near': np.array([], dtype=np.uint64), 'exact': np.array([], dtype=np.uint64)})
+        return cls(0, groups, variants)
+
+    @classmethod
+    def index_path(cls, store):
+        return os.path.join(store.path, cls.FILE_NAME)
+
+    @classmethod
+    def open(cls, store):
+        """Прочитать счетчики хранилища или вернуть None"""
+        path = cls.index_path(store)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            groups = {
+                kind: pd.DataFrame({
+                    'hash': data[f'{kind}_hash'],
+                    'count': data[f'{kind}_count'],
+                    'first': data[f'{kind}_first'],
+                    'hours': data[f'{kind}_hours']
+                })
+                for kind in KINDS
+            }
+            variants = pd.DataFrame({'near': data['variant_near'], 'exact': data['variant_exact']})
+            rows = int(data['rows'])
+        return cls(rows, groups, variants)
+
+    @classmethod
+    def update(cls, store):
+        """Досчитать повторы для строк, добавленных в хранилище после прошлого обновления"""
+        index = cls.open(store)
+        if index is not None and index.rows == len(store):
+            return index
+        if index is None or index.rows > len(store):
+            index = cls.empty()
+
+        start, stop = index.rows, len(store)
+        hashes = {'exact': np.asarray(store.row_hashes[start:stop]), 'near': near_hashes(store, start, stop)}
+        batch = pd.DataFrame({
+            'row': np.arange(start, stop),
+            'hours': np.asarray(store.values['Hours'][start:stop])
+        })
+        groups = {}
+        for kind in KINDS:
+            new = batch.assign(hash=hashes[kind]).groupby('hash', sort=False).agg(
+                count=('row', 'size'), first=('row', 'min'), hours=('hours', 'sum')
+            ).reset_index()
+            groups[kind] = pd.concat([index.groups[kind], new]).groupby('hash', sort=False).agg(
+                {'count': 'sum', 'first': 'min', 'hours': 'sum'}
+            ).reset_index()
+        variants = pd.concat([
+            index.variants,
+            pd.DataFrame({'near': hashes['near'], 'exact': hashes['exact']})
+        ]).drop_duplicates()
+
+        arrays = {'rows': np.int64(stop), 'variant_near': variants['near'].to_numpy(), 'variant_exact': variants['exact'].to_numpy()}
+        for kind in KINDS:
+            for field in ['hash', 'count', 'first', 'hours']:
+                arrays[f'{kind}_{field}'] = groups[kind][field].to_numpy()
+        path = cls.index_path(store)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+        return cls(stop, groups, variants)
+
+    def report(self, store, kind='exact'):
+        """Группы повторов: одна запись-представитель, число повторов и сумма часов.
+
+        Для near показываются только группы, в которых есть различающиеся
+        написания (полные совпадения уже видны в exact).
+        """
+        groups = self.groups[kind]
+        groups = groups[groups['count'] > 1]
+        if kind == 'near':
+            spellings = self.variants.groupby('near').size()
+            groups = groups[groups['hash'].map(spellings).to_numpy() > 1]
+        groups = groups.sort_values(['count', 'first'], ascending=[False, True])
+        report = store.take(groups['first'].to_numpy())
+        report['Count'] = groups['count'].to_numpy()
+        report['Total_Hours'] = groups['hours'].to_numpy()
+        return report
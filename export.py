@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Форматы: расширение файла и MIME; Parquet - только с пакетом pyarrow
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'zip': ('zip', 'application/zip')
+}
+FORMAT_LABELS = {
+    'csv': 'CSV',
+    'csv.gz': 'CSV (gzip)',
+    'parquet': 'Parquet',
+    'zip': 'ZIP: все таблицы в CSV'
+}
+# Строк в одной части: файл пишется по частям, целиком в памяти не собирается
+CHUNK_ROWS = 100_000
+# Готовые файлы переиспользуются всеми сессиями, пока не изменятся данные или фильтры. Каталог -
+# внутри static рядом с приложением: при server.enableStaticServing Streamlit отдает файлы
+# с диска по адресу app/static/kmga_exports/<имя>, не загружая их в память процесса
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+EXPORT_DIR = os.path.join(STATIC_DIR, 'kmga_exports')
+EXPORT_URL = 'app/static/kmga_exports'
+# Предел места под файлы экспорта, МБ, и срок их хранения, с
+EXPORT_MAX_MB = float(os.environ.get('KMGA_EXPORT_MB', 1024))
+EXPORT_MAX_AGE = float(os.environ.get('KMGA_EXPORT_TTL', 24 * 3600))
+# Блокировки файлов экспорта по пути (запись одного файла - в одном потоке)
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != 'parquet' or pa is not None]
+
+
+def frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    """Таблица частями по chunk_rows строк (пустая - одной пустой частью, чтобы был заголовок)"""
+    if len(df) == 0:
+        yield df
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def record_chunks(store, rows, chunk_rows=CHUNK_ROWS):
+    """Записи хранилища rows частями: декодируется только текущая часть"""
+    if len(rows) == 0:
+        yield store.take(rows)
+    for start in range(0, len(rows), chunk_rows):
+        yield store.take(rows[start:start + chunk_rows])
+
+
+def _write_csv(chunks, f):
+    first = True
+    for chunk in chunks:
+        # BOM в начале файла - чтобы Excel распознал UTF-8
+        f.write(chunk.to_csv(index=False, header=first).encode('utf-8-sig' if first else 'utf-8'))
+        first = False
+
+
+def _write_parquet(chunks, f):
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(f, table.schema)
+        else:
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+    writer.close()
+
+
+def export_path(version, key, fmt):
+    """Файл экспорта версии данных для ключа (фильтры, формат, содержимое); версия - в имени для очистки"""
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(EXPORT_DIR, f'kmga_{version}_{digest}.{FORMATS[fmt][0]}')
+
+
+def export_url(path):
+    """Адрес файла экспорта при включенной раздаче static"""
+    return f'{EXPORT_URL}/{os.path.basename(path)}'
+
+
+def cleanup_exports(version, keep=None, max_mb=EXPORT_MAX_MB, max_age=EXPORT_MAX_AGE):
+    """Удалить файлы других версий данных и старше max_age, затем самые давние сверх max_mb.
+
+    keep - файл, который только что подготовлен и не удаляется. Файл,
+    который сейчас скачивается, удалять можно: открытый файл остается
+    доступным до конца передачи.
+    """
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    now = time.time()
+    files = []
+    for entry in os.scandir(EXPORT_DIR):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        stale = now - stat.st_mtime > max_age
+        # Недописанные файлы упавших процессов удаляются по сроку, чужие версии - сразу
+        other_version = not entry.name.endswith('.tmp') and not entry.name.startswith(f'kmga_{version}_')
+        if entry.path != keep and (stale or other_version):
+            _remove(entry.path)
+        elif not entry.name.endswith('.tmp'):
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_mb * 1e6:
+            break
+        if path != keep:
+            _remove(path)
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_export(path, fmt, tables):
+    """Записать экспорт, если файла еще нет, и вернуть путь к нему.
+
+    tables: {имя: функция без аргументов, возвращающая части таблицы}.
+    Части вычисляются только при записи; CSV, gzip и Parquet берут первую
+    таблицу, ZIP кладет каждую в отдельный CSV. Сессии Streamlit - потоки
+    одного процесса: один и тот же файл пишет только одна из них, остальные
+    ждут его и переиспользуют.
+    """
+    with _path_lock(path):
+        if os.path.exists(path):
+            # Время изменения - время последнего запроса: по нему очистка выбирает, что удалить
+            os.utime(path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Уникальный временный файл: другой процесс может писать тот же экспорт одновременно
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+        os.close(fd)
+        try:
+            _write_tables(tmp_path, fmt, tables)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+    return path
+
+
+def _path_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _write_tables(tmp_path, fmt, tables):
+    chunks = next(iter(tables.values()))
+    if fmt == 'csv':
+        with open(tmp_path, 'wb') as f:
+            _write_csv(chunks(), f)
+    elif fmt == 'csv.gz':
+        with gzip.open(tmp_path, 'wb') as f:
+            _write_csv(chunks(), f)
+    elif fmt == 'parquet':
+        if pa is None:
+            raise ImportError("Для экспорта в Parquet нужен пакет pyarrow (pip install pyarrow)")
+        with open(tmp_path, 'wb') as f:
+            _write_parquet(chunks(), f)
+    elif fmt == 'zip':
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, table_chunks in tables.items():
+                with archive.open(f'{name}.csv', 'w', force_zip64=True) as f:
+                    _write_csv(table_chunks(), f)
+    else:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
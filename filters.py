@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+# Измерения, по которым фильтруется дашборд
+FILTER_COLUMNS = ['Project_No', 'Employee', 'Client', 'Activity']
+# Значение, которое plotly подставляет в custom_data родительского узла treemap при разных значениях детей
+MIXED_VALUE = '(?)'
+
+
+def combine(*selections):
+    """Пересечение нескольких выборов {колонка: значения}.
+
+    Колонка без значений не фильтрует и в результат не попадает; пустой
+    список в результате означает, что пересечение пусто.
+    """
+    combined = {}
+    for selection in selections:
+        for col, values in selection.items():
+            if not values:
+                continue
+            combined[col] = [v for v in combined[col] if v in values] if col in combined else list(values)
+    return combined
+
+
+def chart_selection(event, columns):
+    """Выбор по элементам, отмеченным на графике.
+
+    customdata точки - значения колонок columns в том же порядке; значение
+    может быть списком (например, срез "Другие проекты").
+    """
+    selection = {col: [] for col in columns}
+    points = (event or {}).get('selection', {}).get('points', [])
+    for point in points:
+        values = point.get('customdata')
+        if values is None:
+            continue
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        for col, value in zip(columns, values):
+            for v in value if isinstance(value, (list, tuple)) else [value]:
+                if isinstance(v, str) and v not in ('', MIXED_VALUE) and v not in selection[col]:
+                    selection[col].append(v)
+    return selection
+
+
+class FilterIndex:
+    """Предвычисленные множества строк для каждого значения измерений.
+
+    Строки значения лежат непрерывным отрезком в перестановке order (CSR).
+    Выбор начинается с самого маленького множества (размер известен из
+    offsets без материализации), остальные измерения проверяются по кодам
+    кандидатов через таблицу допустимых значений - стоимость пропорциональна
+    размеру наименьшего множества, а не всей таблицы.
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS):
+        self.size = len(df)
+        self.codes = {}
+        self.postings = {}
+        for col in columns:
+            codes, uniques = pd.factorize(df[col])
+            self._add(col, codes, uniques)
+
+    @classmethod
+    def from_rollups(cls, rollups, columns=FILTER_COLUMNS):
+        """Индекс по путям rollups (строка - путь в их порядке) прямо по кодам словарей, без расшифровки строк"""
+        index = cls.__new__(cls)
+        index.size = len(rollups)
+        index.codes = {}
+        index.postings = {}
+        for col in columns:
+            index._add(col, np.asarray(rollups.codes[col]), rollups.store.dictionaries[col])
+        return index
+
+    def _add(self, col, codes, uniques):
+        counts = np.bincount(codes, minlength=len(uniques))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.codes[col] = codes
+        self.postings[col] = (pd.Index(uniques), offsets, np.argsort(codes, kind='stable'))
+
+    def positions(self, col, values):
+        """Коды выбранных значений колонки"""
+        positions = self.postings[col][0].get_indexer(list(values))
+        return positions[positions >= 0]
+
+    def rows(self, col, positions):
+        """Отсортированные номера строк с любым из значений"""
+        _, offsets, order = self.postings[col]
+        parts = [order[offsets[i]:offsets[i + 1]] for i in positions]
+        if not parts:
+            return np.array([], dtype=np.intp)
+        rows = np.concatenate(parts)
+        if len(parts) > 1:
+            rows.sort()
+        return rows
+
+    def select(self, *selections):
+        """Номера строк для пересечения выборов {колонка: значения}; None - фильтров нет"""
+        active = {col: self.positions(col, values) for col, values in combine(*selections).items()}
+        if not active:
+            return None
+        sizes = {col: (self.postings[col][1][positions + 1] - self.postings[col][1][positions]).sum()
+                 for col, positions in active.items()}
+        smallest = min(sizes, key=sizes.get)
+        result = self.rows(smallest, active[smallest])
+        for col, positions in active.items():
+            if col == smallest or len(result) == 0:
+                continue
+            allowed = np.zeros(len(self.postings[col][0]), dtype=bool)
+            allowed[positions] = True
+            result = result[allowed[self.codes[col][result]]]
+        return result
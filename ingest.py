@@ -0,0 +1,110 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from anomalies import Anomalies
+from backend import sql_engine
+from duplicates import DuplicateIndex
+from ledger import Ledger, record_keys
+from readers import find_input, read_input, source_name
+from record_store import RecordStore, STORE_DIR
+from rollups import Rollups
+from snapshots import SNAPSHOT_DIR, SnapshotStore
+from sql_store import SqlStore
+from text_index import TextIndex
+from validation import RECORD_COLUMNS, validate, write_quarantine
+
+DATA_PATH = 'data.json'
+
+
+def read_records(path=DATA_PATH):
+    """Чтение выгрузки: JSON n8n (массив записей в поле data), NDJSON, CSV или Excel.
+
+    Сжатые gzip/zstd файлы распаковываются по мере чтения, записи читаются
+    частями (readers.read_chunks). Элементы JSON, которые не являются
+    объектами, сохраняются в колонке RAW_COLUMN, чтобы проверка отправила
+    их в карантин, а не уронила загрузку.
+    """
+    return read_input(path)
+
+
+def file_version(path=DATA_PATH):
+    """Версия данных - хеш содержимого файла"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def ingest(path=None, store_dir=STORE_DIR, snapshot_dir=SNAPSHOT_DIR):
+    """Идемпотентная загрузка пакета записей в хранилище.
+
+    Выгрузка - полный снимок своего источника (имени файла без расширений
+    формата и сжатия: data.json и data.json.zst - один источник). Если это
+    последний принятый файл источника (тот же хеш), он пропускается без
+    разбора. Иначе записи проверяются (отклоненные - в файл карантина) и
+    сравниваются по ключам журнала с прежними записями источника: новые
+    дописываются в хранилище, а если части прежних записей в выгрузке
+    больше нет (исправлены или удалены), хранилище пересобирается без них.
+    Затем поисковый индекс, счетчики повторов, итоги иерархии и, если
+    выбран SQL-бэкенд, встроенная база досчитываются по новым строкам
+    (после пересборки - строятся заново), отчет о выбросах пересчитывается
+    для новой версии, а итоги новой версии данных сохраняются в историю
+    снимков. Возвращает хранилище и версию данных - она меняется только
+    при изменении записей. Без path берется выгрузка из KMGA_DATA или
+    первая найденная (data.json, data.json.zst, ...).
+    """
+    path = find_input(path)
+    source = source_name(path)
+    batch_hash = file_version(path)
+    store = RecordStore.open(store_dir)
+    ledger = Ledger.open(store_dir)
+    latest = ledger.latest(source)
+    if store is None or latest is None or latest['hash'] != batch_hash:
+        df, rejected = validate(read_records(path))
+        write_quarantine(rejected)
+        keys = record_keys(df)
+        if store is None:
+            is_new = np.ones(len(keys), dtype=bool)
+            store = RecordStore.build(df[RECORD_COLUMNS], store_dir, batch_hash)
+            ledger = Ledger.open(store_dir)
+        else:
+            is_new, missing = ledger.compare(keys, ledger.source_rows(source))
+            if len(missing):
+                # Хранилище только дописывается, поэтому отозванные записи убираются пересборкой
+                kept = np.setdiff1d(np.arange(len(store)), missing)
+                records = pd.concat([store.take(kept)[RECORD_COLUMNS], df.loc[is_new, RECORD_COLUMNS]], ignore_index=True)
+                store = RecordStore.build(records, store_dir, batch_hash)
+                ledger.keep(kept)
+            elif is_new.any():
+                store = store.append(df.loc[is_new, RECORD_COLUMNS], batch_hash)
+        ledger.record(batch_hash, path, keys[is_new], received=len(df))
+
+    TextIndex.update(store)
+    DuplicateIndex.update(store)
+    Anomalies.update(store)
+    SnapshotStore(snapshot_dir).save(Rollups.update(store), store.version)
+    if sql_engine() is not None:
+        SqlStore.update(store, sql_engine())
+    return store, store.version
+
+
+def reconcile(store, path=None):
+    """Сверка всего хранилища с выгрузкой: записи и часы файла против всех строк хранилища.
+
+    Ключи записей сравниваются как мультимножества, поэтому исправленная,
+    удаленная или лишняя запись дает расхождение даже при совпадении сумм;
+    строки, оставшиеся от других источников, - тоже.
+    """
+    path = find_input(path)
+    df, _ = validate(read_records(path))
+    ledger = Ledger.open(store.path)
+    return {
+        'file_records': len(df),
+        'file_hours': float(df['Hours'].sum()),
+        'store_records': len(store),
+        'store_hours': float(np.asarray(store.values['Hours']).sum()),
+        'matches': np.array_equal(np.sort(record_keys(df)), np.sort(ledger.keys))
+    }
@@ -0,0 +1,118 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from readers import source_name
+from record_store import row_hashes
+from validation import RECORD_COLUMNS
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def record_keys(df):
+    """Ключи записей: хеш содержимого и номер его повторения внутри пакета.
+
+    Повторная выгрузка тех же строк дает те же ключи, а законно повторяющиеся
+    одинаковые строки одного пакета (в табеле нет дат) получают разные ключи.
+    """
+    hashes = row_hashes(df[RECORD_COLUMNS])
+    occurrence = pd.Series(hashes).groupby(hashes, sort=False).cumcount().to_numpy(dtype=np.uint64)
+    return hashes * _MIX ^ pd.util.hash_array(occurrence)
+
+
+class Ledger:
+    """Журнал принятых пакетов и записей.
+
+    Пакет адресуется хешем содержимого файла, записи - ключами, которые
+    хранятся массивом в порядке строк хранилища (ключ i - строка i). Каждый
+    пакет помнит источник (имя файла без расширений формата и сжатия) и
+    файл, поэтому строки хранилища можно отнести к выгрузке, из которой они
+    пришли: полная выгрузка источника в любом формате заменяет его прежние
+    записи. Последний принятый файл источника
+    пропускается до разбора, а сравнение ключей идет через хеш-таблицу
+    pandas - O(1) на запись.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        keys_path = os.path.join(path, 'keys.npy')
+        batches_path = os.path.join(path, 'batches.json')
+        self.keys = np.load(keys_path) if os.path.exists(keys_path) else np.array([], dtype=np.uint64)
+        if os.path.exists(batches_path):
+            with open(batches_path, 'r', encoding='utf-8') as f:
+                self.batches = json.load(f)
+        else:
+            self.batches = []
+
+    @classmethod
+    def open(cls, store_dir):
+        """Журнал хранится внутри каталога хранилища и пересоздается вместе с ним"""
+        return cls(os.path.join(store_dir, 'ledger'))
+
+    def latest(self, source):
+        """Последний принятый пакет источника или None"""
+        return next((batch for batch in reversed(self.batches) if self._source(batch) == source), None)
+
+    def files(self):
+        """Файл последней выгрузки каждого источника"""
+        return {self._source(batch): batch.get('file', batch['source']) for batch in self.batches}
+
+    @staticmethod
+    def _source(batch):
+        # В журналах прежних версий источник - имя файла с расширениями
+        return source_name(batch['source'])
+
+    def batch_rows(self):
+        """Номер пакета для каждой строки хранилища"""
+        return np.repeat(np.arange(len(self.batches)), [batch['added'] for batch in self.batches])
+
+    def source_rows(self, source):
+        """Номера строк хранилища, пришедших из выгрузок источника"""
+        batches = [i for i, batch in enumerate(self.batches) if self._source(batch) == source]
+        return np.flatnonzero(np.isin(self.batch_rows(), batches))
+
+    def compare(self, keys, rows):
+        """Сравнение ключей новой выгрузки с ключами строк rows.
+
+        Возвращает маску новых ключей выгрузки и номера строк из rows,
+        ключей которых в выгрузке больше нет (запись исправлена или удалена).
+        """
+        known = pd.Index(self.keys[rows])
+        is_new = known.get_indexer(keys) < 0
+        missing = rows[pd.Index(keys).get_indexer(known) < 0]
+        return is_new, missing
+
+    def keep(self, rows):
+        """Оставить только строки rows (хранилище пересобрано без остальных)"""
+        kept = np.bincount(self.batch_rows()[rows], minlength=len(self.batches))
+        for batch, count in zip(self.batches, kept):
+            batch['retracted'] = batch.get('retracted', 0) + batch['added'] - int(count)
+            batch['added'] = int(count)
+        self.keys = self.keys[rows]
+
+    def record(self, batch_hash, path, keys, received):
+        """Зафиксировать пакет выгрузки path и ключи добавленных записей"""
+        self.keys = np.concatenate([self.keys, keys])
+        self.batches.append({
+            'hash': batch_hash,
+            'source': source_name(path),
+            'file': os.path.basename(path),
+            'received': received,
+            'added': int(len(keys)),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        self._save()
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, 'keys.npy.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.keys)
+        os.replace(tmp_path, os.path.join(self.path, 'keys.npy'))
+        tmp_path = os.path.join(self.path, 'batches.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.batches, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, 'batches.json'))
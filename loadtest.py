@@ -0,0 +1,253 @@
+"""Нагрузочный тест дашборда: N одновременных сессий на streamlit.testing (AppTest).
+
+Каждая сессия - отдельный AppTest в своем потоке; все сессии работают в
+одном процессе и делят st.cache_data/st.cache_resource, как сессии одного
+сервера. Сессия открывает страницу и выполняет случайные действия sidebar
+(тип графика, проекты, сотрудники, таблицы, записи, экспорт, сравнение), время каждого
+перезапуска скрипта записывается. Отчет в JSON сравнивается с прошлым:
+
+    python loadtest.py --sessions 8 --steps 20 -o report.json
+    python loadtest.py --sessions 8 --compare report.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+from memory import VIEW_CACHE
+from shadow import SHADOW
+
+APP_PATH = 'dashboard.py'
+# Веса действий: чаще всего меняют тип графика и фильтры
+ACTIONS = {
+    'chart_type': 4,
+    'project': 3,
+    'employee': 3,
+    'tables': 2,
+    'records': 1,
+    'export': 1,
+    'compare': 1
+}
+PERCENTILES = [50, 90, 95, 99]
+# Показатели, которые сравниваются между версиями (меньше - лучше, кроме пропускной способности)
+COMPARED = [('latency_ms', 'p50'), ('latency_ms', 'p95'), ('latency_ms', 'p99'), ('cold_start_ms', None),
+            ('throughput_rps', None), ('rss_mb', 'peak'), ('cache', 'mb')]
+
+
+def rss_mb():
+    """Текущий RSS процесса, МБ (без /proc - пиковый)"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler(threading.Thread):
+    """Фоновый замер RSS во время теста"""
+
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = [rss_mb()]
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.samples.append(rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append(rss_mb())
+
+
+def _widget(widgets, label):
+    """Первый виджет с подписью label или None, если его нет на странице"""
+    return next((w for w in widgets if w.label == label), None)
+
+
+class Session:
+    """Пользователь дашборда: открытие страницы и случайные действия sidebar"""
+
+    def __init__(self, app_path, seed, timeout):
+        self.app = AppTest.from_file(app_path, default_timeout=timeout)
+        self.rng = random.Random(seed)
+        self.results = []
+
+    def run(self, action):
+        started = time.perf_counter()
+        self.app.run()
+        seconds = time.perf_counter() - started
+        errors = [str(e.value).split('\n')[0][:200] for e in self.app.exception]
+        self.results.append({'action': action, 'seconds': seconds, 'errors': errors})
+
+    def step(self):
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        sidebar = self.app.sidebar
+        if action == 'chart_type':
+            widget = _widget(sidebar.radio, "📊 Тип графика")
+            if widget is not None:
+                widget.set_value(self.rng.choice(widget.options))
+        elif action in ('project', 'employee'):
+            widget = _widget(sidebar.multiselect, "📁 Проекты" if action == 'project' else "👤 Сотрудники")
+            if widget is not None:
+                widget.set_value(self.rng.sample(widget.options, self.rng.randint(0, min(2, len(widget.options)))))
+        else:
+            label = {'tables': "📋 Показать таблицы", 'records': "🔎 Исходные записи", 'export': "💾 Экспорт данных",
+                 'compare': "⚖️ Режим сравнения"}[action]
+            widget = _widget(sidebar.checkbox, label)
+            if widget is not None:
+                widget.set_value(not widget.value)
+        self.run(action)
+
+    def play(self, steps, think):
+        self.run('open')
+        for _ in range(steps):
+            if think > 0:
+                time.sleep(self.rng.uniform(0, 2 * think))
+            self.step()
+        return self.results
+
+
+def _latency(seconds):
+    values = np.asarray(seconds) * 1000
+    if len(values) == 0:
+        return {}
+    stats = {f'p{p}': round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+    stats['mean'] = round(float(values.mean()), 1)
+    stats['max'] = round(float(values.max()), 1)
+    return stats
+
+
+def _git_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def load_test(app_path=APP_PATH, sessions=4, steps=10, think=0.0, timeout=120, seed=0):
+    """Прогон сессий параллельно; отчет с перцентилями задержки, пропускной способностью и RSS"""
+    sampler = RssSampler()
+    sampler.start()
+    # Первое открытие отдельно: холодный старт с пустыми кешами
+    cold = Session(app_path, seed, timeout)
+    cold.run('open')
+    cold_start = cold.results[0]['seconds']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(Session(app_path, seed + i + 1, timeout).play, steps, think) for i in range(sessions)]
+        results = [r for future in futures for r in future.result()]
+    duration = time.perf_counter() - started
+    sampler.stop()
+
+    errors = {}
+    for r in results:
+        for error in r['errors']:
+            errors[error] = errors.get(error, 0) + 1
+    by_action = {}
+    for action in ['open'] + list(ACTIONS):
+        seconds = [r['seconds'] for r in results if r['action'] == action]
+        if seconds:
+            by_action[action] = dict(count=len(seconds), **_latency(seconds))
+    return {
+        'version': _git_version(),
+        'app': app_path,
+        'python': platform.python_version(),
+        'streamlit': streamlit.__version__,
+        'sessions': sessions,
+        'steps': steps,
+        'think_s': think,
+        'reruns': len(results),
+        'duration_s': round(duration, 2),
+        'throughput_rps': round(len(results) / duration, 2) if duration > 0 else 0,
+        'cold_start_ms': round(cold_start * 1000, 1),
+        'latency_ms': _latency([r['seconds'] for r in results]),
+        'by_action': by_action,
+        'rss_mb': {
+            'start': round(sampler.samples[0], 1),
+            'peak': round(max(sampler.samples), 1),
+            'end': round(sampler.samples[-1], 1)
+        },
+        # Кеш видов общий для сессий процесса - тот же, что у дашборда
+        'cache': VIEW_CACHE.stats(),
+        # Теневая проверка итогов (KMGA_SHADOW_PERCENT > 0)
+        'shadow': SHADOW.stats(),
+        'errors': errors
+    }
+
+
+def compare(report, baseline):
+    """Изменение показателей относительно прошлого отчета, %"""
+    changes = {}
+    for section, key in COMPARED:
+        before = baseline.get(section)
+        after = report.get(section)
+        if key is not None:
+            before = (before or {}).get(key)
+            after = (after or {}).get(key)
+        if before and after is not None:
+            changes[f'{section}.{key}' if key else section] = round((after - before) / before * 100, 1)
+    return changes
+
+
+def print_report(report, changes=None):
+    latency = report['latency_ms']
+    print(f"✅ {report['sessions']} сессий, {report['reruns']} перезапусков за {report['duration_s']} с: "
+          f"{report['throughput_rps']} перезапусков/с")
+    print(f"   Холодный старт: {report['cold_start_ms']:,.0f} мс")
+    print("   Задержка, мс: " + ", ".join(f"{k} {v:,.0f}" for k, v in latency.items()))
+    for action, stats in report['by_action'].items():
+        print(f"   {action}: {stats['count']} × p50 {stats['p50']:,.0f} / p95 {stats['p95']:,.0f} мс")
+    print(f"   RSS, МБ: {report['rss_mb']['start']:,.0f} → пик {report['rss_mb']['peak']:,.0f}")
+    cache = report.get('cache')
+    if cache:
+        print(f"   Кеш видов: {cache['entries']} записей, {cache['mb']:,.1f} из {cache['budget_mb']:,.1f} МБ, "
+              f"попаданий {cache['hits']}, промахов {cache['misses']}, вытеснений "
+              + ", ".join(f"{reason} {count}" for reason, count in cache['evictions'].items()))
+    shadow = report.get('shadow')
+    if shadow and shadow['checks']:
+        print(f"   Теневая проверка: {shadow['checks']} сравнений, расхождений {shadow['mismatches']}, "
+              f"эталон медленнее в {shadow['ratio_p50']:,.1f} раз (p95 {shadow['ratio_p95']:,.1f})")
+    for error, count in report['errors'].items():
+        print(f"⚠️ Ошибка ×{count}: {error}")
+    if changes:
+        print("🔄 По сравнению с прошлым отчетом: " + ", ".join(f"{k} {v:+.1f}%" for k, v in changes.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный тест дашборда одновременными сессиями")
+    parser.add_argument('--app', default=APP_PATH, help="скрипт приложения Streamlit")
+    parser.add_argument('--sessions', type=int, default=4, help="одновременных сессий")
+    parser.add_argument('--steps', type=int, default=10, help="действий на сессию после открытия")
+    parser.add_argument('--think', type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument('--timeout', type=float, default=120, help="предел одного перезапуска, с")
+    parser.add_argument('--seed', type=int, default=0, help="зерно случайных действий")
+    parser.add_argument('-o', '--output', help="сохранить отчет в JSON")
+    parser.add_argument('--compare', help="отчет JSON прошлой версии для сравнения")
+    args = parser.parse_args()
+
+    report = load_test(args.app, args.sessions, args.steps, args.think, args.timeout, args.seed)
+    changes = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            changes = compare(report, json.load(f))
+        report['compared_to'] = {'path': args.compare, 'changes_pct': changes}
+    print_report(report, changes)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,202 @@
+import functools
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perflog import get_logger
+
+logger = get_logger('memory')
+
+MB = 1 << 20
+# Бюджеты кеша видов (отфильтрованные итоги, таблицы, фигуры), МБ, и срок жизни записи, с
+GLOBAL_BUDGET_MB = float(os.environ.get('KMGA_CACHE_MB', 512))
+SESSION_BUDGET_MB = float(os.environ.get('KMGA_SESSION_CACHE_MB', 128))
+CACHE_TTL = float(os.environ.get('KMGA_CACHE_TTL', 3600))
+# Как часто писать в лог текущее использование, с
+LOG_INTERVAL = 60
+
+
+def sizeof(value):
+    """Примерный размер значения в памяти, байт"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sum(sizeof(v) for v in value.values())
+    # Остальное (фигуры plotly и т.п.) - по размеру сериализованного значения
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def freeze(value):
+    """Хешируемый ключ из аргументов: словари и списки - в кортежи"""
+    if isinstance(value, dict):
+        return tuple((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class MemoryCache:
+    """Кеш с учетом памяти: общий бюджет, бюджет сессии, LRU и срок жизни.
+
+    Запись принадлежит сессии, которая ее посчитала (owner() - id сессии
+    или None вне сессии, например при прогреве). Если сессия превышает
+    свой бюджет, вытесняются ее самые давние записи; если превышен общий
+    бюджет - самые давние записи всех сессий. Значения отдаются без
+    копирования: вызывающий код их не изменяет.
+    """
+
+    def __init__(self, budget_mb=GLOBAL_BUDGET_MB, session_budget_mb=SESSION_BUDGET_MB, ttl=CACHE_TTL, owner=None):
+        self.budget = budget_mb * MB
+        self.session_budget = session_budget_mb * MB
+        self.ttl = ttl
+        self.owner = owner or (lambda: None)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.session_bytes = {}
+        # Наборы данных версии (не вытесняются, но занимают общий бюджет)
+        self.pinned = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {'ttl': 0, 'session': 0, 'global': 0}
+        self._lock = threading.RLock()
+        self._logged = time.monotonic()
+
+    def get(self, key):
+        """(найдено, значение); просроченная запись удаляется"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry['time'] > self.ttl:
+                self._evict(key, 'ttl')
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry['value']
+
+    def put(self, key, value, name=''):
+        size = sizeof(value)
+        owner = self.owner()
+        with self._lock:
+            if key in self.entries:
+                self._evict(key, None)
+            self.entries[key] = {'value': value, 'size': size, 'owner': owner, 'name': name, 'time': time.monotonic()}
+            self.bytes += size
+            self.session_bytes[owner] = self.session_bytes.get(owner, 0) + size
+            self._enforce(owner)
+            if time.monotonic() - self._logged > LOG_INTERVAL:
+                self.log_usage()
+
+    def pin(self, name, value):
+        """Учесть размер набора данных, который хранится вне кеша видов (например, в st.cache_data)"""
+        size = sizeof(value)
+        with self._lock:
+            self.bytes += size - self.pinned.get(name, 0)
+            self.pinned[name] = size
+            self._enforce(None)
+
+    def _evict(self, key, reason):
+        entry = self.entries.pop(key)
+        self.bytes -= entry['size']
+        self.session_bytes[entry['owner']] -= entry['size']
+        if self.session_bytes[entry['owner']] <= 0:
+            del self.session_bytes[entry['owner']]
+        if reason is not None:
+            self.evictions[reason] += 1
+
+    def _enforce(self, owner):
+        """Вытеснить давние записи сессии owner, затем любые, пока бюджеты не соблюдены"""
+        evicted = {'ttl': 0, 'session': 0, 'global': 0}
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items() if now - entry['time'] > self.ttl]:
+            self._evict(key, 'ttl')
+            evicted['ttl'] += 1
+        # Вне сессии (прогрев) действует только общий бюджет
+        if owner is not None:
+            for key in [key for key, entry in self.entries.items() if entry['owner'] == owner]:
+                if self.session_bytes.get(owner, 0) <= self.session_budget or len(self.entries) == 1:
+                    break
+                self._evict(key, 'session')
+                evicted['session'] += 1
+        while self.bytes > self.budget and len(self.entries) > (1 if owner is not None else 0):
+            self._evict(next(iter(self.entries)), 'global')
+            evicted['global'] += 1
+        if any(evicted.values()):
+            # Каждое вытеснение - в отладочный лог, итоги - в периодическую сводку log_usage
+            logger.debug("Вытеснено из кеша: " + ", ".join(f"{reason} {count}" for reason, count in evicted.items() if count)
+                         + f"; занято {self.bytes / MB:,.1f} из {self.budget / MB:,.1f} МБ")
+
+    def stats(self):
+        """Использование памяти: всего, по функциям и сессиям, попадания и вытеснения"""
+        with self._lock:
+            by_name = dict(self.pinned)
+            for entry in self.entries.values():
+                by_name[entry['name']] = by_name.get(entry['name'], 0) + entry['size']
+            return {
+                'entries': len(self.entries),
+                'mb': round(self.bytes / MB, 2),
+                'pinned_mb': round(sum(self.pinned.values()) / MB, 2),
+                'budget_mb': round(self.budget / MB, 2),
+                'session_budget_mb': round(self.session_budget / MB, 2),
+                'sessions': len([owner for owner in self.session_bytes if owner is not None]),
+                'max_session_mb': round(max([b for o, b in self.session_bytes.items() if o is not None], default=0) / MB, 2),
+                'by_name_mb': {name: round(size / MB, 2) for name, size in sorted(by_name.items(), key=lambda x: -x[1])},
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': dict(self.evictions)
+            }
+
+    def log_usage(self):
+        stats = self.stats()
+        self._logged = time.monotonic()
+        logger.info(
+            f"Кеш видов: {stats['entries']} записей, {stats['mb']:,.1f} из {stats['budget_mb']:,.1f} МБ, "
+            f"сессий {stats['sessions']} (больше всех {stats['max_session_mb']:,.1f} МБ), "
+            f"попаданий {stats['hits']}, промахов {stats['misses']}, вытеснений "
+            + ", ".join(f"{reason} {count}" for reason, count in stats['evictions'].items())
+            + "; " + ", ".join(f"{name} {mb:,.1f} МБ" for name, mb in stats['by_name_mb'].items())
+        )
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = sum(self.pinned.values())
+            self.session_bytes = {}
+
+
+# Общий для всех сессий процесса: модуль импортируется один раз, в отличие от скрипта дашборда
+VIEW_CACHE = MemoryCache()
+
+
+def cached(name=None, cache=None):
+    """Декоратор: результат функции - в кеш видов по имени функции и аргументам.
+
+    Повторный запуск скрипта Streamlit заново определяет функцию, но ключи
+    строятся по имени, поэтому записи переживают перезапуски.
+    """
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            target = cache or VIEW_CACHE
+            key = (label, freeze(args), freeze(kwargs))
+            found, value = target.get(key)
+            if not found:
+                value = fn(*args, **kwargs)
+                target.put(key, value, label)
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,17 @@
+import logging
+
+# Общий логгер производительности: прогрев, память кешей и т.п. пишут в kmga.<раздел>
+ROOT_LOGGER = 'kmga'
+
+
+def get_logger(name):
+    """Логгер kmga.<name>; свой обработчик - сообщения видны в логе сервера
+    при любой настройке корневого логгера (Streamlit его не настраивает)"""
+    root = logging.getLogger(ROOT_LOGGER)
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        root.propagate = False
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
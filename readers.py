@@ -0,0 +1,158 @@
+import gzip
+import io
+import json
+import os
+
+import pandas as pd
+
+from validation import RAW_COLUMN
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Выгрузки по умолчанию: берется первая найденная (или путь из KMGA_DATA)
+INPUT_CANDIDATES = [
+    'data.json', 'data.json.zst', 'data.json.gz',
+    'data.ndjson', 'data.ndjson.zst', 'data.ndjson.gz',
+    'data.csv', 'data.csv.zst', 'data.csv.gz',
+    'data.xlsx'
+]
+# Форматы по расширению файла (после снятия расширения сжатия)
+FORMATS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv', '.xlsx': 'excel'}
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+# Записей в одной части
+CHUNK_ROWS = 100_000
+
+
+def find_input(path=None):
+    """Путь выгрузки: явный, из KMGA_DATA или первый найденный из INPUT_CANDIDATES"""
+    if path:
+        return path
+    if os.environ.get('KMGA_DATA'):
+        return os.environ['KMGA_DATA']
+    return next((candidate for candidate in INPUT_CANDIDATES if os.path.exists(candidate)), INPUT_CANDIDATES[0])
+
+
+def source_name(path):
+    """Источник выгрузки - имя файла без расширений формата и сжатия: data.json и data.json.zst - один источник"""
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    if ext.lower() in COMPRESSIONS:
+        stem, ext = os.path.splitext(stem)
+    return stem if ext.lower() in FORMATS else name
+
+
+def input_format(path):
+    """(формат, сжатие) по расширениям файла, например data.csv.gz -> ('csv', 'gzip')"""
+    name, ext = os.path.splitext(path.lower())
+    compression = COMPRESSIONS.get(ext)
+    if compression is not None:
+        name, ext = os.path.splitext(name)
+    if ext not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {path} (поддерживаются {', '.join(FORMATS)})")
+    if FORMATS[ext] == 'excel' and compression is not None:
+        raise ValueError(f"Файл Excel уже сжат, дополнительное сжатие не поддерживается: {path}")
+    return FORMATS[ext], compression
+
+
+def open_input(path):
+    """Двоичный поток выгрузки; сжатый файл распаковывается по мере чтения"""
+    _, compression = input_format(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("Для выгрузок .zst нужен пакет zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def _records_frame(records):
+    """Часть записей JSON: элементы, которые не являются объектами, - в колонку RAW_COLUMN"""
+    return pd.DataFrame([r if isinstance(r, dict) else {RAW_COLUMN: json.dumps(r, ensure_ascii=False)} for r in records])
+
+
+def _batched(items, chunk_rows):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == chunk_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_records(f):
+    """Элементы массива data выгрузки n8n: потоково через ijson, без него - разбором целиком"""
+    if ijson is not None:
+        yield from ijson.items(f, 'data.item', use_float=True)
+    else:
+        yield from json.load(f)['data']
+
+
+def _ndjson_records(f):
+    for line in io.TextIOWrapper(f, encoding='utf-8-sig'):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _excel_chunks(path, chunk_rows):
+    """Первый лист книги построчно (режим только чтения openpyxl), первая строка - заголовки"""
+    if openpyxl is None:
+        raise ImportError("Для выгрузок Excel нужен пакет openpyxl (pip install openpyxl)")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(name).strip() for name in next(rows, ())]
+        for batch in _batched(rows, chunk_rows):
+            yield pd.DataFrame(batch, columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Записи выгрузки частями по chunk_rows строк с исходными колонками.
+
+    Проверка и нормализация - дело validate(): значения передаются как
+    есть (CSV - строками), чтобы ошибки типов попадали в карантин.
+    """
+    fmt, _ = input_format(path)
+    if fmt == 'excel':
+        yield from _excel_chunks(path, chunk_rows)
+        return
+    with open_input(path) as f:
+        if fmt == 'csv':
+            # BOM в начале файла (экспорт для Excel) снимается кодировкой utf-8-sig
+            yield from pd.read_csv(f, dtype=str, encoding='utf-8-sig', chunksize=chunk_rows)
+            return
+        records = _json_records(f) if fmt == 'json' else _ndjson_records(f)
+        for batch in _batched(records, chunk_rows):
+            yield _records_frame(batch)
+
+
+def read_input(path, chunk_rows=CHUNK_ROWS):
+    """Все записи выгрузки одной таблицей, собранной из частей.
+
+    Части снижают память только на разборе (JSON не держится в памяти
+    целиком вместе с таблицей): проверка и загрузка получают всю выгрузку
+    сразу, поэтому пик памяти - таблица всех записей. validate() приводит
+    регистр к самому частому написанию по всей выгрузке, а ключи журнала
+    нумеруют повторы записи внутри пакета, так что по частям их считать нельзя.
+    """
+    chunks = list(read_chunks(path, chunk_rows))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
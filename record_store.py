@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = '.kmga_store'
+
+
+class RecordStore:
+    """Колоночное хранилище очищенных записей на диске.
+
+    Текстовые колонки хранятся словарным кодированием (<col>.codes.npy + <col>.dict.json),
+    числовые - как есть (<col>.npy). Файлы открываются через memmap, поэтому
+    фильтрация и сортировка идут по компактным массивам кодов, а в DataFrame
+    превращается только запрошенная страница.
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.version = meta['version']
+        self.rows = meta['rows']
+        self.columns = meta['columns']
+        self.text_columns = meta['text_columns']
+        self.codes = {}
+        self.dictionaries = {}
+        self.values = {}
+        for col in self.columns:
+            if col in self.text_columns:
+                self.codes[col] = np.load(os.path.join(path, f'{col}.codes.npy'), mmap_mode='r')
+                with open(os.path.join(path, f'{col}.dict.json'), 'r', encoding='utf-8') as f:
+                    self.dictionaries[col] = np.array(json.load(f), dtype=object)
+            else:
+                self.values[col] = np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r')
+        self.row_hashes = np.load(os.path.join(path, 'row_hashes.npy'), mmap_mode='r')
+        self._sort_orders = {}
+
+    def __len__(self):
+        return self.rows
+
+    @classmethod
+    def open(cls, path=STORE_DIR):
+        """Открыть хранилище или вернуть None, если оно еще не собрано"""
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        return cls(path)
+
+    @classmethod
+    def build(cls, df, path=STORE_DIR, version=''):
+        """Записать записи в хранилище (во временный каталог, затем подмена)"""
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        text_columns = []
+        for col in df.columns:
+            series = df[col]
+            if pd.api.types.is_numeric_dtype(series):
+                np.save(os.path.join(tmp_path, f'{col}.npy'), series.to_numpy(dtype=np.float64))
+                continue
+            codes, uniques = pd.factorize(series, sort=True)
+            np.save(os.path.join(tmp_path, f'{col}.codes.npy'), codes.astype(np.int32))
+            with open(os.path.join(tmp_path, f'{col}.dict.json'), 'w', encoding='utf-8') as f:
+                json.dump([str(v) for v in uniques], f, ensure_ascii=False)
+            text_columns.append(col)
+
+        np.save(os.path.join(tmp_path, 'row_hashes.npy'), row_hashes(df))
+
+        meta = {
+            'version': version,
+            'rows': len(df),
+            'columns': list(df.columns),
+            'text_columns': text_columns
+        }
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def append(self, df, version):
+        """Дописать новые записи в конец хранилища.
+
+        Коды существующих значений не меняются, новые значения добавляются
+        в конец словаря. Файлы подменяются через os.replace, поэтому уже
+        открытые memmap других процессов остаются валидными.
+        """
+        for col in self.columns:
+            if col in self.text_columns:
+                dictionary = pd.Index(self.dictionaries[col])
+                codes = dictionary.get_indexer(df[col])
+                new_values = pd.unique(df[col][codes < 0])
+                if len(new_values):
+                    dictionary = dictionary.append(pd.Index(new_values, dtype=object))
+                    codes = dictionary.get_indexer(df[col])
+                    _write_json(os.path.join(self.path, f'{col}.dict.json'), [str(v) for v in dictionary])
+                _write_npy(os.path.join(self.path, f'{col}.codes.npy'),
+                           np.concatenate([self.codes[col], codes.astype(np.int32)]))
+            else:
+                _write_npy(os.path.join(self.path, f'{col}.npy'),
+                           np.concatenate([self.values[col], df[col].to_numpy(dtype=np.float64)]))
+        _write_npy(os.path.join(self.path, 'row_hashes.npy'), np.concatenate([self.row_hashes, row_hashes(df)]))
+
+        meta = {
+            'version': version,
+            'rows': self.rows + len(df),
+            'columns': self.columns,
+            'text_columns': self.text_columns
+        }
+        _write_json(os.path.join(self.path, 'meta.json'), meta)
+        return type(self)(self.path)
+
+    def value_codes(self, col, values):
+        """Коды значений словаря колонки (неизвестные значения пропускаются)"""
+        indexer = pd.Index(self.dictionaries[col]).get_indexer(list(values))
+        return indexer[indexer >= 0]
+
+    def select(self, equals=None, rows=None):
+        """Номера строк, прошедших фильтры.
+
+        equals: {колонка: список допустимых значений}
+        rows: ограничение заранее отобранными строками (например, результатом поиска)
+        """
+        if rows is None:
+            rows = np.arange(self.rows)
+        for col, values in (equals or {}).items():
+            rows = rows[np.isin(self.codes[col][rows], self.value_codes(col, values))]
+        return rows
+
+    def sort_order(self, col, ascending=True):
+        """Перестановка всех строк по колонке (считается один раз и кешируется)"""
+        key = (col, ascending)
+        if key not in self._sort_orders:
+            if col in self.text_columns:
+                # Ранг значения в словаре - порядок сортировки строк
+                rank = np.empty(len(self.dictionaries[col]), dtype=np.int64)
+                rank[np.argsort(self.dictionaries[col].astype(str), kind='stable')] = np.arange(len(rank))
+                values = rank[self.codes[col]]
+            else:
+                values = np.asarray(self.values[col])
+            self._sort_orders[key] = np.argsort(values if ascending else -values, kind='stable')
+        return self._sort_orders[key]
+
+    def page(self, rows, sort_by=None, ascending=True, offset=0, limit=50):
+        """Страница записей из rows с сортировкой; материализуются только limit строк"""
+        if sort_by is not None:
+            order = self.sort_order(sort_by, ascending)
+            if len(rows) < self.rows:
+                selected = np.zeros(self.rows, dtype=bool)
+                selected[rows] = True
+                order = order[selected[order]]
+            rows = order
+        return self.take(rows[offset:offset + limit])
+
+    def take(self, rows):
+        """Декодирование строк rows в DataFrame"""
+        data = {}
+        for col in self.columns:
+            if col in self.text_columns:
+                data[col] = self.dictionaries[col][self.codes[col][rows]]
+            else:
+                data[col] = np.asarray(self.values[col][rows])
+        return pd.DataFrame(data, columns=self.columns)
+
+    def aggregate(self, keys, rows=None, value='Hours'):
+        """Сумма value по ключам для строк rows (по умолчанию всех) - на кодах, без декодирования строк"""
+        if rows is None:
+            rows = np.arange(self.rows)
+        group = np.zeros(len(rows), dtype=np.int64)
+        for col in keys:
+            # Коды групп остаются плотными, поэтому произведение не переполняется
+            group, _ = pd.factorize(group * len(self.dictionaries[col]) + self.codes[col][rows])
+        n_groups = group.max() + 1 if len(group) else 0
+        first = np.full(n_groups, len(rows), dtype=np.int64)
+        np.minimum.at(first, group, np.arange(len(rows)))
+        result = pd.DataFrame({
+            col: self.dictionaries[col][self.codes[col][rows[first]]] for col in keys
+        })
+        result[value] = np.bincount(group, weights=self.values[value][rows], minlength=n_groups)
+        return result.sort_values(keys).reset_index(drop=True)
+
+
+def row_hashes(df):
+    """64-битные хеши содержимого строк (числа приводятся к float64, как в хранилище)"""
+    numeric = {col: np.float64 for col in df.columns if pd.api.types.is_numeric_dtype(df[col])}
+    return pd.util.hash_pandas_object(df.astype(numeric), index=False).to_numpy()
+
+
+def _write_npy(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
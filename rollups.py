@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Иерархия итогов: Клиент → Проект → Сотрудник → Активность
+LEVELS = ['Client', 'Project_No', 'Employee', 'Activity']
+# Атрибуты проекта переносятся в итоги любого уровня с проектом (нужны для подписей)
+PROJECT_ATTRIBUTES = ['Client', 'Project_Description']
+PATH_COLUMNS = LEVELS + ['Project_Description']
+# Уровни, которые материализуются сразу: префиксы иерархии и отдельные измерения
+MATERIALIZED_LEVELS = [
+    ['Client'],
+    ['Client', 'Project_No'],
+    ['Client', 'Project_No', 'Employee'],
+    LEVELS,
+    ['Project_No'],
+    ['Employee'],
+    ['Activity'],
+    ['Employee', 'Project_No']
+]
+
+
+def _group_codes(codes, sizes):
+    """Плотные номера групп по нескольким колонкам кодов"""
+    group = np.zeros(len(codes[0]) if codes else 0, dtype=np.int64)
+    for col_codes, size in zip(codes, sizes):
+        group, _ = pd.factorize(group * size + col_codes)
+    return group
+
+
+class Rollups:
+    """Итоги часов по всем уровням иерархии.
+
+    Основа - итоги по полным путям (коды словарей хранилища и сумма часов),
+    остальные уровни сворачиваются из них по кодам. Пути хранятся рядом с
+    хранилищем вместе с номером пути каждой строки и при дозагрузке
+    досчитываются только по новым строкам; уровни материализуются один раз
+    на объект (версию данных).
+    """
+
+    FILE_NAME = 'rollups.npz'
+
+    def __init__(self, store, rows, codes, hours, row_paths=None):
+        self.store = store
+        self.rows = rows
+        self.codes = codes
+        self.hours = hours
+        self._row_paths = row_paths
+        self._table = None
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.hours)
+
+    @classmethod
+    def rollup_path(cls, store):
+        return os.path.join(store.path, cls.FILE_NAME)
+
+    @classmethod
+    def open(cls, store):
+        """Прочитать итоги хранилища или вернуть None"""
+        path = cls.rollup_path(store)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            codes = {col: data[col] for col in PATH_COLUMNS}
+            # Файлы прежних версий без номеров путей строк - номера считаются при первом запросе
+            row_paths = data['row_paths'] if 'row_paths' in data.files else None
+            return cls(store, int(data['rows']), codes, data['hours'], row_paths)
+
+    @classmethod
+    def update(cls, store):
+        """Досчитать итоги путей по строкам, добавленным после прошлого обновления"""
+        rollups = cls.open(store)
+        if rollups is not None and rollups.rows == len(store) and rollups._row_paths is not None:
+            return rollups
+        if rollups is None or rollups.rows > len(store):
+            rollups = cls(store, 0, {col: np.array([], dtype=np.int32) for col in PATH_COLUMNS}, np.array([]),
+                          np.array([], dtype=np.int32))
+
+        start, stop = rollups.rows, len(store)
+        codes, hours, group = cls._collapse(
+            {col: np.concatenate([rollups.codes[col], store.codes[col][start:stop]]) for col in PATH_COLUMNS},
+            np.concatenate([rollups.hours, np.asarray(store.values['Hours'][start:stop])]),
+            store
+        )
+        # Прежние пути уникальны и идут первыми, поэтому сохраняют свои номера
+        row_paths = np.concatenate([rollups.row_paths(), group[len(rollups):]]).astype(np.int32)
+        path = cls.rollup_path(store)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, rows=np.int64(stop), hours=hours, row_paths=row_paths, **codes)
+        os.replace(path + '.tmp', path)
+        return cls(store, stop, codes, hours, row_paths)
+
+    @staticmethod
+    def _collapse(codes, hours, store):
+        """Свернуть строки с одинаковыми путями"""
+        group = _group_codes([codes[col] for col in PATH_COLUMNS], [len(store.dictionaries[col]) for col in PATH_COLUMNS])
+        n_groups = group.max() + 1 if len(group) else 0
+        first = np.full(n_groups, len(group), dtype=np.int64)
+        np.minimum.at(first, group, np.arange(len(group)))
+        collapsed = {col: codes[col][first] for col in PATH_COLUMNS}
+        return collapsed, np.bincount(group, weights=hours, minlength=n_groups), group
+
+    def take(self, positions):
+        """Итоги по части путей (например, одного клиента) с теми же словарями хранилища"""
+        positions = np.asarray(positions)
+        return Rollups(self.store, self.rows, {col: self.codes[col][positions] for col in PATH_COLUMNS}, self.hours[positions])
+
+    def row_paths(self):
+        """Номер пути для каждой из rows первых строк хранилища"""
+        if self._row_paths is None:
+            # Пути итогов уникальны и идут первыми - строки получают номера совпадающих путей
+            group = _group_codes(
+                [np.concatenate([self.codes[col], self.store.codes[col][:self.rows]]) for col in PATH_COLUMNS],
+                [len(self.store.dictionaries[col]) for col in PATH_COLUMNS]
+            )
+            self._row_paths = group[len(self):].astype(np.int32)
+        return self._row_paths
+
+    def restrict(self, rows):
+        """Итоги по строкам хранилища rows (например, найденным поиском) без сохранения.
+
+        Один bincount по номерам путей найденных строк; пути без найденных
+        строк отбрасываются, остальные идут в порядке путей всего хранилища.
+        """
+        rows = np.asarray(rows)
+        paths = self.row_paths()[rows]
+        counts = np.bincount(paths, minlength=len(self))
+        hours = np.bincount(paths, weights=np.asarray(self.store.values['Hours'])[rows], minlength=len(self))
+        positions = np.flatnonzero(counts)
+        return Rollups(self.store, self.rows, {col: self.codes[col][positions] for col in PATH_COLUMNS}, hours[positions])
+
+    def table(self):
+        """Итоги по полным путям в виде таблицы; номера строк - позиции для level(rows=...)"""
+        if self._table is None:
+            self._table = self._decode(PATH_COLUMNS, np.arange(len(self)), self.hours)
+        return self._table
+
+    def level(self, keys, rows=None):
+        """Итоги уровня keys по путям rows (по умолчанию всем), отсортированные по ключам"""
+        if rows is not None:
+            return self._rollup(keys, np.asarray(rows))
+        level_key = tuple(keys)
+        if level_key not in self._levels:
+            self._levels[level_key] = self._rollup(keys, np.arange(len(self)))
+        return self._levels[level_key].copy()
+
+    def materialize(self):
+        """Посчитать все уровни MATERIALIZED_LEVELS заранее"""
+        for keys in MATERIALIZED_LEVELS:
+            self.level(keys)
+        return self
+
+    def _rollup(self, keys, rows):
+        group = _group_codes([self.codes[col][rows] for col in keys], [len(self.store.dictionaries[col]) for col in keys])
+        n_groups = group.max() + 1 if len(group) else 0
+        first = np.full(n_groups, len(rows), dtype=np.int64)
+        np.minimum.at(first, group, np.arange(len(rows)))
+        columns = list(keys)
+        if 'Project_No' in keys:
+            columns += [col for col in PROJECT_ATTRIBUTES if col not in keys]
+        hours = np.bincount(group, weights=self.hours[rows], minlength=n_groups)
+        return self._decode(columns, rows[first], hours).sort_values(list(keys)).reset_index(drop=True)
+
+    def _decode(self, columns, rows, hours):
+        result = pd.DataFrame({col: self.store.dictionaries[col][self.codes[col][rows]] for col in columns})
+        result['Hours'] = hours
+        return result
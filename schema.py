@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# Измерения: ключевая колонка и атрибуты члена измерения
+DIMENSIONS = {
+    'Employee': ('Employee', []),
+    'Project': ('Project_No', ['Client', 'Project_Description']),
+    'Client': ('Client', []),
+    'Activity': ('Activity', [])
+}
+# Порядок колонок широкой таблицы (метки измерений добавляются следом)
+WIDE_COLUMNS = ['Employee', 'Project_No', 'Client', 'Activity', 'Project_Description']
+
+
+class StarSchema:
+    """Факты с целочисленными ключами измерений и таблицы измерений.
+
+    Факт - итог часов по полному пути иерархии (строки в порядке путей
+    rollups, поэтому номера строк фильтров подходят и к фактам). Измерение -
+    по строке на член с ключом, атрибутами и метками; метки добавляются в
+    измерение один раз и разносятся по строкам выборкой по ключу.
+    """
+
+    def __init__(self, facts, dimensions):
+        self.facts = facts
+        self.dimensions = dimensions
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.facts)
+
+    @classmethod
+    def from_rollups(cls, rollups):
+        facts = {}
+        dimensions = {}
+        for name, (key, attributes) in DIMENSIONS.items():
+            ids, codes = pd.factorize(rollups.codes[key])
+            first = np.zeros(len(codes), dtype=np.intp)
+            first[ids[::-1]] = np.arange(len(ids))[::-1]
+            dimension = pd.DataFrame({key: rollups.store.dictionaries[key][codes]})
+            for col in attributes:
+                dimension[col] = rollups.store.dictionaries[col][rollups.codes[col][first]]
+            dimensions[name] = dimension
+            facts[f'{name.lower()}_id'] = ids.astype(np.int32)
+        facts['Hours'] = rollups.hours
+        return cls(pd.DataFrame(facts), dimensions)
+
+    def dimension(self, name):
+        """Таблица измерения, отсортированная по ключу"""
+        key = DIMENSIONS[name][0]
+        return self.dimensions[name].sort_values(key).reset_index(drop=True)
+
+    def options(self, name):
+        """Отсортированные значения ключа измерения - варианты фильтра"""
+        return self.dimension(name)[DIMENSIONS[name][0]].tolist()
+
+    def wide(self, rows=None):
+        """Факты с развернутыми ключами, атрибутами и метками измерений"""
+        facts = self.facts if rows is None else self.facts.iloc[rows]
+        result = pd.DataFrame(index=pd.RangeIndex(len(facts)))
+        columns = {}
+        # Сначала ключи измерений, затем атрибуты и метки, которых еще нет
+        for keys_only in (True, False):
+            for name, dimension in self.dimensions.items():
+                ids = facts[f'{name.lower()}_id'].to_numpy()
+                for col in dimension.columns[:1] if keys_only else dimension.columns[1:]:
+                    if col not in columns:
+                        columns[col] = dimension[col].to_numpy()[ids]
+        order = WIDE_COLUMNS + [col for col in columns if col not in WIDE_COLUMNS]
+        for col in order:
+            result[col] = columns[col]
+        result['Hours'] = facts['Hours'].to_numpy()
+        return result
+
+    def attach(self, totals, name):
+        """Добавить к итогам атрибуты и метки измерения по его ключу"""
+        key = DIMENSIONS[name][0]
+        dimension = self.dimensions[name]
+        if name not in self._positions:
+            self._positions[name] = pd.Index(dimension[key])
+        ids = self._positions[name].get_indexer(totals[key])
+        for col in dimension.columns:
+            if col not in totals.columns:
+                totals[col] = dimension[col].to_numpy()[ids]
+        return totals
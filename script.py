@@ -1,164 +1,437 @@
+"""Сборка дашборда для GitHub Pages из выгрузки n8n.
+
+    python script.py                          # data.json -> index.html
+    python script.py -i data.json -o dashboard.json
+    python script.py -i export.csv.gz         # сжатые JSON/NDJSON/CSV и Excel
+    python script.py --check                  # проверка и сводка без plotly
+    python script.py --timings                # время импорта и этапов
+    python script.py --per-client             # плюс отчет по каждому клиенту в reports/
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import html
+import importlib
+import importlib.util
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import json
-
-# 1. Загрузка данных
-print("📊 Загрузка данных...")
-with open('data.json', 'r', encoding='utf-8') as f:
-    raw = json.load(f)
-
-df = pd.DataFrame(raw['data'])
-
-# Очистка: только записи с часами > 0
-df = df[df['Hours'] > 0].copy()
-
-# Улучшение данных
-df['Employee'] = df['Employee'].str.strip()
-df['Project_No'] = df['Project_No'].str.strip()
-df['Client'] = df['Client'].str.strip()
-df['Activity'] = df['Activity'].str.strip()
-
-# Улучшенная маркировка проектов
-df['Project_Name'] = df['Project_No'] + "<br>" + df['Project_Description'].str[:30] + "..."
-
-print(f"✅ Данные загружены: {len(df)} записей")
-
-# 2. Создаем дашборд с несколькими графиками
-print("📈 Создание графиков...")
-
-# Создаем subplots: 3 строки, 2 колонки
-fig = make_subplots(
-    rows=3, cols=2,
-    subplot_titles=(
-        "<b>Затраты времени по сотрудникам (Stacked Bar)</b>",
-        "<b>Доли проектов в общих часах (%)</b>",
-        "<b>Сравнение проектов (Line Chart)</b>",
-        "<b>Распределение по клиентам (%)</b>",
-        "<b>Heatmap: Сотрудники × Проекты</b>",
-        "<b>Распределение по активностям (%)</b>"
-    ),
-    vertical_spacing=0.12,
-    horizontal_spacing=0.1,
-    specs=[
-        [{"type": "bar"}, {"type": "pie"}],
-        [{"type": "scatter"}, {"type": "pie"}],
-        [{"type": "heatmap"}, {"type": "pie"}]
-    ]
-)
-
-# График 1: Stacked Bar Chart - затраты по сотрудникам
-for emp in sorted(df['Employee'].unique()):
-    temp = df[df['Employee'] == emp].groupby('Project_No')['Hours'].sum().reset_index()
+
+from backend import RollupBackend, open_backend
+from ingest import ingest, reconcile
+from record_store import RecordStore
+from rollups import Rollups
+from snapshots import SnapshotStore, summary
+from validation import QUARANTINE_PATH
+
+IMPORT_SECONDS = time.perf_counter() - STARTED
+
+OUTPUT_PATH = 'index.html'
+REPORTS_DIR = 'reports'
+TITLE = "KMGA: Оперативная аналитика ресурсов"
+# html и json пишет сам plotly, картинкам нужен пакет kaleido
+FORMATS = ['html', 'json', 'png', 'svg', 'pdf']
+IMAGE_FORMATS = ['png', 'svg', 'pdf']
+# Одна копия plotly.js на все отчеты клиентов (каждый отчет ссылается на нее)
+PLOTLYJS_NAME = 'plotly.min.js'
+
+
+class Timings:
+    """Длительности этапов сборки (выводятся с --timings)"""
+
+    def __init__(self):
+        self.stages = [('импорт модулей', IMPORT_SECONDS)]
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - started))
+
+    def report(self):
+        print("⏱️ Время выполнения:")
+        for name, seconds in self.stages:
+            print(f"   {name}: {seconds:.2f} с")
+        print(f"   всего с запуска: {time.perf_counter() - STARTED:.2f} с")
+
+
+def load(input_path):
+    """Проверка и идемпотентная загрузка выгрузки; итоги - из того же источника, что у дашборда"""
+    print("📊 Загрузка данных...")
+    # Проверка (типы, обязательные поля, диапазон часов, нормализация) и загрузка в хранилище
+    store, data_version = ingest(input_path)
+    rejected = 0
+    if os.path.exists(QUARANTINE_PATH):
+        rejected = len(pd.read_csv(QUARANTINE_PATH))
+        if rejected > 0:
+            print(f"⚠️ Отклонено записей: {rejected} (см. {QUARANTINE_PATH})")
+
+    # Источник итогов выбирается переменной KMGA_BACKEND; уровни rollups в памяти строятся только для pandas
+    backend = open_backend(store, lambda: Rollups.open(store).materialize())
+
+    print(f"✅ Данные загружены: {len(store)} записей")
+    return store, data_version, backend, rejected
+
+
+def check(store, data_version, backend, rejected, input_path=None):
+    """Сводка по данным без графиков; код возврата 1, если есть отклоненные записи,
+    нет ни одной или хранилище расходится с выгрузкой"""
+    projects = backend.totals(['Project_No'])
+    print(f"📋 Версия данных: {data_version}")
+    print(f"   Часов: {projects['Hours'].sum():,.0f}")
+    print(f"   Проектов: {len(projects)}, сотрудников: {len(backend.totals(['Employee']))}, "
+          f"клиентов: {len(backend.totals(['Client']))}, активностей: {len(backend.totals(['Activity']))}")
+
+    snapshots = SnapshotStore()
+    previous_version = snapshots.previous(data_version)
+    if previous_version is not None:
+        before = summary(snapshots.load(previous_version))
+        after = summary(snapshots.load(data_version))
+        print(f"🔄 С прошлой загрузки: {after['hours'] - before['hours']:+,.0f} ч, "
+              f"проектов {after['projects'] - before['projects']:+d}, "
+              f"сотрудников {after['employees'] - before['employees']:+d}")
+
+    # Хранилище дописывается пакетами - все его записи должны совпасть с выгрузкой
+    reconciled = reconcile(store, input_path)
+    print(f"🧾 Выгрузка: {reconciled['file_records']} записей, {reconciled['file_hours']:,.2f} ч; "
+          f"в хранилище: {reconciled['store_records']} записей, {reconciled['store_hours']:,.2f} ч")
+
+    if len(store) == 0:
+        print("❌ Нет ни одной корректной записи")
+        return 1
+    if rejected > 0:
+        print("❌ Проверка не пройдена: есть отклоненные записи")
+        return 1
+    if not reconciled['matches']:
+        print("❌ Проверка не пройдена: хранилище не совпадает с выгрузкой")
+        return 1
+    print("✅ Проверка пройдена")
+    return 0
+
+
+def build_figure(backend, title=TITLE):
+    """Шесть графиков дашборда (plotly импортируется только здесь)"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # Создаем subplots: 3 строки, 2 колонки
+    fig = make_subplots(
+        rows=3, cols=2,
+        subplot_titles=(
+            "<b>Затраты времени по сотрудникам (Stacked Bar)</b>",
+            "<b>Доли проектов в общих часах (%)</b>",
+            "<b>Сравнение проектов (Line Chart)</b>",
+            "<b>Распределение по клиентам (%)</b>",
+            "<b>Heatmap: Сотрудники × Проекты</b>",
+            "<b>Распределение по активностям (%)</b>"
+        ),
+        vertical_spacing=0.12,
+        horizontal_spacing=0.1,
+        specs=[
+            [{"type": "bar"}, {"type": "pie"}],
+            [{"type": "scatter"}, {"type": "pie"}],
+            [{"type": "heatmap"}, {"type": "pie"}]
+        ]
+    )
+
+    # График 1: Stacked Bar Chart - затраты по сотрудникам
+    for emp, temp in backend.totals(['Employee', 'Project_No']).groupby('Employee', sort=True):
+        fig.add_trace(
+            go.Bar(
+                x=temp['Project_No'],
+                y=temp['Hours'],
+                name=emp,
+                text=temp['Hours'],
+                textposition='auto',
+                hovertemplate='<b>%{fullData.name}</b><br>Проект: %{x}<br>Часы: %{y:,.0f}<extra></extra>'
+            ),
+            row=1, col=1
+        )
+
+    # График 2: Pie Chart - доли проектов
+    proj_sum = backend.totals(['Project_No'])
+    fig.add_trace(
+        go.Pie(
+            labels=proj_sum['Project_No'],
+            values=proj_sum['Hours'],
+            hole=0.4,
+            textinfo='percent+label',
+            hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
+        ),
+        row=1, col=2
+    )
+
+    # График 3: Line Chart - сравнение проектов
+    project_hours_sorted = backend.totals(['Project_No']).set_index('Project_No')['Hours'].sort_values(ascending=False)
+    fig.add_trace(
+        go.Scatter(
+            x=project_hours_sorted.index,
+            y=project_hours_sorted.values,
+            mode='lines+markers',
+            name='Часы',
+            line=dict(width=3, color='#667eea', shape='spline'),
+            marker=dict(size=10, color='#764ba2', line=dict(width=2, color='white')),
+            fill='tonexty',
+            fillcolor='rgba(102, 126, 234, 0.1)',
+            hovertemplate='<b>Проект:</b> %{x}<br><b>Часы:</b> %{y:,.0f}<extra></extra>'
+        ),
+        row=2, col=1
+    )
+
+    # График 4: Pie Chart - распределение по клиентам
+    client_sum = backend.totals(['Client'])
+    fig.add_trace(
+        go.Pie(
+            labels=client_sum['Client'],
+            values=client_sum['Hours'],
+            hole=0.4,
+            textinfo='percent+label',
+            hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
+        ),
+        row=2, col=2
+    )
+
+    # График 5: Heatmap - Сотрудники × Проекты
+    pivot_data = backend.totals(['Employee', 'Project_No'])
+    pivot_table = pivot_data.pivot(index='Employee', columns='Project_No', values='Hours').fillna(0)
     fig.add_trace(
-        go.Bar(
-            x=temp['Project_No'],
-            y=temp['Hours'],
-            name=emp,
-            text=temp['Hours'],
-            textposition='auto',
-            hovertemplate='<b>%{fullData.name}</b><br>Проект: %{x}<br>Часы: %{y:,.0f}<extra></extra>'
+        go.Heatmap(
+            z=pivot_table.values,
+            x=pivot_table.columns,
+            y=pivot_table.index,
+            colorscale='YlOrRd',
+            text=pivot_table.values,
+            texttemplate='%{text:.0f}',
+            textfont={"size": 10},
+            hovertemplate='<b>Сотрудник:</b> %{y}<br><b>Проект:</b> %{x}<br><b>Часы:</b> %{z:,.0f}<extra></extra>'
         ),
-        row=1, col=1
+        row=3, col=1
     )
 
-# График 2: Pie Chart - доли проектов
-proj_sum = df.groupby('Project_No')['Hours'].sum().reset_index()
-fig.add_trace(
-    go.Pie(
-        labels=proj_sum['Project_No'],
-        values=proj_sum['Hours'],
-        hole=0.4,
-        textinfo='percent+label',
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
-    ),
-    row=1, col=2
-)
-
-# График 3: Line Chart - сравнение проектов
-project_hours_sorted = df.groupby('Project_No')['Hours'].sum().sort_values(ascending=False)
-fig.add_trace(
-    go.Scatter(
-        x=project_hours_sorted.index,
-        y=project_hours_sorted.values,
-        mode='lines+markers',
-        name='Часы',
-        line=dict(width=3, color='#667eea', shape='spline'),
-        marker=dict(size=10, color='#764ba2', line=dict(width=2, color='white')),
-        fill='tonexty',
-        fillcolor='rgba(102, 126, 234, 0.1)',
-        hovertemplate='<b>Проект:</b> %{x}<br><b>Часы:</b> %{y:,.0f}<extra></extra>'
-    ),
-    row=2, col=1
-)
-
-# График 4: Pie Chart - распределение по клиентам
-client_sum = df.groupby('Client')['Hours'].sum().reset_index()
-fig.add_trace(
-    go.Pie(
-        labels=client_sum['Client'],
-        values=client_sum['Hours'],
-        hole=0.4,
-        textinfo='percent+label',
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
-    ),
-    row=2, col=2
-)
-
-# График 5: Heatmap - Сотрудники × Проекты
-pivot_data = df.groupby(['Employee', 'Project_No'])['Hours'].sum().reset_index()
-pivot_table = pivot_data.pivot(index='Employee', columns='Project_No', values='Hours').fillna(0)
-fig.add_trace(
-    go.Heatmap(
-        z=pivot_table.values,
-        x=pivot_table.columns,
-        y=pivot_table.index,
-        colorscale='YlOrRd',
-        text=pivot_table.values,
-        texttemplate='%{text:.0f}',
-        textfont={"size": 10},
-        hovertemplate='<b>Сотрудник:</b> %{y}<br><b>Проект:</b> %{x}<br><b>Часы:</b> %{z:,.0f}<extra></extra>'
-    ),
-    row=3, col=1
-)
-
-# График 6: Pie Chart - распределение по активностям
-activity_sum = df.groupby('Activity')['Hours'].sum().reset_index()
-fig.add_trace(
-    go.Pie(
-        labels=activity_sum['Activity'],
-        values=activity_sum['Hours'],
-        hole=0.4,
-        textinfo='percent+label',
-        hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
-    ),
-    row=3, col=2
-)
-
-# 3. Оформление для руководства
-fig.update_layout(
-    height=1500,
-    barmode='stack',  # Сотрудники один над другим
-    title_text="<b>KMGA: Оперативная аналитика ресурсов</b>",
-    template="plotly_white",
-    showlegend=True,
-    legend=dict(orientation="v", yanchor="top", y=1, xanchor="left", x=1.02)
-)
-
-# Обновляем оси для каждого subplot
-fig.update_xaxes(title_text="Проект", row=1, col=1, categoryorder='total descending')
-fig.update_yaxes(title_text="Часы", row=1, col=1)
-fig.update_xaxes(title_text="Проект", row=2, col=1)
-fig.update_yaxes(title_text="Часы", row=2, col=1)
-fig.update_xaxes(title_text="Проект", row=3, col=1)
-fig.update_yaxes(title_text="Сотрудник", row=3, col=1)
-
-print("✅ Графики созданы")
-
-# 4. Генерируем HTML
-print("🌐 Генерация HTML файла...")
-fig.write_html('index.html')
-print("✅ HTML файл создан: index.html")
-print("🌐 Файл готов для размещения на GitHub Pages!")
-print("\n💡 Откройте index.html в браузере для просмотра дашборда")
+    # График 6: Pie Chart - распределение по активностям
+    activity_sum = backend.totals(['Activity'])
+    fig.add_trace(
+        go.Pie(
+            labels=activity_sum['Activity'],
+            values=activity_sum['Hours'],
+            hole=0.4,
+            textinfo='percent+label',
+            hovertemplate='<b>%{label}</b><br>Часы: %{value:,.0f}<br>Доля: %{percent}<extra></extra>'
+        ),
+        row=3, col=2
+    )
+
+    # Оформление для руководства
+    fig.update_layout(
+        height=1500,
+        barmode='stack',  # Сотрудники один над другим
+        title_text=f"<b>{title}</b>",
+        template="plotly_white",
+        showlegend=True,
+        legend=dict(orientation="v", yanchor="top", y=1, xanchor="left", x=1.02)
+    )
+
+    # Обновляем оси для каждого subplot
+    fig.update_xaxes(title_text="Проект", row=1, col=1, categoryorder='total descending')
+    fig.update_yaxes(title_text="Часы", row=1, col=1)
+    fig.update_xaxes(title_text="Проект", row=2, col=1)
+    fig.update_yaxes(title_text="Часы", row=2, col=1)
+    fig.update_xaxes(title_text="Проект", row=3, col=1)
+    fig.update_yaxes(title_text="Сотрудник", row=3, col=1)
+
+    return fig
+
+
+def write_output(fig, path, fmt, plotlyjs=True):
+    """plotlyjs - как у write_html: True встраивает plotly.js в файл, имя .js - ссылка на общую копию"""
+    if fmt == 'html':
+        fig.write_html(path, include_plotlyjs=plotlyjs)
+    elif fmt == 'json':
+        fig.write_json(path)
+    else:
+        fig.write_image(path, format=fmt)
+
+
+class ClientBackend:
+    """Итоги одного клиента: его выбор добавляется к каждому запросу источника"""
+
+    def __init__(self, backend, client):
+        self.backend = backend
+        self.selection = {'Client': [client]}
+
+    def totals(self, keys, *selections):
+        return self.backend.totals(keys, self.selection, *selections)
+
+
+# Источник итогов, общий для процессов пула: каждый процесс открывает его один раз -
+# файлы хранилища читаются через memmap и делят страничный кеш, база открывается своим соединением
+_worker_backend = None
+
+
+def _init_worker(store_dir):
+    global _worker_backend
+    store = RecordStore(store_dir)
+    _worker_backend = open_backend(store, lambda: Rollups.open(store))
+
+
+def client_partitions(backend, clients=None):
+    """Части итогов по клиентам: номера путей rollups или, для встроенной базы, None (выбор клиента
+    выполняется запросом); крупные клиенты идут первыми, чтобы пул загружался ровно"""
+    if isinstance(backend, RollupBackend):
+        partitions = backend.rollups.table().groupby('Client', sort=True).indices
+        sizes = {client: len(rows) for client, rows in partitions.items()}
+    else:
+        totals = backend.totals(['Client'])
+        partitions = dict.fromkeys(totals['Client'])
+        sizes = dict(zip(totals['Client'], totals['Hours']))
+    if clients:
+        missing = [client for client in clients if client not in partitions]
+        if missing:
+            print(f"⚠️ Нет данных по клиентам: {', '.join(missing)}")
+        partitions = {client: rows for client, rows in partitions.items() if client in clients}
+    return sorted(partitions.items(), key=lambda item: -sizes[item[0]])
+
+
+def render_client(client, rows, path, fmt):
+    """Отчет одного клиента по его части итогов (выполняется в процессе пула)"""
+    started = time.perf_counter()
+    if rows is None:
+        backend = ClientBackend(_worker_backend, client)
+    else:
+        backend = RollupBackend(_worker_backend.rollups.take(rows))
+    fig = build_figure(backend, title=f"{TITLE} · {client}")
+    write_output(fig, path, fmt, plotlyjs=PLOTLYJS_NAME)
+    return client, path, time.perf_counter() - started
+
+
+def write_plotlyjs(reports_dir):
+    """Общая копия plotly.js для отчетов; файл перезаписывается, только если изменился"""
+    from plotly.offline import get_plotlyjs
+
+    path = os.path.join(reports_dir, PLOTLYJS_NAME)
+    content = get_plotlyjs().encode('utf-8')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return path
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def write_reports_index(results, reports_dir):
+    """Страница со ссылками на отчеты клиентов"""
+    links = '\n'.join(
+        f'<li><a href="{html.escape(os.path.basename(path))}">{html.escape(client)}</a></li>'
+        for client, path, _ in sorted(results)
+    )
+    with open(os.path.join(reports_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(
+            f'<!DOCTYPE html>\n<html lang="ru">\n<head><meta charset="utf-8"><title>{TITLE}: клиенты</title></head>\n'
+            f'<body>\n<h1>{TITLE}: клиенты</h1>\n<ul>\n{links}\n</ul>\n'
+            f'<p><a href="../{OUTPUT_PATH}">Общий дашборд</a></p>\n</body>\n</html>\n'
+        )
+
+
+def build_client_reports(store, backend, reports_dir, fmt, workers=None, clients=None):
+    """Отчеты по клиентам: данные загружены и свернуты один раз, отчеты строятся на пуле процессов"""
+    os.makedirs(reports_dir, exist_ok=True)
+    if fmt == 'html':
+        # Записывается до запуска пула: процессы только ссылаются на нее
+        write_plotlyjs(reports_dir)
+    tasks = []
+    used = set()
+    for client, rows in client_partitions(backend, clients):
+        name = re.sub(r'[^\w-]+', '_', client).strip('_') or 'client'
+        while name.lower() in used or name.lower() == 'index':
+            name += '_'
+        used.add(name.lower())
+        tasks.append((client, rows, os.path.join(reports_dir, f'{name}.{fmt}'), fmt))
+
+    results = []
+    if workers == 1:
+        _init_worker(store.path)
+        for task in tasks:
+            results.append(render_client(*task))
+            print(f"   ✅ {results[-1][0]}: {results[-1][1]} ({results[-1][2]:.2f} с)")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(store.path,)) as pool:
+            futures = [pool.submit(render_client, *task) for task in tasks]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print(f"   ✅ {results[-1][0]}: {results[-1][1]} ({results[-1][2]:.2f} с)")
+    if fmt == 'html':
+        write_reports_index(results, reports_dir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка дашборда KMGA из выгрузки n8n")
+    parser.add_argument('-i', '--input',
+                        help="выгрузка: JSON, NDJSON, CSV (в том числе .gz/.zst) или Excel; "
+                             "по умолчанию - KMGA_DATA или первый найденный data.*")
+    parser.add_argument('-o', '--output', default=OUTPUT_PATH, help="файл дашборда")
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help="формат дашборда (по умолчанию - по расширению файла, иначе html)")
+    parser.add_argument('--check', action='store_true', help="только проверить данные и вывести сводку")
+    parser.add_argument('--timings', action='store_true', help="вывести время импорта и этапов")
+    parser.add_argument('--per-client', action='store_true', help="дополнительно построить отчет по каждому клиенту")
+    parser.add_argument('--clients', help="клиенты для отчетов через запятую (по умолчанию все)")
+    parser.add_argument('--reports-dir', default=REPORTS_DIR, help="каталог отчетов по клиентам")
+    parser.add_argument('--workers', type=int, help="процессов для отчетов (по умолчанию - число ядер)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        fmt = 'html'
+    if not args.check and fmt in IMAGE_FORMATS and importlib.util.find_spec('kaleido') is None:
+        parser.error(f"для формата {fmt} нужен пакет kaleido (pip install kaleido)")
+
+    timings = Timings()
+    with timings.stage('загрузка данных'):
+        store, data_version, backend, rejected = load(args.input)
+
+    status = 0
+    if args.check:
+        with timings.stage('сводка'):
+            status = check(store, data_version, backend, rejected, args.input)
+    else:
+        print("📈 Создание графиков...")
+        with timings.stage('импорт plotly'):
+            importlib.import_module('plotly.graph_objects')
+            importlib.import_module('plotly.subplots')
+        with timings.stage('построение графиков'):
+            fig = build_figure(backend)
+        print("✅ Графики созданы")
+
+        print(f"🌐 Генерация файла {fmt}...")
+        with timings.stage('запись файла'):
+            write_output(fig, args.output, fmt)
+        print(f"✅ Файл создан: {args.output}")
+        if fmt == 'html':
+            print("🌐 Файл готов для размещения на GitHub Pages!")
+            print(f"\n💡 Откройте {args.output} в браузере для просмотра дашборда")
+
+        if args.per_client:
+            clients = [client.strip() for client in args.clients.split(',')] if args.clients else None
+            print(f"👥 Отчеты по клиентам в {args.reports_dir}...")
+            with timings.stage('отчеты по клиентам'):
+                results = build_client_reports(store, backend, args.reports_dir, fmt, args.workers, clients)
+            print(f"✅ Отчетов по клиентам: {len(results)}")
+
+    if args.timings:
+        timings.report()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
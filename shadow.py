@@ -0,0 +1,384 @@
+"""Теневая проверка быстрых итогов по эталонному расчету pandas.
+
+В дашборде (KMGA_SHADOW_PERCENT > 0) заданная доля вызовов totals()
+источника итогов, таблиц, отобранных индексом фильтров (chart_df графика
+Treemap, сводка экспорта), и загрузки сотрудников повторяется
+эталоном - groupby(...).sum() с фильтрами масками, как считалось до
+rollups, индексов и встроенной базы. Эталонные записи не берутся из
+хранилища: выгрузки источников заново читаются read_input() и очищаются
+validate(), поэтому ошибки журнала, дозаписи и пересборки хранилища тоже
+дают расхождение. Расхождения больше допуска пишутся в лог kmga.shadow
+предупреждениями, отношение времени эталона к быстрому пути - в сводку.
+
+Как дифференциальный тест - те же сравнения на сгенерированных наборах
+данных для всех источников итогов (rollups, sqlite, duckdb), выборок
+индекса фильтров и загрузки сотрудников; эталон там - сгенерированная
+таблица, из которой построено хранилище:
+
+    python shadow.py --datasets 20 --rows 5000 --queries 30
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend import RollupBackend
+from filters import FILTER_COLUMNS, MIXED_VALUE, FilterIndex, combine
+from ledger import Ledger, record_keys
+from perflog import get_logger
+from readers import find_input, read_input
+from record_store import RecordStore
+from rollups import Rollups
+from sql_store import ENGINES, SqlStore, duckdb
+from treemap import build_hierarchy
+from utilization import utilization
+from validation import RECORD_COLUMNS, validate
+
+logger = get_logger('shadow')
+
+# Доля проверяемых вызовов, %, и допуск расхождения часов
+SHADOW_PERCENT = float(os.environ.get('KMGA_SHADOW_PERCENT', 0))
+TOLERANCE = float(os.environ.get('KMGA_SHADOW_TOLERANCE', 1e-6))
+# Уровни treemap дашборда, цвета узлов которых сверяются с px.treemap
+TREEMAP_LEVELS = [['Client', 'Project_No', 'Employee'], ['Client', 'Project_No', 'Employee', 'Activity']]
+# Как часто писать сводку проверок, с; строк расхождения в сообщении
+LOG_INTERVAL = 60
+MISMATCH_ROWS = 5
+
+
+def reference_totals(records, keys, *selections, rows=None):
+    """Эталон: маски фильтров по исходным записям и groupby(keys).sum()"""
+    if rows is not None:
+        records = records.iloc[np.sort(np.asarray(rows))]
+    mask = pd.Series(True, index=records.index)
+    for col, values in combine(*selections).items():
+        mask &= records[col].isin(values)
+    totals = records[mask].groupby(list(keys), sort=True)['Hours'].sum().reset_index()
+    return totals.astype({'Hours': np.float64})
+
+
+def source_paths(store):
+    """Выгрузки источников хранилища: последние файлы источников из журнала в каталоге текущей выгрузки"""
+    directory = os.path.dirname(find_input())
+    return [os.path.join(directory, name) for name in Ledger.open(store.path).files().values()]
+
+
+def reference_records(paths):
+    """Записи выгрузок, прочитанные и очищенные заново, и их ключи (ключи считаются по каждой выгрузке)"""
+    frames, keys = [], []
+    for path in paths:
+        df, _ = validate(read_input(path))
+        frames.append(df[RECORD_COLUMNS])
+        keys.append(record_keys(df))
+    return pd.concat(frames, ignore_index=True), np.concatenate(keys)
+
+
+def mismatches(fast, reference, keys, tolerance=TOLERANCE):
+    """Строки, где итоги расходятся: ключ есть только с одной стороны или часы отличаются больше допуска"""
+    merged = fast[list(keys) + ['Hours']].merge(
+        reference[list(keys) + ['Hours']], on=list(keys), how='outer', suffixes=('_fast', '_reference'), indicator=True
+    )
+    hours = merged[['Hours_fast', 'Hours_reference']].fillna(0.0).to_numpy()
+    differs = ~np.isclose(hours[:, 0], hours[:, 1], rtol=tolerance, atol=tolerance)
+    return merged[differs | (merged['_merge'] != 'both').to_numpy()].drop(columns='_merge').reset_index(drop=True)
+
+
+def treemap_mismatches(df, levels, tolerance=TOLERANCE):
+    """Узлы build_hierarchy, часы или цвет которых расходятся с px.treemap на тех же листьях.
+
+    px.treemap получает одну строку на лист (при нескольких строках его цвет
+    листа зависит от разбиения), build_hierarchy - исходную таблицу без
+    сворачивания в "Другие". Узлы сопоставляются по пути значений (id px.treemap).
+    """
+    import plotly.express as px
+
+    # px.treemap не строит узлы с нулевой суммой весов - такие листья не сравниваются
+    df = df[df.groupby(levels, sort=False)['Hours'].transform('sum').to_numpy() > 0]
+    leaves = df.groupby(levels, sort=False)['Hours'].sum().reset_index()
+    trace = px.treemap(leaves, path=levels, values='Hours', color='Hours').data[0]
+    reference = pd.DataFrame({'id': trace.ids, 'Hours': trace.values, 'Color': trace.marker.colors})
+    nodes = build_hierarchy(df, levels, max_children=len(leaves) + 1)
+    fast = pd.DataFrame({
+        'id': ['/'.join(v for v in path if v != MIXED_VALUE) for path in nodes['customdata']],
+        'Hours': nodes['values'],
+        'Color': nodes['colors']
+    })
+    # Корень build_hierarchy у px.treemap не строится
+    merged = fast[fast['id'] != ''].merge(reference, on='id', how='outer', suffixes=('_fast', '_reference'), indicator=True)
+    differs = np.zeros(len(merged), dtype=bool)
+    for col in ['Hours', 'Color']:
+        values = merged[[f'{col}_fast', f'{col}_reference']].fillna(0.0).to_numpy(dtype=np.float64)
+        differs |= ~np.isclose(values[:, 0], values[:, 1], rtol=tolerance, atol=tolerance)
+    return merged[differs | (merged['_merge'] != 'both').to_numpy()].drop(columns='_merge').reset_index(drop=True)
+
+
+class Shadow:
+    """Выборочная проверка: счетчики, расхождения и отношения времени эталона к быстрому пути.
+
+    Эталонные записи читаются из выгрузок один раз на версию хранилища.
+    Строки хранилища (результат поиска) переводятся в записи выгрузок по
+    ключам журнала. Если выгрузки источника уже нет на диске, проверки
+    этой версии пропускаются.
+    """
+
+    def __init__(self, percent=SHADOW_PERCENT, tolerance=TOLERANCE, seed=None, inputs=source_paths):
+        self.rate = percent / 100
+        self.tolerance = tolerance
+        self.random = random.Random(seed)
+        self.inputs = inputs
+        self.checks = 0
+        self.mismatches = 0
+        self.ratios = []
+        self._references = {}
+        self._lock = threading.Lock()
+        self._logged = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def sample(self):
+        with self._lock:
+            return self.random.random() < self.rate
+
+    def reference(self, store, rows=None):
+        """Эталонные записи для строк хранилища rows (по умолчанию всех) или None, если выгрузок нет"""
+        key = (store.path, store.version)
+        with self._lock:
+            if key not in self._references:
+                paths = self.inputs(store)
+                missing = [path for path in paths if not os.path.exists(path)]
+                if missing:
+                    logger.warning(f"Теневая проверка версии {store.version} пропускается: нет выгрузок {missing}")
+                    self._references = {key: None}
+                else:
+                    records, keys = reference_records(paths)
+                    self._references = {key: (records, keys, Ledger.open(store.path).keys)}
+            reference = self._references[key]
+        if reference is None:
+            return None
+        records, keys, store_keys = reference
+        return records if rows is None else records[np.isin(keys, store_keys[rows])]
+
+    def check(self, name, keys, fast, fast_seconds, store, rows, *selections):
+        """Сравнить готовый результат быстрого пути с эталоном; True - совпали (или эталона нет).
+
+        fast_seconds - время быстрого пути; None, если его нечем измерить.
+        """
+        records = self.reference(store, rows)
+        if records is None:
+            return True
+        started = time.perf_counter()
+        reference = reference_totals(records, keys, *selections)
+        reference_seconds = time.perf_counter() - started
+        diff = mismatches(fast, reference, keys, self.tolerance)
+        with self._lock:
+            self.checks += 1
+            if fast_seconds is not None:
+                self.ratios.append(reference_seconds / max(fast_seconds, 1e-9))
+            if len(diff):
+                self.mismatches += 1
+            log_summary = time.monotonic() - self._logged > LOG_INTERVAL
+        if len(diff):
+            logger.warning(f"Расхождение {name}: {len(diff)} строк (быстрый путь / эталон)\n"
+                           + diff.head(MISMATCH_ROWS).to_string(index=False))
+        else:
+            logger.debug(f"{name}: совпало, эталон {reference_seconds * 1000:,.1f} мс")
+        if log_summary:
+            self.log_usage()
+        return not len(diff)
+
+    def check_frame(self, name, frame, keys, store, rows, *selections):
+        """Сверить итоги таблицы, уже отобранной быстрым путем (chart_df, загрузка сотрудников), с эталоном"""
+        fast = frame.groupby(list(keys), sort=True)['Hours'].sum().reset_index()
+        return self.check(name, keys, fast, None, store, rows, *selections)
+
+    def stats(self):
+        with self._lock:
+            ratios = np.array(self.ratios)
+            return {
+                'percent': self.rate * 100,
+                'checks': self.checks,
+                'mismatches': self.mismatches,
+                'ratio_p50': round(float(np.percentile(ratios, 50)), 1) if len(ratios) else None,
+                'ratio_p95': round(float(np.percentile(ratios, 95)), 1) if len(ratios) else None
+            }
+
+    def log_usage(self):
+        stats = self.stats()
+        self._logged = time.monotonic()
+        if stats['checks']:
+            logger.info(f"Теневая проверка: {stats['checks']} сравнений, расхождений {stats['mismatches']}, "
+                        f"эталон медленнее в {stats['ratio_p50']:,.1f} раз (p95 {stats['ratio_p95']:,.1f})")
+
+
+# Общая для сессий процесса, как кеш видов
+SHADOW = Shadow()
+
+
+class ShadowBackend:
+    """Источник итогов, часть вызовов totals() которого сверяется с эталоном"""
+
+    def __init__(self, backend, store, rows=None, shadow=SHADOW):
+        self.backend = backend
+        self.store = store
+        self.rows = rows
+        self.shadow = shadow
+
+    def totals(self, keys, *selections):
+        started = time.perf_counter()
+        result = self.backend.totals(keys, *selections)
+        if self.shadow.sample():
+            self.shadow.check(
+                f"{type(self.backend).__name__}.totals({list(keys)}, {combine(*selections)})",
+                keys, result, time.perf_counter() - started, self.store, self.rows, *selections
+            )
+        return result
+
+
+def shadowed(backend, store, rows=None, shadow=SHADOW):
+    """Источник итогов с теневой проверкой; без нее (доля 0) - сам источник без обертки"""
+    return ShadowBackend(backend, store, rows, shadow) if shadow.enabled else backend
+
+
+def generate_records(rng, rows):
+    """Случайный набор записей: перекошенные частоты значений, дробные и нулевые часы"""
+    sizes = {'Employee': 40, 'Client': 8, 'Project_No': 30, 'Activity': 6}
+    values = {col: np.array([f'{col}-{i:03d}' for i in range(size)], dtype=object) for col, size in sizes.items()}
+    data = {}
+    for col, size in sizes.items():
+        # Степенной закон: немногие значения встречаются часто, многие - редко
+        data[col] = values[col][np.minimum(rng.zipf(1.5, rows) - 1, size - 1)]
+    # Клиент и описание зависят от проекта, как в выгрузке
+    project = pd.Index(values['Project_No']).get_indexer(data['Project_No'])
+    data['Client'] = values['Client'][project % sizes['Client']]
+    data['Project_Description'] = np.array([f'Описание {p}' for p in project], dtype=object)
+    data['Staff_Comment'] = np.array([f'комментарий {c}' for c in rng.integers(0, 50, rows)], dtype=object)
+    hours = np.round(rng.gamma(2.0, 3.0, rows) * 4) / 4
+    hours[rng.random(rows) < 0.02] = 0.0
+    data['Hours'] = hours + rng.random(rows) * (rng.random(rows) < 0.1)
+    return pd.DataFrame(data)[RECORD_COLUMNS]
+
+
+def random_query(rng, records):
+    """Ключи группировки и выборы: значения из данных, отсутствующие значения и пустые пересечения"""
+    keys = sorted(rng.choice(FILTER_COLUMNS, size=rng.integers(1, 3), replace=False).tolist(), key=FILTER_COLUMNS.index)
+    selections = []
+    for _ in range(rng.integers(0, 3)):
+        selection = {}
+        for col in rng.choice(FILTER_COLUMNS, size=rng.integers(1, 3), replace=False).tolist():
+            present = records[col].unique()
+            chosen = rng.choice(present, size=min(len(present), rng.integers(0, 4)), replace=False).tolist()
+            if rng.random() < 0.1:
+                chosen.append(f'{col}-нет')
+            selection[col] = chosen
+        selections.append(selection)
+    return keys, selections
+
+
+def build_backends(store, rows=None, engines=None):
+    """Все источники итогов над хранилищем (rows - ограничение, как результат поиска)"""
+    rollups = Rollups.update(store) if rows is None else Rollups.update(store).restrict(rows)
+    backends = {'pandas': RollupBackend(rollups, FilterIndex.from_rollups(rollups))}
+    for engine in engines if engines is not None else ENGINES:
+        if engine == 'duckdb' and duckdb is None:
+            continue
+        db = SqlStore.update(store, engine)
+        backends[engine] = db if rows is None else db.restrict(rows)
+    return backends
+
+
+def selection_totals(backend, keys, *selections):
+    """Итоги путей, отобранных индексом фильтров, как их получают chart_df и загрузка сотрудников.
+
+    Возвращает {имя проверки: (ключи, итоги)}; backend - источник итогов pandas.
+    """
+    rows = backend.filter_index.select(*selections)
+    table = backend.rollups.table()
+    selected = table if rows is None else table.iloc[rows]
+    return {
+        'filter_index': (keys, selected.groupby(list(keys), sort=True)['Hours'].sum().reset_index()),
+        'utilization': (['Employee'], utilization(backend.rollups, rows))
+    }
+
+
+def differential(datasets=20, rows=5000, queries=30, seed=0, engines=None, tolerance=TOLERANCE):
+    """Дифференциальный тест: итоги всех источников против эталона на сгенерированных данных.
+
+    Половина наборов загружается в два пакета, чтобы проверить и дозапись
+    хранилища с досчетом итогов. Таблица путей, отобранных индексом
+    фильтров, и загрузка сотрудников тоже сверяются с эталоном, цвета и
+    часы узлов treemap каждого набора - с px.treemap. Возвращает число сравнений и список
+    расхождений (набор, источник, ключи, выборы, строки расхождения).
+    """
+    rng = np.random.default_rng(seed)
+    checks, failures = 0, []
+    for dataset in range(datasets):
+        records = generate_records(rng, int(rng.integers(1, rows + 1)))
+        path = tempfile.mkdtemp(prefix='kmga-shadow-')
+        try:
+            if dataset % 2 and len(records) > 1:
+                split = int(rng.integers(1, len(records)))
+                store = RecordStore.build(records.iloc[:split], path, 'first')
+                build_backends(store, engines=engines)
+                store = store.append(records.iloc[split:].reset_index(drop=True), 'second')
+            else:
+                store = RecordStore.build(records, path, 'first')
+            # Эталон считается по сгенерированной таблице, а не по хранилищу
+            searches = [None, np.sort(rng.choice(len(records), size=max(1, len(records) // 3), replace=False))]
+            for rows_limit in searches:
+                backends = build_backends(store, rows_limit, engines)
+                for _ in range(queries):
+                    keys, selections = random_query(rng, records)
+                    reference = reference_totals(records, keys, *selections, rows=rows_limit)
+                    for name, backend in backends.items():
+                        diff = mismatches(backend.totals(keys, *selections), reference, keys, tolerance)
+                        checks += 1
+                        if len(diff):
+                            failures.append((dataset, name, keys, selections, diff))
+                    for name, (check_keys, fast) in selection_totals(backends['pandas'], keys, *selections).items():
+                        reference = reference_totals(records, check_keys, *selections, rows=rows_limit)
+                        diff = mismatches(fast, reference, check_keys, tolerance)
+                        checks += 1
+                        if len(diff):
+                            failures.append((dataset, name, check_keys, selections, diff))
+                for backend in backends.values():
+                    if isinstance(backend, SqlStore):
+                        backend.close()
+            for levels in TREEMAP_LEVELS:
+                diff = treemap_mismatches(records, levels, tolerance)
+                checks += 1
+                if len(diff):
+                    failures.append((dataset, 'treemap', levels, [], diff))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    return checks, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Дифференциальный тест источников итогов против эталона pandas")
+    parser.add_argument('--datasets', type=int, default=20, help="сгенерированных наборов данных")
+    parser.add_argument('--rows', type=int, default=5000, help="наибольшее число записей в наборе")
+    parser.add_argument('--queries', type=int, default=30, help="случайных запросов на набор и ограничение строк")
+    parser.add_argument('--seed', type=int, default=0, help="зерно генерации")
+    parser.add_argument('--engine', action='append', choices=ENGINES,
+                        help="встроенные базы для проверки (по умолчанию все установленные)")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="допуск расхождения часов")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    checks, failures = differential(args.datasets, args.rows, args.queries, args.seed, args.engine, args.tolerance)
+    print(f"🔍 {checks} сравнений на {args.datasets} наборах за {time.perf_counter() - started:,.1f} с")
+    for dataset, name, keys, selections, diff in failures[:10]:
+        print(f"❌ Набор {dataset}, {name}: totals({keys}, {selections})")
+        print(diff.head(MISMATCH_ROWS).to_string(index=False))
+    if failures:
+        print(f"❌ Расхождений: {len(failures)}")
+        raise SystemExit(1)
+    print("✅ Все источники итогов совпадают с эталоном")
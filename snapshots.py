@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from filters import combine
+from rollups import PATH_COLUMNS
+
+# Снимки лежат отдельно от хранилища и переживают его пересборку
+SNAPSHOT_DIR = '.kmga_snapshots'
+# Сколько последних снимков хранится
+MAX_SNAPSHOTS = 100
+STATUS_LABELS = {'new': 'новый', 'gone': 'выбыл', 'changed': 'изменился', 'same': 'без изменений'}
+
+
+class SnapshotStore:
+    """История итогов по загрузкам.
+
+    Снимок - итоги часов по полным путям иерархии (rollups) для версии
+    данных, со словарным кодированием колонок. Любые уровни и сравнения
+    считаются из снимков без чтения исходных записей. История идет в
+    порядке загрузок: версия, загруженная снова (возврат к прежней
+    выгрузке), получает новую запись, файл снимка переиспользуется.
+    """
+
+    def __init__(self, path=SNAPSHOT_DIR):
+        self.path = path
+        index_path = os.path.join(path, 'snapshots.json')
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.snapshots = json.load(f)
+        else:
+            self.snapshots = []
+
+    def versions(self):
+        return [snapshot['version'] for snapshot in self.snapshots]
+
+    def previous(self, version):
+        """Версия снимка перед последней загрузкой version (или последняя, если version нет в истории)"""
+        versions = self.versions()
+        position = len(versions) - 1 - versions[::-1].index(version) if version in versions else len(versions)
+        return versions[position - 1] if position > 0 else None
+
+    def save(self, rollups, version):
+        """Записать загрузку версии в историю; False - версия и так последняя (перезапуск без новых данных)"""
+        versions = self.versions()
+        if versions and versions[-1] == version:
+            return False
+        os.makedirs(self.path, exist_ok=True)
+        table = rollups.table()
+        if not os.path.exists(self._file(version)):
+            data = {'version': version, 'columns': {}, 'hours': table['Hours'].tolist()}
+            for col in PATH_COLUMNS:
+                codes, values = pd.factorize(table[col])
+                data['columns'][col] = {'values': values.tolist(), 'codes': codes.tolist()}
+            _write_json(self._file(version), data)
+
+        self.snapshots.append({
+            'version': version,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'hours': float(table['Hours'].sum())
+        })
+        kept = set(self.versions()[-MAX_SNAPSHOTS:])
+        for version in set(self.versions()[:-MAX_SNAPSHOTS]) - kept:
+            os.remove(self._file(version))
+        self.snapshots = self.snapshots[-MAX_SNAPSHOTS:]
+        _write_json(os.path.join(self.path, 'snapshots.json'), self.snapshots)
+        return True
+
+    def load(self, version):
+        """Итоги по путям снимка: колонки PATH_COLUMNS и Hours"""
+        with open(self._file(version), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        table = pd.DataFrame({
+            col: np.asarray(column['values'], dtype=object)[np.asarray(column['codes'], dtype=np.intp)]
+            for col, column in data['columns'].items()
+        })
+        table['Hours'] = np.asarray(data['hours'], dtype=np.float64)
+        return table
+
+    def _file(self, version):
+        return os.path.join(self.path, f'snapshot_{version}.json')
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def totals(table, keys, *selections):
+    """Сумма часов снимка по ключам для пересечения выборов"""
+    mask = np.ones(len(table), dtype=bool)
+    for col, values in combine(*selections).items():
+        mask &= table[col].isin(values).to_numpy()
+    return table[mask].groupby(keys, sort=True)['Hours'].sum().reset_index()
+
+
+def summary(table, *selections):
+    """Показатели KPI снимка: часы, проекты, сотрудники, средняя загрузка"""
+    projects = totals(table, ['Project_No'], *selections)
+    employees = totals(table, ['Employee'], *selections)
+    return {
+        'hours': projects['Hours'].sum(),
+        'projects': len(projects),
+        'employees': len(employees),
+        'avg_hours': employees['Hours'].mean() if len(employees) > 0 else 0
+    }
+
+
+def diff(before, after, keys, *selections, changed_only=True):
+    """Изменения часов по ключам между двумя снимками.
+
+    Итоги сливаются по ключам: Hours_Before, Hours_After, Delta, Delta_Pct
+    (к прежнему значению) и Status. Сортировка - по модулю изменения.
+    """
+    merged = totals(before, keys, *selections).merge(
+        totals(after, keys, *selections), on=keys, how='outer', suffixes=('_Before', '_After')
+    ).fillna({'Hours_Before': 0.0, 'Hours_After': 0.0})
+    merged['Delta'] = merged['Hours_After'] - merged['Hours_Before']
+    merged['Delta_Pct'] = np.where(
+        merged['Hours_Before'] > 0,
+        merged['Delta'] / merged['Hours_Before'].where(merged['Hours_Before'] > 0, 1) * 100,
+        np.nan
+    )
+    merged['Status'] = np.select(
+        [merged['Hours_Before'] == 0, merged['Hours_After'] == 0, merged['Delta'] != 0],
+        [STATUS_LABELS['new'], STATUS_LABELS['gone'], STATUS_LABELS['changed']],
+        STATUS_LABELS['same']
+    )
+    if changed_only:
+        merged = merged[merged['Delta'] != 0]
+    order = np.argsort(-merged['Delta'].abs().to_numpy(), kind='stable')
+    return merged.iloc[order].reset_index(drop=True)
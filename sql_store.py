@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from filters import FILTER_COLUMNS, combine
+from validation import RECORD_COLUMNS
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+ENGINES = ['sqlite', 'duckdb']
+# Строк хранилища за одну вставку
+INSERT_CHUNK = 100_000
+
+# Открытые базы процесса: одно соединение на файл базы и движок
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _file_id(path):
+    """Устройство и inode файла: после пересборки хранилища файл базы - другой"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+class SqlStore:
+    """Записи во встроенной базе: фильтры и группировки выполняются запросами.
+
+    Файл базы лежит в каталоге хранилища и догоняет его по номерам строк
+    (row_id - номер строки хранилища), поэтому несколько процессов читают
+    одну базу, а память процесса не зависит от числа записей. Колонки
+    фильтров проиндексированы. В процессе на файл базы открывается одно
+    соединение (connect); ограничение строками передается параметром
+    запроса, поэтому представления не создают объектов в базе.
+    """
+
+    def __init__(self, path, engine='sqlite'):
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок базы: {engine}")
+        if engine == 'duckdb' and duckdb is None:
+            raise ImportError("Для движка duckdb нужен пакет duckdb (pip install duckdb)")
+        self.path = path
+        self.engine = engine
+        if engine == 'duckdb':
+            self.connection = duckdb.connect(path)
+        else:
+            # Соединение общее для потоков Streamlit, запросы сериализуются блокировкой
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.selected = None
+        # Повторно входимая: update держит ее на всю дозапись, а внутри выполняет запросы
+        self._lock = threading.RLock()
+        self._create()
+        self.file_id = _file_id(path)
+        self.pid = os.getpid()
+
+    @classmethod
+    def connect(cls, path, engine='sqlite'):
+        """Общая для процесса база: соединение переоткрывается, только если файл пересоздан.
+
+        Соединение, унаследованное процессом пула от родителя (fork), не используется и не закрывается.
+        """
+        with _shared_lock:
+            db = _shared.get((path, engine))
+            if db is not None and db.pid != os.getpid():
+                db = None
+            elif db is not None and db.file_id != _file_id(path):
+                db.connection.close()
+                db = None
+            if db is None:
+                db = _shared[(path, engine)] = cls(path, engine)
+            return db
+
+    def close(self):
+        """Закрыть соединение (общее с представлениями restrict) и забыть базу"""
+        with _shared_lock:
+            db = _shared.get((self.path, self.engine))
+            if db is not None and db.connection is self.connection:
+                del _shared[(self.path, self.engine)]
+        self.connection.close()
+
+    @classmethod
+    def db_path(cls, store, engine='sqlite'):
+        return os.path.join(store.path, f'records.{engine}')
+
+    @classmethod
+    def update(cls, store, engine='sqlite'):
+        """Дописать в базу строки хранилища, которых в ней еще нет"""
+        db = cls.connect(cls.db_path(store, engine), engine)
+        # Соединение общее для потоков: проверка числа строк и запись - под одной блокировкой,
+        # чтобы два потока не дописывали одни и те же строки
+        with db._lock:
+            rows = len(db)
+            if rows > len(store):
+                # Хранилище пересобрано - база тоже
+                db.connection.execute("DROP TABLE records")
+                db._create()
+                rows = 0
+            for start in range(rows, len(store), INSERT_CHUNK):
+                stop = min(start + INSERT_CHUNK, len(store))
+                batch = store.take(np.arange(start, stop))[RECORD_COLUMNS]
+                batch.insert(0, 'row_id', np.arange(start, stop, dtype=np.int64))
+                db._insert(batch)
+        return db
+
+    def _create(self):
+        columns = ', '.join(f'{col} DOUBLE' if col == 'Hours' else f'{col} VARCHAR' for col in RECORD_COLUMNS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS records (row_id BIGINT PRIMARY KEY, {columns})")
+        for col in FILTER_COLUMNS:
+            # Покрывающий индекс: фильтр и группировка по колонке не читают саму таблицу
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS records_{col.lower()} ON records ({col}, Hours)")
+        self.connection.commit()
+
+    def _insert(self, batch):
+        if self.engine == 'duckdb':
+            self.connection.register('batch', batch)
+            self.connection.execute("INSERT INTO records SELECT * FROM batch")
+            self.connection.unregister('batch')
+        else:
+            placeholders = ', '.join('?' * len(batch.columns))
+            values = zip(*(batch[col].tolist() for col in batch.columns))
+            self.connection.executemany(f"INSERT INTO records VALUES ({placeholders})", values)
+        self.connection.commit()
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM records")[0][0]
+
+    def restrict(self, rows):
+        """Представление базы, ограниченное строками хранилища rows (например, найденными поиском)"""
+        view = SqlStore.__new__(SqlStore)
+        view.__dict__.update(self.__dict__)
+        # Номера строк - один параметр запроса: массив JSON для sqlite, список для duckdb
+        rows = [int(r) for r in rows]
+        view.selected = rows if self.engine == 'duckdb' else json.dumps(rows)
+        return view
+
+    def _where(self, selections):
+        """Условие WHERE и параметры для пересечения выборов"""
+        conditions, params = [], []
+        for col, values in combine(*selections).items():
+            if col not in RECORD_COLUMNS:
+                raise ValueError(f"Неизвестная колонка: {col}")
+            if not values:
+                conditions.append("1 = 0")
+                continue
+            conditions.append(f"{col} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if self.selected is not None:
+            if self.engine == 'duckdb':
+                conditions.append("row_id IN (SELECT UNNEST(?::BIGINT[]))")
+            else:
+                conditions.append("row_id IN (SELECT value FROM json_each(?))")
+            params.append(self.selected)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def totals(self, keys, *selections):
+        """Сумма часов по ключам для пересечения выборов, отсортированная по ключам"""
+        if any(col not in RECORD_COLUMNS for col in keys):
+            raise ValueError(f"Неизвестные колонки: {keys}")
+        columns = ', '.join(keys)
+        where, params = self._where(selections)
+        rows = self._query(
+            f"SELECT {columns}, SUM(Hours) AS Hours FROM records{where} GROUP BY {columns} ORDER BY {columns}",
+            params
+        )
+        return pd.DataFrame(rows, columns=list(keys) + ['Hours']).astype({'Hours': np.float64})
@@ -0,0 +1,39 @@
+import gzip
+import json
+import os
+import shutil
+
+import numpy as np
+
+from ingest import ingest, reconcile
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.json')
+
+
+def total_hours(store):
+    return float(np.asarray(store.values['Hours']).sum())
+
+
+def test_same_export_in_another_format_is_not_added_twice(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(DATA, 'data.json')
+    store, _ = ingest('data.json', 'store', 'snapshots')
+    hours = total_hours(store)
+
+    with open(DATA, 'rb') as src, gzip.open('data.json.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    store, _ = ingest('data.json.gz', 'store', 'snapshots')
+    assert total_hours(store) == hours
+    assert reconcile(store, 'data.json.gz')['matches']
+
+
+def test_rows_of_another_source_fail_reconcile(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(DATA, 'data.json')
+    ingest('data.json', 'store', 'snapshots')
+    with open(DATA, 'r', encoding='utf-8') as f:
+        record = dict(json.load(f)['data'][0], Staff_Comment='другой источник')
+    with open('extra.json', 'w', encoding='utf-8') as f:
+        json.dump({'data': [record]}, f, ensure_ascii=False)
+    store, _ = ingest('extra.json', 'store', 'snapshots')
+    assert not reconcile(store, 'data.json')['matches']
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from validation import validate
+
+
+def records(**columns):
+    """Выгрузка из двух записей: первая корректна, во вторую подставляются значения columns"""
+    df = pd.DataFrame({
+        'Employee': ['A', 'B'],
+        'Client': ['C', 'C'],
+        'Project_No': ['P-1', 'P-1'],
+        'Activity': ['Work', 'Work'],
+        'Project_Description': ['D', 'D'],
+        'Staff_Comment': ['', ''],
+        'Hours': [1, 2]
+    }, dtype=object)
+    for col, value in columns.items():
+        df.at[1, col] = value
+    return df
+
+
+def test_nested_text_goes_to_quarantine():
+    for col, value in [('Project_No', {'a': 1}), ('Employee', ['a']), ('Staff_Comment', [1])]:
+        clean, rejected = validate(records(**{col: value}))
+        assert clean['Employee'].tolist() == ['A']
+        assert rejected['Reason'].tolist() == [f'{col}: неверный тип']
+
+
+def test_bool_hours_goes_to_quarantine():
+    clean, rejected = validate(records(Hours=True))
+    assert clean['Hours'].tolist() == [1]
+    assert rejected['Reason'].tolist() == ['Hours: неверный тип']
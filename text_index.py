@@ -0,0 +1,149 @@
+import glob
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Индексируемые текстовые колонки хранилища
+INDEX_COLUMNS = ['Staff_Comment', 'Project_Description']
+TOKEN_PATTERN = r'\w+'
+# После стольких сегментов индекс сливается в один
+MAX_SEGMENTS = 8
+
+
+def tokenize(text):
+    """Токены текста: слова в нижнем регистре"""
+    return re.findall(TOKEN_PATTERN, text.lower())
+
+
+def _build_segment(store, start, stop):
+    """Сегмент инвертированного индекса для строк хранилища [start, stop).
+
+    Токенизируются только уникальные значения словаря, затем пары
+    (токен, значение) разворачиваются в строки через коды колонки.
+    Результат - CSR: отсортированный словарь токенов, offsets и номера строк.
+    """
+    size = stop - start
+    pair_parts = []
+    length_parts = []
+    row_parts = []
+    for col in INDEX_COLUMNS:
+        codes = np.asarray(store.codes[col][start:stop])
+        counts = np.bincount(codes, minlength=len(store.dictionaries[col]))
+        used = np.flatnonzero(counts)
+        tokens = pd.Series(store.dictionaries[col][used]).str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+        if tokens.empty:
+            continue
+        pair_codes = used[tokens.index.to_numpy()]
+        pair_tokens = tokens.to_numpy(dtype=object)
+
+        # Строки каждого значения лежат подряд в порядке сортировки кодов
+        order = np.argsort(codes, kind='stable')
+        starts = np.cumsum(counts) - counts
+        lengths = counts[pair_codes]
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        pair_parts.append(pair_tokens)
+        length_parts.append(lengths)
+        row_parts.append(order[np.repeat(starts[pair_codes], lengths) + within])
+
+    if not pair_parts:
+        return {'vocab': np.array([], dtype=str), 'offsets': np.zeros(1, dtype=np.int64), 'postings': np.array([], dtype=np.int64)}
+
+    # Словарь строится по парам уникальных значений, на строки размножаются только номера
+    pair_ids, vocab = pd.factorize(np.concatenate(pair_parts), sort=True)
+    token_ids = np.repeat(pair_ids.astype(np.int64), np.concatenate(length_parts))
+    keys = np.sort(token_ids * size + np.concatenate(row_parts))
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    offsets = np.searchsorted(keys // size, np.arange(len(vocab) + 1))
+    return {
+        'vocab': np.asarray(vocab, dtype=str),
+        'offsets': offsets.astype(np.int64),
+        'postings': keys % size + start
+    }
+
+
+class TextIndex:
+    """Инвертированный индекс по комментариям и описаниям проектов.
+
+    Хранится сегментами рядом с хранилищем записей: новые записи добавляют
+    новый сегмент, старые не перестраиваются. Сегменты покрывают
+    возрастающие диапазоны строк, поэтому результаты просто склеиваются.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.rows = json.load(f)['rows']
+        self.segments = []
+        for seg_path in sorted(glob.glob(os.path.join(path, 'segment_*.npz'))):
+            with np.load(seg_path) as seg:
+                self.segments.append({key: seg[key] for key in seg.files})
+
+    @staticmethod
+    def index_path(store):
+        return os.path.join(store.path, 'text_index')
+
+    @classmethod
+    def open(cls, store):
+        """Открыть индекс хранилища или вернуть None"""
+        path = cls.index_path(store)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        return cls(path)
+
+    @classmethod
+    def update(cls, store):
+        """Привести индекс в соответствие с хранилищем.
+
+        Индексируются только строки, добавленные после прошлого обновления;
+        при превышении MAX_SEGMENTS индекс пересобирается одним сегментом.
+        """
+        path = cls.index_path(store)
+        index = cls.open(store)
+        if index is not None and index.rows == len(store):
+            return index
+        if index is None or index.rows > len(store) or len(index.segments) >= MAX_SEGMENTS:
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            start = 0
+        else:
+            start = index.rows
+        segment_no = len(glob.glob(os.path.join(path, 'segment_*.npz')))
+        np.savez(os.path.join(path, f'segment_{segment_no:05d}.npz'), **_build_segment(store, start, len(store)))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(store)}, f)
+        return cls(path)
+
+    @staticmethod
+    def _lookup(segment, token, prefix):
+        """Строки сегмента с токеном (или с токенами, начинающимися с token)"""
+        vocab = segment['vocab']
+        lo = np.searchsorted(vocab, token, side='left')
+        if prefix:
+            hi = np.searchsorted(vocab, token + '\uffff', side='left')
+        else:
+            hi = lo + 1 if lo < len(vocab) and vocab[lo] == token else lo
+        postings = segment['postings'][segment['offsets'][lo]:segment['offsets'][hi]]
+        if hi - lo <= 1:
+            return postings
+        postings = np.sort(postings)
+        return postings[np.concatenate([[True], postings[1:] != postings[:-1]])]
+
+    def search(self, query):
+        """Номера строк, содержащих все слова запроса (последнее - как префикс)"""
+        tokens = tokenize(query)
+        if not tokens:
+            return np.arange(self.rows)
+        parts = []
+        for segment in self.segments:
+            rows = None
+            for i, token in enumerate(tokens):
+                found = self._lookup(segment, token, prefix=i == len(tokens) - 1)
+                rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+                if len(rows) == 0:
+                    break
+            parts.append(rows)
+        return np.concatenate(parts) if parts else np.array([], dtype=np.int64)
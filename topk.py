@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def top_k_positions(values, k):
+    """Позиции k наибольших значений по убыванию.
+
+    Частичная выборка через np.partition вместо полной сортировки: O(N + k log k).
+    При равных значениях порядок определяется позицией строки, поэтому
+    соседние страницы не пересекаются и ничего не теряют.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    k = max(0, min(int(k), n))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        kth = np.partition(values, n - k)[n - k]
+        above = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[:k - len(above)]
+        positions = np.concatenate([above, ties])
+    else:
+        positions = np.arange(n)
+    order = np.lexsort((positions, -values[positions]))
+    return positions[order]
+
+
+def top_k(totals, k, value='Hours'):
+    """Топ-k строк предагрегированной таблицы по убыванию value"""
+    return totals.iloc[top_k_positions(totals[value].to_numpy(), k)]
+
+
+def page(totals, page_no, page_size, value='Hours'):
+    """Страница page_no (с нуля) списка, отсортированного по убыванию value.
+
+    Отбираются только первые (page_no + 1) * page_size строк, остальные не сортируются.
+    """
+    start = page_no * page_size
+    positions = top_k_positions(totals[value].to_numpy(), start + page_size)
+    return totals.iloc[positions[start:]]
+
+
+def page_count(totals, page_size):
+    """Количество страниц размера page_size"""
+    return max(1, -(-len(totals) // page_size))
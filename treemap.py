@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from filters import MIXED_VALUE
+
+ROOT_ID = 'root'
+ROOT_LABEL = 'Все'
+OTHER_LABEL = 'Другие'
+# Сколько крупнейших детей остается у узла, остальные сворачиваются в "Другие"
+MAX_CHILDREN = 20
+
+
+def _first_rows(codes, size):
+    """Номер первой строки для каждого кода"""
+    first = np.zeros(size, dtype=np.intp)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    return first
+
+
+def build_hierarchy(df, levels, keys=None, value='Hours', max_children=MAX_CHILDREN):
+    """Узлы go.Treemap: массивы ids, labels, parents, values, colors и customdata.
+
+    levels - колонки подписей уровней, keys - колонки значений этих уровней
+    (по умолчанию те же). Пути листьев сворачиваются по целочисленным кодам
+    уровней, каждый уровень считается одной группировкой уже свернутых путей.
+    У родителя остается не больше max_children крупнейших детей, остальные
+    объединяются в узел "Другие" без детализации. Цвет листа - его часы,
+    цвет родителя - среднее часов его листьев с весом часов, как у
+    px.treemap(color=value) по таблице с одной строкой на лист (от того,
+    на сколько строк разбит лист во входной таблице, цвет не зависит).
+
+    customdata узла - значения keys по его пути; глубже узла стоит MIXED_VALUE,
+    у узла "Другие" на его уровне - список свернутых значений.
+    """
+    keys = keys or levels
+    depths = list(range(len(levels)))
+    uniques, labels, columns = [], [], {}
+    for depth, key, label in zip(depths, keys, levels):
+        codes, values = pd.factorize(df[key])
+        uniques.append(np.asarray(values, dtype=object))
+        labels.append(df[label].to_numpy(dtype=object)[_first_rows(codes, len(values))])
+        columns[depth] = codes
+    paths = pd.DataFrame(columns).assign(value=df[value].to_numpy(dtype=np.float64))
+    paths = paths.groupby(depths, sort=False)['value'].sum().reset_index()
+    # Квадрат - уже свернутого листа: сумма квадратов отдельных строк дала бы цвет по строкам входа
+    paths['square'] = paths['value'] ** 2
+
+    total = paths['value'].sum()
+    nodes = [pd.DataFrame({
+        'id': [ROOT_ID], 'label': [ROOT_LABEL], 'parent': [''],
+        'value': [total], 'square': [paths['square'].sum()]
+    })]
+    paths['parent'] = ROOT_ID
+    for depth in depths:
+        prefix = depths[:depth + 1]
+        level = paths.groupby(['parent'] + prefix, sort=False)[['value', 'square']].sum().reset_index()
+        level = level.sort_values('value', ascending=False, kind='stable')
+        kept = level.groupby('parent', sort=False).cumcount().to_numpy() < max_children
+
+        shown = level[kept].copy()
+        shown['id'] = shown['parent'] + '/' + shown[depth].astype(str)
+        shown['label'] = labels[depth][shown[depth].to_numpy()]
+        for i in prefix:
+            shown[f'key_{i}'] = uniques[i][shown[i].to_numpy()]
+        nodes.append(shown)
+
+        folded = level[~kept]
+        if len(folded):
+            grouped = folded.groupby('parent', sort=False)
+            other = grouped[['value', 'square']].sum().join(grouped[prefix].first()).reset_index()
+            other['id'] = other['parent'] + '/' + OTHER_LABEL
+            other['label'] = OTHER_LABEL
+            for i in prefix[:-1]:
+                other[f'key_{i}'] = uniques[i][other[i].to_numpy()]
+            other[f'key_{depth}'] = [list(uniques[depth][codes]) for codes in grouped[depth].agg(list).loc[other['parent']]]
+            nodes.append(other)
+
+        # Детализация продолжается только у показанных узлов
+        paths = paths.merge(shown[['parent', depth, 'id']], on=['parent', depth])
+        paths['parent'] = paths.pop('id')
+
+    nodes = pd.concat(nodes, ignore_index=True)
+    values = nodes['value'].to_numpy()
+    customdata = np.empty((len(nodes), len(keys)), dtype=object)
+    for depth in depths:
+        column = nodes.get(f'key_{depth}', pd.Series(np.nan, index=nodes.index))
+        customdata[:, depth] = column.where(column.notna(), MIXED_VALUE).to_numpy(dtype=object)
+    return {
+        'ids': nodes['id'].to_numpy(dtype=object),
+        'labels': nodes['label'].to_numpy(dtype=object),
+        'parents': nodes['parent'].to_numpy(dtype=object),
+        'values': values,
+        'colors': np.divide(nodes['square'].to_numpy(), values, out=np.zeros(len(values)), where=values > 0),
+        'customdata': customdata
+    }
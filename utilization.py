@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Проекты без выставления счета клиенту: с этим описанием в выгрузке и перечисленные
+# через запятую в KMGA_NON_CHARGEABLE (номера проектов)
+NON_CHARGEABLE_DESCRIPTION = os.environ.get('KMGA_NON_CHARGEABLE_DESCRIPTION', 'NON-CHARGEABLE')
+NON_CHARGEABLE_PROJECTS = [p.strip() for p in os.environ.get('KMGA_NON_CHARGEABLE', '').split(',') if p.strip()]
+# Активности, считающиеся административными, на любом проекте
+ADMIN_ACTIVITIES = ['Administration']
+# Норма часов сотрудника за период данных (по умолчанию - месяц по 8 ч)
+CAPACITY_HOURS = float(os.environ.get('KMGA_CAPACITY_HOURS', 168))
+
+# Ключи итогов, по которым считается загрузка
+UTILIZATION_KEYS = ['Employee', 'Project_No', 'Project_Description', 'Activity']
+UTILIZATION_COLUMNS = ['Employee', 'Hours', 'Chargeable_Hours', 'Non_Chargeable_Hours', 'Admin_Hours',
+                       'Chargeable_Ratio', 'Admin_Share', 'Capacity', 'Utilization', 'Chargeable_Utilization']
+
+
+def _codes_of(dictionary, values):
+    """Маска кодов словаря хранилища, значения которых входят в values"""
+    return np.isin(dictionary, list(values))
+
+
+def _non_chargeable(projects, descriptions, non_chargeable, description):
+    """Маска проектов без счета: номер в списке или описание-признак (без учета регистра)"""
+    descriptions = pd.Series(descriptions, dtype=object).str.upper().to_numpy()
+    return np.isin(projects, list(non_chargeable)) | (descriptions == description.upper())
+
+
+def utilization(rollups, rows=None, capacity=CAPACITY_HOURS, non_chargeable=NON_CHARGEABLE_PROJECTS,
+                non_chargeable_description=NON_CHARGEABLE_DESCRIPTION, admin_activities=ADMIN_ACTIVITIES):
+    """Загрузка всех сотрудников за один проход по итогам путей.
+
+    rows - позиции путей rollups (например, выбранные фильтрами); часы
+    раскладываются по сотрудникам одним bincount на показатель. Доли - к
+    часам сотрудника, загрузка - к норме capacity. Сортировка - по сотруднику.
+    """
+    dictionaries = rollups.store.dictionaries
+    if rows is None:
+        rows = np.arange(len(rollups))
+    rows = np.asarray(rows)
+    employee_codes = rollups.codes['Employee'][rows]
+    chargeable = ~_non_chargeable(
+        dictionaries['Project_No'][rollups.codes['Project_No'][rows]],
+        dictionaries['Project_Description'][rollups.codes['Project_Description'][rows]],
+        non_chargeable, non_chargeable_description
+    )
+    admin = _codes_of(dictionaries['Activity'], admin_activities)[rollups.codes['Activity'][rows]]
+    employees, group = np.unique(employee_codes, return_inverse=True)
+    return _employee_table(dictionaries['Employee'][employees], group, rollups.hours[rows], chargeable, admin, capacity)
+
+
+def utilization_totals(totals, capacity=CAPACITY_HOURS, non_chargeable=NON_CHARGEABLE_PROJECTS,
+                       non_chargeable_description=NON_CHARGEABLE_DESCRIPTION, admin_activities=ADMIN_ACTIVITIES):
+    """Загрузка сотрудников по итогам UTILIZATION_KEYS (например, из встроенной базы)"""
+    chargeable = ~_non_chargeable(
+        totals['Project_No'].to_numpy(dtype=object), totals['Project_Description'].to_numpy(dtype=object),
+        non_chargeable, non_chargeable_description
+    )
+    admin = totals['Activity'].isin(list(admin_activities)).to_numpy()
+    employees, group = np.unique(totals['Employee'].to_numpy(dtype=object), return_inverse=True)
+    return _employee_table(employees, group, totals['Hours'].to_numpy(dtype=np.float64), chargeable, admin, capacity)
+
+
+def _employee_table(employees, group, hours, chargeable, admin, capacity):
+    """Показатели сотрудников: group - номер сотрудника для каждой строки часов"""
+    n = len(employees)
+    total = np.bincount(group, weights=hours, minlength=n)
+    chargeable_hours = np.bincount(group, weights=hours * chargeable, minlength=n)
+    admin_hours = np.bincount(group, weights=hours * admin, minlength=n)
+    # Доли сотрудника без часов - 0, а не деление на ноль
+    safe_total = np.where(total > 0, total, 1)
+
+    result = pd.DataFrame({
+        'Employee': employees,
+        'Hours': total,
+        'Chargeable_Hours': chargeable_hours,
+        'Non_Chargeable_Hours': total - chargeable_hours,
+        'Admin_Hours': admin_hours,
+        'Chargeable_Ratio': np.where(total > 0, chargeable_hours / safe_total, 0.0),
+        'Admin_Share': np.where(total > 0, admin_hours / safe_total, 0.0),
+        'Capacity': float(capacity)
+    })
+    result['Utilization'] = result['Hours'] / capacity if capacity > 0 else np.nan
+    result['Chargeable_Utilization'] = result['Chargeable_Hours'] / capacity if capacity > 0 else np.nan
+    return result.sort_values('Employee').reset_index(drop=True)[UTILIZATION_COLUMNS]
+
+
+def team_summary(table):
+    """Показатели команды: доли считаются по сумме часов, а не как среднее долей"""
+    hours = table['Hours'].sum()
+    capacity = table['Capacity'].sum()
+    return {
+        'employees': len(table),
+        'hours': hours,
+        'chargeable_ratio': table['Chargeable_Hours'].sum() / hours if hours > 0 else 0.0,
+        'admin_share': table['Admin_Hours'].sum() / hours if hours > 0 else 0.0,
+        'utilization': hours / capacity if capacity > 0 else 0.0,
+        'over_capacity': int((table['Hours'] > table['Capacity']).sum())
+    }
@@ -0,0 +1,152 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# Схема записи табеля
+REQUIRED_COLUMNS = ['Employee', 'Client', 'Project_No', 'Activity']
+TEXT_COLUMNS = ['Employee', 'Client', 'Project_No', 'Activity', 'Project_Description', 'Staff_Comment']
+RECORD_COLUMNS = TEXT_COLUMNS + ['Hours']
+# Колонки, в которых написание приводится к единому регистру
+CANONICAL_CASE_COLUMNS = ['Employee', 'Client', 'Activity', 'Project_Description']
+MAX_HOURS = 24
+
+# Служебная колонка для элементов выгрузки, которые не являются объектами
+RAW_COLUMN = '_Raw'
+QUARANTINE_PATH = 'quarantine.csv'
+# Замена нехешируемых значений текстовых полей перед factorize: не строка, поэтому уходит в карантин
+NESTED_VALUE = object()
+
+
+def _normalize_text(values):
+    """Пробелы по краям убираются, внутренние схлопываются в один"""
+    return values.str.strip().str.replace(r'\s+', ' ', regex=True)
+
+
+def _canonical_case(values, counts):
+    """Варианты написания, отличающиеся только регистром, заменяются самым частым"""
+    spellings = pd.DataFrame({'key': values.str.casefold(), 'value': values, 'count': counts})
+    totals = spellings.groupby(['key', 'value'], sort=False)['count'].sum().reset_index()
+    canonical = totals.sort_values('count', ascending=False, kind='stable').drop_duplicates('key')
+    return spellings['key'].map(canonical.set_index('key')['value'])
+
+
+def _factorize(values):
+    """factorize колонки; списки и словари (вложенный JSON) не хешируются и заменяются маркером не-текста"""
+    try:
+        return pd.factorize(values)
+    except TypeError:
+        nested = np.array([isinstance(v, (list, dict)) for v in values], dtype=bool)
+        return pd.factorize(values.mask(nested, NESTED_VALUE))
+
+
+def _is_bool(values, numbers):
+    """Маска логических значений: pd.to_numeric принимает True за 1 (проверяются только строки с 0 и 1)"""
+    if pd.api.types.is_bool_dtype(values):
+        return np.ones(len(values), dtype=bool)
+    mask = np.zeros(len(values), dtype=bool)
+    if values.dtype == object:
+        candidates = np.flatnonzero((numbers == 0) | (numbers == 1))
+        mask[candidates] = [isinstance(v, (bool, np.bool_)) for v in values.to_numpy()[candidates]]
+    return mask
+
+
+def validate(df):
+    """Проверка и нормализация записей выгрузки.
+
+    Все проверки векторные: каждая дает маску нарушений, причины собираются
+    только для отклоненных строк. Текст нормализуется по уникальным значениям
+    колонки и разносится по строкам через коды factorize. Возвращает
+    (очищенные записи, отклоненные записи с колонками Row и Reason).
+    """
+    df = df.reset_index(drop=True)
+    n = len(df)
+    checks = []
+
+    not_object = df[RAW_COLUMN].notna().to_numpy() if RAW_COLUMN in df.columns else np.zeros(n, dtype=bool)
+    checks.append((not_object, 'запись не является объектом'))
+
+    clean = pd.DataFrame(index=df.index)
+    for col in TEXT_COLUMNS:
+        if col not in df.columns:
+            codes, uniques = np.full(n, -1, dtype=np.intp), pd.Index([], dtype=object)
+        else:
+            codes, uniques = _factorize(df[col])
+        is_text = np.array([isinstance(v, str) for v in uniques], dtype=bool)
+        values = _normalize_text(pd.Series(np.where(is_text, uniques.astype(object), ''), dtype='string'))
+        if col == 'Project_No':
+            values = values.str.upper()
+        if col in CANONICAL_CASE_COLUMNS:
+            values = _canonical_case(values, np.bincount(codes[codes >= 0], minlength=len(uniques)))
+
+        # Позиция -1 (пропуск) указывает на дополнительный элемент в конце
+        row_text = np.append(is_text, False)[codes]
+        missing = codes < 0
+        checks.append((~missing & ~row_text, f'{col}: неверный тип'))
+        if col in REQUIRED_COLUMNS:
+            empty = np.append((values == '').to_numpy(dtype=bool), True)[codes]
+            checks.append((missing | (row_text & empty), f'нет {col}'))
+        clean[col] = np.append(values.to_numpy(dtype=object), '')[codes]
+
+    hours_raw = df['Hours'] if 'Hours' in df.columns else pd.Series([None] * n, index=df.index, dtype=object)
+    hours = pd.to_numeric(hours_raw, errors='coerce')
+    hours_missing = hours_raw.isna().to_numpy()
+    hours_values = hours.to_numpy(dtype=np.float64, na_value=np.nan)
+    hours_bool = _is_bool(hours_raw, hours_values)
+    hours_values = np.where(hours_bool, np.nan, hours_values)
+    checks.append((hours_missing, 'нет Hours'))
+    checks.append((hours_bool, 'Hours: неверный тип'))
+    checks.append((~hours_missing & ~hours_bool & np.isnan(hours_values), 'Hours: не число'))
+    checks.append((hours_values <= 0, 'Hours <= 0'))
+    checks.append((hours_values > MAX_HOURS, f'Hours > {MAX_HOURS}'))
+    clean['Hours'] = hours
+
+    failed = np.column_stack([mask for mask, _ in checks])
+    # Для не-объектов остальные причины не информативны
+    failed[not_object, 1:] = False
+    rejected_mask = failed.any(axis=1)
+    messages = np.array([message for _, message in checks], dtype=object)
+
+    rejected = df[rejected_mask].copy()
+    rejected.insert(0, 'Row', np.flatnonzero(rejected_mask))
+    rejected['Reason'] = ['; '.join(messages[row]) for row in failed[rejected_mask]]
+
+    clean = clean[~rejected_mask].reset_index(drop=True)
+    clean[TEXT_COLUMNS] = clean[TEXT_COLUMNS].astype(str)
+    if pd.api.types.is_float_dtype(clean['Hours']) and (clean['Hours'] % 1 == 0).all():
+        clean['Hours'] = clean['Hours'].astype(np.int64)
+    return clean, rejected.reset_index(drop=True)
+
+
+def write_quarantine(rejected, path=QUARANTINE_PATH):
+    """Сохранение отклоненных записей с причинами (файл перезаписывается при каждой загрузке)"""
+    rejected.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def benchmark(rows, bad_share=0.01, seed=0):
+    """Пропускная способность validate() на синтетической выгрузке, строк/с"""
+    from ingest import read_records
+
+    rng = np.random.default_rng(seed)
+    sample = read_records()
+    df = sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+    df['Hours'] = df['Hours'].astype(object)
+    bad = rng.random(rows) < bad_share
+    df.loc[bad, 'Hours'] = 'n/a'
+    df.loc[rng.random(rows) < bad_share, 'Employee'] = None
+
+    started = time.perf_counter()
+    clean, rejected = validate(df)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {rows:,} строк за {elapsed:.2f} с: {rows / elapsed:,.0f} строк/с "
+          f"(принято {len(clean):,}, отклонено {len(rejected):,})")
+    return rows / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк проверки записей табеля")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="размер синтетической выгрузки")
+    parser.add_argument('--bad-share', type=float, default=0.01, help="доля испорченных записей")
+    args = parser.parse_args()
+    benchmark(args.rows, args.bad_share)
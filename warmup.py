@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from perflog import get_logger
+
+logger = get_logger('warmup')
+
+# Сколько раз за прогрев писать прогресс
+PROGRESS_STEPS = 10
+THREAD_PREFIX = 'kmga-warmup'
+
+
+def quiet(logger_name):
+    """Не писать в логгер logger_name сообщения из потоков прогрева
+    (например, предупреждения Streamlit о вызове кеша вне сессии)"""
+    logging.getLogger(logger_name).addFilter(lambda record: not record.threadName.startswith(THREAD_PREFIX))
+
+
+class Warmup:
+    """Фоновый прогрев кешей на пуле потоков.
+
+    Задача - (вид, функция, аргументы): функция - кешируемый загрузчик,
+    ее результат не нужен, важно только заполнить кеш. Задачи выполняются
+    в порядке списка, поэтому самые частые виды ставятся первыми. Прогресс
+    и покрытие по видам пишутся в лог kmga.warmup.
+    """
+
+    def __init__(self, tasks, workers=2, name='Прогрев'):
+        self.tasks = list(tasks)
+        self.workers = workers
+        self.name = name
+        self.done = {}
+        self.failed = {}
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not self.tasks or self.workers <= 0:
+            logger.info(f"{self.name}: отключен")
+            return self
+        self.started = time.perf_counter()
+        logger.info(f"{self.name}: {len(self.tasks)} задач на {self.workers} потоках")
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=THREAD_PREFIX)
+        for view, fn, args in self.tasks:
+            pool.submit(self._run, view, fn, args)
+        # Потоки доработают очередь сами, запуск не ждет их
+        pool.shutdown(wait=False)
+        return self
+
+    def _run(self, view, fn, args):
+        try:
+            fn(*args)
+            ok = True
+        except Exception:
+            logger.exception(f"{self.name}: ошибка в задаче {view}")
+            ok = False
+        with self._lock:
+            counts = self.done if ok else self.failed
+            counts[view] = counts.get(view, 0) + 1
+            completed = sum(self.done.values()) + sum(self.failed.values())
+            step = max(1, len(self.tasks) // PROGRESS_STEPS)
+            if completed % step == 0 and completed < len(self.tasks):
+                logger.info(f"{self.name}: {completed}/{len(self.tasks)} "
+                            f"({completed / len(self.tasks):.0%}) за {time.perf_counter() - self.started:.1f} с")
+            if completed == len(self.tasks):
+                self.finished = time.perf_counter()
+                logger.info(f"{self.name}: завершен за {self.finished - self.started:.1f} с, покрытие: " + self.coverage())
+
+    def coverage(self):
+        """Доля закешированных задач по видам, например 'проекты 17/17'"""
+        totals = {}
+        for view, _, _ in self.tasks:
+            totals[view] = totals.get(view, 0) + 1
+        parts = [f"{view} {self.done.get(view, 0)}/{total}" for view, total in totals.items()]
+        errors = sum(self.failed.values())
+        return ', '.join(parts) + (f", ошибок {errors}" if errors else '')